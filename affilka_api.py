@@ -1,46 +1,226 @@
 """
 Модуль для работы с Affilka API
 """
+import json
+import time
+import threading
 import requests
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from datetime import datetime, timedelta
 import logging
-from config import AFFILKA_API_ENDPOINT, AFFILKA_MAP
+from config import (
+    AFFILKA_API_ENDPOINT, AFFILKA_MAP, HTTP_CACHE_ENABLED,
+    AFFILKA_ATTRIBUTES_TTL_MINUTES, AFFILKA_COLUMN_VALIDATION, PERSISTED_REPORT_COLUMNS,
+    AFFILKA_JSON_BACKEND, AFFILKA_KEEP_DEBUG_FIELDS,
+)
+from http_cache import ResponseCache
+from transport import create_transport, BaseTransport
+from clickid_codes import get_clickid_table
+from records import ClickRecord
+from reject_sink import RejectSink
 
 logger = logging.getLogger(__name__)
 
+# Порядок выбора JSON-библиотеки в режиме auto (от быстрой к стандартной)
+JSON_BACKENDS = ['orjson', 'ujson', 'json']
+
+
+def load_json_backend(name: str = 'auto', quiet: bool = False) -> Tuple[str, Callable[[Any], Any]]:
+    """
+    Выбирает функцию декодирования JSON
+    
+    Args:
+        name: 'auto' (первая установленная из JSON_BACKENDS), 'orjson', 'ujson' или 'json'
+        quiet: Не предупреждать, если запрошенная библиотека не установлена
+    
+    Returns:
+        (имя библиотеки, функция loads, принимающая bytes или str)
+    """
+    candidates = JSON_BACKENDS if name == 'auto' else [name]
+    for candidate in candidates:
+        if candidate == 'orjson':
+            try:
+                import orjson
+                return 'orjson', orjson.loads
+            except ImportError:
+                pass
+        elif candidate == 'ujson':
+            try:
+                import ujson
+                return 'ujson', ujson.loads
+            except ImportError:
+                pass
+        elif candidate == 'json':
+            return 'json', json.loads
+    if not quiet:
+        logger.warning(f"JSON-библиотека {name} не установлена, используем стандартный json")
+    return 'json', json.loads
+
+
+# Декодер ответов API (AFFILKA_JSON_BACKEND); строки отчета - миллионы мелких объектов,
+# поэтому быстрая библиотека заметно сокращает время декодирования больших отчетов
+JSON_BACKEND_NAME, json_loads = load_json_backend(AFFILKA_JSON_BACKEND)
+
+# Кеш ответа /report/attributes: base_url -> (время получения, ответ).
+# Общий для всех экземпляров AffilkaAPI с одним base_url
+_attributes_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_attributes_lock = threading.Lock()
+
+
+def _attribute_names(items: Any) -> List[str]:
+    """Имена из списка атрибутов (строки или объекты с name/key)"""
+    names = []
+    for item in items or []:
+        if isinstance(item, str):
+            names.append(item)
+        elif isinstance(item, dict):
+            name = item.get('name') or item.get('key') or item.get('id')
+            if name:
+                names.append(str(name))
+    return names
+
 
 class AffilkaAPI:
     """Класс для работы с Affilka API"""
     
-    def __init__(self, token: str, base_url: str):
+    def __init__(
+        self,
+        token: str,
+        base_url: str,
+        cache: Optional[ResponseCache] = None,
+        transport: Optional[BaseTransport] = None
+    ):
         """
         Args:
             token: Токен для авторизации
             base_url: Базовый URL API
+            cache: Дисковый кеш ответов (по умолчанию создается, если HTTP_CACHE_ENABLED)
+            transport: HTTP-транспорт (по умолчанию по настройкам AFFILKA_HTTP_*)
         """
         self.token = token
         self.base_url = base_url
         self.endpoint = AFFILKA_API_ENDPOINT
-        self.session = requests.Session()
-        self.session.headers.update({
+        if cache is None and HTTP_CACHE_ENABLED:
+            cache = ResponseCache()
+        self.cache = cache
+        # Таймауты, пул соединений, сжатие, HTTP/2 и замеры времени запросов - в transport.py
+        self.session = transport or create_transport({
             'Accept': 'application/json',
             'Content-Type': 'application/json',
             'Authorization': token,
-            'Version': 'HTTP/1.0'
         })
     
-    def get_available_columns(self) -> Optional[List[str]]:
-        """Получает список доступных колонок из API"""
+    def get_report_attributes(self, force_refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Получает атрибуты отчета (/report/attributes) с кешированием на base_url
+        
+        Args:
+            force_refresh: Игнорировать кеш и запросить заново
+        
+        Returns:
+            Ответ attributes (available_columns, available_groupers, ...) или None при ошибке
+        """
+        ttl = AFFILKA_ATTRIBUTES_TTL_MINUTES * 60
+        if not force_refresh:
+            with _attributes_lock:
+                cached = _attributes_cache.get(self.base_url)
+            if cached and time.monotonic() - cached[0] < ttl:
+                return cached[1]
+        
         try:
             url = f"{self.base_url}/api/customer/v1/partner/report/attributes"
             response = self.session.get(url)
             response.raise_for_status()
-            data = response.json()
-            return data.get('available_columns', [])
+            data = json_loads(response.content)
         except Exception as e:
-            logger.error(f"Ошибка при получении доступных колонок: {e}")
+            logger.error(f"Ошибка при получении атрибутов отчета: {e}")
+            return None
+        
+        with _attributes_lock:
+            _attributes_cache[self.base_url] = (time.monotonic(), data)
+        return data
+    
+    def get_available_columns(self) -> Optional[List[str]]:
+        """Получает список доступных колонок из API (с кешированием)"""
+        data = self.get_report_attributes()
+        if data is None:
+            logger.error("Ошибка при получении доступных колонок")
             return None
+        return data.get('available_columns', [])
+    
+    def get_available_groupers(self) -> Optional[List[str]]:
+        """Получает список доступных группировок из API (с кешированием), None если API их не сообщает"""
+        data = self.get_report_attributes()
+        if data is None or 'available_groupers' not in data:
+            return None
+        return _attribute_names(data.get('available_groupers'))
+    
+    @staticmethod
+    def project_columns(columns: Optional[List[str]]) -> List[str]:
+        """
+        Оставляет только колонки, которые сохраняются в БД (PERSISTED_REPORT_COLUMNS)
+        
+        Args:
+            columns: Запрошенные колонки (None - все сохраняемые)
+        """
+        if columns is None:
+            return list(PERSISTED_REPORT_COLUMNS)
+        projected = [col for col in columns if col in PERSISTED_REPORT_COLUMNS]
+        dropped = [col for col in columns if col not in PERSISTED_REPORT_COLUMNS]
+        if dropped:
+            logger.info(f"Колонки не сохраняются в БД и не запрашиваются: {', '.join(dropped)}")
+        return projected
+    
+    def validate_request(
+        self,
+        columns: List[str],
+        group_by: List[str],
+        mode: Optional[str] = None
+    ) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Проверяет columns/group_by по атрибутам отчета до запроса
+        
+        Неподдерживаемые колонки удаляются (mode='trim') или запрос отклоняется (mode='reject').
+        Неподдерживаемая группировка всегда отклоняет запрос: без нее меняется смысл отчета.
+        Группировки dynamic_tag_* не проверяются - они задаются в настройках партнерки.
+        Если атрибуты получить не удалось, запрос пропускается без проверки.
+        
+        Returns:
+            (columns, group_by) для запроса или None, если запрос отклонен
+        """
+        mode = mode or AFFILKA_COLUMN_VALIDATION
+        if mode == 'off':
+            return columns, group_by
+        
+        attributes = self.get_report_attributes()
+        if attributes is None:
+            return columns, group_by
+        
+        if 'available_columns' in attributes:
+            available_columns = set(_attribute_names(attributes.get('available_columns')))
+            unsupported = [col for col in columns if col not in available_columns] if available_columns else []
+            if unsupported:
+                if mode == 'reject':
+                    logger.error(f"Колонки не поддерживаются API {self.base_url}: {', '.join(unsupported)}. Запрос не отправлен")
+                    return None
+                logger.warning(f"Колонки не поддерживаются API {self.base_url} и исключены из запроса: {', '.join(unsupported)}")
+                columns = [col for col in columns if col in available_columns]
+                if not columns:
+                    logger.error("После исключения неподдерживаемых колонок запрашивать нечего")
+                    return None
+        
+        groupers = self.get_available_groupers()
+        if groupers is not None:
+            available_groupers = set(groupers)
+            unsupported = [
+                g for g in group_by
+                if g not in available_groupers and not g.startswith('dynamic_tag_')
+            ]
+            if unsupported:
+                logger.error(f"Группировки не поддерживаются API {self.base_url}: {', '.join(unsupported)}. Запрос не отправлен")
+                return None
+        
+        return columns, group_by
     
     def fetch_report(
         self,
@@ -81,6 +261,12 @@ class AffilkaAPI:
             # Приоритет: visit_id > sub_id > click_id > campaign
             group_by = ['day', 'dynamic_tag_visit_id']
         
+        # Проверяем колонки и группировку до запроса, чтобы не тратить запрос отчета впустую
+        validated = self.validate_request(columns, group_by)
+        if validated is None:
+            return None
+        columns, group_by = validated
+        
         try:
             url = f"{self.base_url}{self.endpoint}"
             
@@ -106,13 +292,40 @@ class AffilkaAPI:
             if group_by:
                 params['group_by[]'] = group_by
             
-            logger.info(f"Запрос к API: {url} с параметрами {params}")
-            response = self.session.get(url, params=params)
+            # Кеш ответов (асинхронные отчеты не кешируем)
+            cache_key = None
+            cache_ttl = None
+            request_headers = {}
+            if self.cache is not None and not async_mode:
+                cache_key = self.cache.make_key(self.base_url, self.token, self.endpoint, params)
+                cache_ttl = self.cache.ttl_for(params)
+                cached_body = self.cache.get(cache_key)
+                if cached_body is not None:
+                    return json_loads(cached_body)
+                request_headers = self.cache.conditional_headers(cache_key)
+            
+            logger.info(
+                f"Запрос к API: {url} ({from_date} - {to_date}, колонок: {len(columns or [])}, "
+                f"group_by: {','.join(group_by or [])}, валюта: {conversion_currency or '-'})"
+            )
+            logger.debug(f"Параметры запроса: {params}")
+            response = self.session.get(url, params=params, headers=request_headers)
+            
+            if response.status_code == 304 and cache_key is not None:
+                cached_body = self.cache.revalidate(cache_key, cache_ttl)
+                if cached_body is not None:
+                    return json_loads(cached_body)
+                # Запись пропала из кеша между запросами - повторяем безусловный запрос
+                response = self.session.get(url, params=params)
+            
             response.raise_for_status()
             
-            data = response.json()
+            data = json_loads(response.content)
             logger.info(f"Получен ответ от API, тип отчета: {data.get('report_type')}")
             
+            if cache_key is not None:
+                self.cache.put(cache_key, response.content, response.headers, cache_ttl, url=response.url)
+            
             return data
             
         except requests.exceptions.RequestException as e:
@@ -120,17 +333,31 @@ class AffilkaAPI:
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Ответ сервера: {e.response.text}")
             return None
+        except ValueError as e:
+            # Некорректный JSON в ответе (ошибки декодирования orjson/ujson/json - подклассы ValueError)
+            logger.error(f"Не удалось декодировать ответ API ({JSON_BACKEND_NAME}): {e}")
+            return None
     
-    def parse_report_data(self, report_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def parse_report_data(
+        self,
+        report_data: Dict[str, Any],
+        keep_debug_fields: Optional[bool] = None,
+        rejects: Optional[RejectSink] = None
+    ) -> List[ClickRecord]:
         """
         Парсит данные отчета из формата API в формат для БД
         
         Args:
             report_data: Данные отчета от API
+            keep_debug_fields: Сохранять немаппящиеся поля ответа в record.debug
+                (по умолчанию AFFILKA_KEEP_DEBUG_FIELDS)
+            rejects: Учет пропущенных строк (по умолчанию итог пишется в лог после парсинга)
         
         Returns:
-            Список словарей с нормализованными данными
+            Список записей ClickRecord с нормализованными данными
         """
+        if keep_debug_fields is None:
+            keep_debug_fields = AFFILKA_KEEP_DEBUG_FIELDS
         if not report_data or 'rows' not in report_data:
             logger.warning("Отчет не содержит данных rows")
             return []
@@ -140,130 +367,163 @@ class AffilkaAPI:
             logger.warning("Отчет не содержит данных в rows.data")
             return []
         
-        parsed_data = []
+        return parse_report_rows(rows, keep_debug_fields, rejects)
+    
+    def _parse_number(self, value: Any) -> float:
+        """Парсит число из различных форматов"""
+        return parse_number(value)
+
+
+def parse_number(value: Any) -> float:
+    """Парсит число из различных форматов"""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace(',', ''))
+        except:
+            return 0.0
+    if isinstance(value, dict):
+        # Для вложенных объектов с amount
+        amount = value.get('amount') or value.get('amount_cents', 0)
+        return parse_number(amount)
+    return 0.0
+
+
+def parse_report_rows(
+    rows: List[list],
+    keep_debug_fields: bool = False,
+    rejects: Optional[RejectSink] = None,
+    require_clickid: bool = True
+) -> List[ClickRecord]:
+    """
+    Парсит строки rows.data отчета в записи ClickRecord
+    
+    Функция уровня модуля, чтобы ее можно было выполнять в дочерних процессах (см. parallel_parse.py)
+    
+    Args:
+        rows: Строки rows.data (каждая - список объектов {name, value, type})
+        keep_debug_fields: Сохранять немаппящиеся поля ответа в record.debug
+        rejects: Учет пропущенных строк; если не передан, итог пишется в лог в конце парсинга
+        require_clickid: Пропускать строки без clickid (False - для отчетов без группировки
+            по clickid, например итогов по дням для сверки в reconcile.py)
+    """
+    owns_rejects = rejects is None
+    if owns_rejects:
+        rejects = RejectSink('parse')
+    parsed_data = []
+    # Повторяющиеся clickid очищаются один раз и разделяют один объект строки
+    clean_clickid = get_clickid_table().clean
+    
+    for row in rows:
+        # Каждая строка - это массив объектов с name, value, type
+        debug = {} if keep_debug_fields else None
+        record = ClickRecord(debug=debug)
+        clickid = None
+        period_date = None
+        bad_date = False
         
-        for row in rows:
-            # Каждая строка - это массив объектов с name, value, type
-            row_dict = {}
-            clickid = None
-            period_date = None
-            
-            for field in row:
-                field_name = field.get('name')
-                field_value = field.get('value')
-                field_type = field.get('type')
-                
-                if not field_name:
-                    continue
-                
-                # Обработка даты
-                if field_name == 'date':
-                    if isinstance(field_value, str):
-                        # Парсим ISO 8601 дату
-                        try:
-                            dt = datetime.fromisoformat(field_value.replace('Z', '+00:00'))
-                            period_date = dt.date()
-                            row_dict['period_date'] = period_date
-                        except:
-                            logger.warning(f"Не удалось распарсить дату: {field_value}")
-                    elif isinstance(field_value, (datetime,)):
-                        period_date = field_value.date()
-                        row_dict['period_date'] = period_date
-                
-                # Обработка clickid
-                # Приоритет: dynamic_tag_visit_id > dynamic_tag_sub_id > dynamic_tag_click_id > 
-                #            dynamic_tag_subid > visit_id > sub_id > campaign_id > player_id
-                elif field_name in ['dynamic_tag_visit_id', 'dynamic_tag_sub_id', 'dynamic_tag_click_id', 
-                                   'dynamic_tag_subid', 'dynamic_tag_web_id', 'dynamic_tag_webid']:
-                    # Dynamic tags - это то, что нам нужно (visit_id, sub_id и т.д.)
-                    if field_value is not None:
-                        clickid_val = str(field_value).strip()
-                        if clickid_val and clickid_val.lower() not in ['null', 'none', '']:
-                            # Используем первое найденное значение (приоритет по порядку в списке)
-                            if not clickid:
-                                clickid = clickid_val
-                                row_dict['clickid'] = clickid
-                elif field_name in ['visit_id', 'sub_id', 'clickid']:
-                    # Прямые поля для clickid (если API их возвращает напрямую)
-                    if field_value is not None:
-                        clickid_val = str(field_value).strip()
-                        if clickid_val and clickid_val.lower() not in ['null', 'none', '']:
-                            if not clickid:
-                                clickid = clickid_val
-                                row_dict['clickid'] = clickid
-                elif field_name in ['campaign_id', 'campaign']:
-                    # Используем campaign_id как fallback, если нет dynamic_tag
-                    if not clickid and field_value is not None:
-                        clickid = str(field_value)
-                        row_dict['clickid'] = clickid
-                    row_dict['campaign_id'] = field_value
-                elif field_name in ['player_id', 'player']:
-                    # Используем player_id как последний fallback
-                    if not clickid and field_value is not None:
-                        clickid = str(field_value)
-                        row_dict['clickid'] = clickid
-                
-                # Маппинг метрик
-                elif field_name == 'first_deposits_count':
-                    row_dict['ftd'] = self._parse_number(field_value)
-                elif field_name == 'deposits_count':
-                    row_dict['dep_cnt'] = self._parse_number(field_value)
-                elif field_name == 'deposits_sum':
-                    # deposits_sum может быть объектом с currency и amount
-                    if isinstance(field_value, dict):
-                        amount = (field_value.get('amount') or 
-                                 field_value.get('amount_cents') or 
-                                 field_value.get('value') or 0)
-                        row_dict['dep_sum'] = self._parse_number(amount)
-                    else:
-                        row_dict['dep_sum'] = self._parse_number(field_value)
-                elif field_name == 'ngr':
-                    # NGR может быть объектом с currency и amount
-                    if isinstance(field_value, dict):
-                        amount = (field_value.get('amount') or 
-                                 field_value.get('amount_cents') or 
-                                 field_value.get('value') or 0)
-                        row_dict['ngr'] = self._parse_number(amount)
-                    else:
-                        row_dict['ngr'] = self._parse_number(field_value)
-                elif field_name in ['partner_income', 'clean_net_revenue']:
-                    # partner_income может быть объектом с currency и amount
-                    if isinstance(field_value, dict):
-                        # Пробуем разные варианты ключей
-                        amount = (field_value.get('amount') or 
-                                 field_value.get('amount_cents') or 
-                                 field_value.get('value') or 0)
-                        row_dict['cpa'] = self._parse_number(amount)
-                    else:
-                        row_dict['cpa'] = self._parse_number(field_value)
-                
-                # Сохраняем все остальные поля для отладки
-                else:
-                    row_dict[f'_{field_name}'] = field_value
+        for field in row:
+            field_name = field.get('name')
+            field_value = field.get('value')
+            field_type = field.get('type')
             
-            # Валидация: должны быть period_date и clickid
-            if not period_date or not clickid:
-                logger.warning(f"Пропущена строка без period_date или clickid: {row_dict}")
+            if not field_name:
                 continue
             
-            parsed_data.append(row_dict)
+            # Обработка даты
+            if field_name == 'date':
+                if isinstance(field_value, str):
+                    # Парсим ISO 8601 дату
+                    try:
+                        dt = datetime.fromisoformat(field_value.replace('Z', '+00:00'))
+                        period_date = dt.date()
+                        record.period_date = period_date
+                    except ValueError:
+                        bad_date = True
+                elif isinstance(field_value, (datetime,)):
+                    period_date = field_value.date()
+                    record.period_date = period_date
+            
+            # Обработка clickid
+            # Приоритет: dynamic_tag_visit_id > dynamic_tag_sub_id > dynamic_tag_click_id > 
+            #            dynamic_tag_subid > visit_id > sub_id > campaign_id > player_id
+            elif field_name in ['dynamic_tag_visit_id', 'dynamic_tag_sub_id', 'dynamic_tag_click_id', 
+                               'dynamic_tag_subid', 'dynamic_tag_web_id', 'dynamic_tag_webid']:
+                # Dynamic tags - это то, что нам нужно (visit_id, sub_id и т.д.)
+                if not clickid and field_value is not None:
+                    # Используем первое найденное значение (приоритет по порядку в списке)
+                    clickid = clean_clickid(field_value)
+                    if clickid:
+                        record.clickid = clickid
+            elif field_name in ['visit_id', 'sub_id', 'clickid']:
+                # Прямые поля для clickid (если API их возвращает напрямую)
+                if not clickid and field_value is not None:
+                    clickid = clean_clickid(field_value)
+                    if clickid:
+                        record.clickid = clickid
+            elif field_name in ['campaign_id', 'campaign']:
+                # Используем campaign_id как fallback, если нет dynamic_tag
+                if not clickid and field_value is not None:
+                    clickid = str(field_value)
+                    record.clickid = clickid
+                if debug is not None:
+                    debug['campaign_id'] = field_value
+            elif field_name in ['player_id', 'player']:
+                # Используем player_id как последний fallback
+                if not clickid and field_value is not None:
+                    clickid = str(field_value)
+                    record.clickid = clickid
+            
+            # Маппинг метрик
+            elif field_name == 'first_deposits_count':
+                record.ftd = parse_number(field_value)
+            elif field_name == 'deposits_count':
+                record.dep_cnt = parse_number(field_value)
+            elif field_name == 'deposits_sum':
+                # deposits_sum может быть объектом с currency и amount
+                if isinstance(field_value, dict):
+                    amount = (field_value.get('amount') or 
+                             field_value.get('amount_cents') or 
+                             field_value.get('value') or 0)
+                    record.dep_sum = parse_number(amount)
+                else:
+                    record.dep_sum = parse_number(field_value)
+            elif field_name == 'ngr':
+                # NGR может быть объектом с currency и amount
+                if isinstance(field_value, dict):
+                    amount = (field_value.get('amount') or 
+                             field_value.get('amount_cents') or 
+                             field_value.get('value') or 0)
+                    record.ngr = parse_number(amount)
+                else:
+                    record.ngr = parse_number(field_value)
+            elif field_name in ['partner_income', 'clean_net_revenue']:
+                # partner_income может быть объектом с currency и amount
+                if isinstance(field_value, dict):
+                    # Пробуем разные варианты ключей
+                    amount = (field_value.get('amount') or 
+                             field_value.get('amount_cents') or 
+                             field_value.get('value') or 0)
+                    record.cpa = parse_number(amount)
+                else:
+                    record.cpa = parse_number(field_value)
+            
+            # Остальные поля сохраняем для отладки, только если это явно включено
+            elif debug is not None:
+                debug[f'_{field_name}'] = field_value
+        
+        # Валидация: должны быть period_date и clickid
+        if not period_date or (require_clickid and not clickid):
+            # Для выборки сохраняем исходную строку ответа API
+            rejects.reject('bad_date' if bad_date else 'missing_period_date' if not period_date else 'missing_clickid', row)
+            continue
         
-        logger.info(f"Распарсено {len(parsed_data)} записей из отчета")
-        return parsed_data
+        parsed_data.append(record)
     
-    def _parse_number(self, value: Any) -> float:
-        """Парсит число из различных форматов"""
-        if value is None:
-            return 0.0
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            try:
-                return float(value.replace(',', ''))
-            except:
-                return 0.0
-        if isinstance(value, dict):
-            # Для вложенных объектов с amount
-            amount = value.get('amount') or value.get('amount_cents', 0)
-            return self._parse_number(amount)
-        return 0.0
+    logger.info(f"Распарсено {len(parsed_data)} записей из отчета")
+    if owns_rejects:
+        rejects.summary()
+    return parsed_data
@@ -0,0 +1,923 @@
+"""
+Аналитика по загруженным данным (main.py analytics / python analytics.py)
+
+Отчеты по fact_click_month, которые раньше были отдельными скриптами check_*:
+
+    summary      - метрики новых игроков (FTD) и всех игроков за период (check_metrics.py)
+    daily        - последние дни с FTD (check_metrics.py)
+    offers       - игроки и метрики по offer_id (check_offers.py)
+    mapping      - игроки и метрики по офферам через vw_clickid_buyer_offer (check_offers_mapping.py)
+    offer-types  - новые / старые игроки по офферам за месяц (check_offers_analytics.py)
+    latest       - последние записи fact_click_month (check_loaded_data.py)
+    verify       - сравнение БД с отчетом API по clickid (verify_db_data.py)
+    cohort       - когорты по месяцу первого FTD (player_cohort) и их метрики за период
+    reconcile    - сверка всех аккаунтов и месяцев с API по контрольным суммам (reconcile.py)
+    rollup       - пересчет агрегатов и когорт за период (Database.refresh_rollups, rebuild_player_cohort)
+
+Агрегация выполняется в SQL: в Python приходят уже готовые строки отчета
+(по строке на оффер или день), которые читаются с сервера пачками
+(Database.stream, ANALYTICS_FETCH_SIZE) и сразу выводятся.
+
+offers, mapping и offer-types за один целый месяц (для текущего месяца - по сегодня)
+читают агрегаты agg_offer_buyer_month / agg_offer_player_types, которые ETL пересчитывает
+после загрузки; за другие периоды и с --no-rollup - fact_click_month. В агрегатах
+игрок считается в пределах аккаунта: clickid, который есть в нескольких аккаунтах,
+без --account учитывается в каждом из них.
+
+Новые игроки (offers --new, mapping --new по fact_click_month, cohort) берутся из
+player_cohort, которую ведет загрузка: игроки с первым FTD в периоде выбираются
+по индексу, а не группировкой всех игроков периода с HAVING MAX(ftd) >= 1.
+
+Использование:
+    python main.py analytics summary
+    python main.py analytics offers --new --format csv -o offers.csv
+    python main.py analytics offer-types --month 2026-01 --account account_1 --format json
+    python analytics.py daily --from-date 2026-01-01 --to-date 2026-01-31 --limit 31
+    python main.py analytics rollup --from-date 2025-01-01   # пересчет агрегатов за прошлые месяцы
+"""
+import sys
+import csv
+import json
+import logging
+import argparse
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from database import Database
+from db_backend import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('table', 'csv', 'json')
+
+# Метрики строки fact_click_month
+METRICS = ('ftd', 'dep_cnt', 'dep_sum', 'ngr', 'cpa')
+
+# Допустимая разница метрик при сравнении с API (verify)
+VERIFY_TOLERANCE = 0.01
+
+# Колонка отчета: ключ строки, заголовок таблицы, тип значения (text, int, money, pct),
+# ширина в таблице (0 - только в CSV / JSON) и суммируется ли колонка в строке ИТОГО
+Column = Tuple[str, str, str, int, bool]
+
+METRIC_COLUMNS: List[Column] = [
+    ('players', 'Игроков', 'int', 10, True),
+    ('ftd', 'FTD', 'int', 8, True),
+    ('dep_cnt', 'Депозиты', 'int', 10, True),
+    ('dep_sum', 'Сумма', 'money', 15, True),
+    ('ngr', 'NGR', 'money', 15, True),
+    ('cpa', 'CPA', 'money', 13, True),
+]
+
+# Суммируемые колонки agg_offer_player_types (отчет offer-types)
+PLAYER_TYPE_COLUMNS = (
+    'new_players', 'old_players', 'reg_only_players', 'players', 'new_ftd', 'ftd',
+    'new_dep_cnt', 'old_dep_cnt', 'dep_cnt', 'new_dep_sum', 'old_dep_sum', 'dep_sum',
+    'new_ngr', 'old_ngr', 'ngr', 'new_cpa', 'old_cpa', 'cpa',
+)
+
+
+class Period:
+    """Фильтр отчетов: период (включительно) и аккаунт"""
+
+    def __init__(self, from_date: date, to_date: date, account_id: Optional[str] = None):
+        self.from_date = from_date
+        self.to_date = to_date
+        self.account_id = account_id
+
+    def where(self, db_columns: List[str], alias: str = '') -> Tuple[str, List[Any]]:
+        """Условие WHERE по fact_click_month для периода и аккаунта"""
+        prefix = f"{alias}." if alias else ''
+        sql = f"{prefix}source = 'affilka' AND {prefix}period_date >= %s AND {prefix}period_date <= %s"
+        params: List[Any] = [self.from_date, self.to_date]
+        if self.account_id:
+            if 'account_id' not in db_columns:
+                raise ValueError("В fact_click_month нет колонки account_id, фильтр --account недоступен")
+            sql += f" AND {prefix}account_id = %s"
+            params.append(self.account_id)
+        return sql, params
+
+    def __str__(self) -> str:
+        account = f", аккаунт {self.account_id}" if self.account_id else ''
+        return f"{self.from_date} - {self.to_date}{account}"
+
+
+class Report:
+    """Результат отчета: колонки и строки (итератор, строки читаются из БД по мере вывода)"""
+
+    def __init__(
+        self,
+        title: str,
+        columns: List[Column],
+        rows: Iterable[Dict[str, Any]],
+        totals: bool = False,
+        notes: Optional[Callable[[Dict[str, float], int], List[str]]] = None,
+        ok: bool = True
+    ):
+        """
+        Args:
+            title: Заголовок (только для таблицы)
+            columns: Колонки отчета
+            rows: Строки отчета
+            totals: Выводить строку ИТОГО по суммируемым колонкам (только для таблицы)
+            notes: Строки после таблицы по итогам (суммы колонок, количество строк)
+            ok: False - отчет нашел проблемы (код выхода 1, например расхождения в reconcile)
+        """
+        self.title = title
+        self.columns = columns
+        self.rows = rows
+        self.totals = totals
+        self.notes = notes
+        self.ok = ok
+
+
+def _cohort_filter(db: Database, period: Period, db_columns: List[str]) -> Optional[Tuple[str, str, List[Any]]]:
+    """
+    JOIN с player_cohort и условие для игроков с первым FTD в периоде
+
+    Returns:
+        (join, условие для WHERE, параметры) или None, если когорты за период не посчитаны
+    """
+    if not db.table_exists('player_cohort'):
+        return None
+    db.cursor.execute(
+        "SELECT 1 AS found FROM player_cohort WHERE ftd_date >= %s AND ftd_date <= %s LIMIT 1",
+        [period.from_date, period.to_date]
+    )
+    if not db.cursor.fetchall():
+        logger.info(f"player_cohort за {period} пуста, новые игроки определяются по fact_click_month")
+        return None
+    account = " AND c.account_id = f.account_id" if 'account_id' in db_columns else ''
+    return (
+        f" JOIN player_cohort c ON c.clickid = f.clickid{account}",
+        " AND c.ftd_date >= %s AND c.ftd_date <= %s",
+        [period.from_date, period.to_date],
+    )
+
+
+def _players_sql(where: str, group_by: str, select: str, join: str = '', having_ftd: bool = False) -> str:
+    """Подзапрос: метрики игрока (clickid) за период; FTD - флаг, берется максимум"""
+    having = " HAVING MAX(f.ftd) >= 1" if having_ftd else ''
+    return f"""
+        SELECT f.clickid, {select}MAX(f.ftd) AS ftd, SUM(f.dep_cnt) AS dep_cnt,
+               SUM(f.dep_sum) AS dep_sum, SUM(f.ngr) AS ngr, SUM(f.cpa) AS cpa
+        FROM fact_click_month f{join}
+        WHERE {where}
+        GROUP BY {group_by}{having}
+    """
+
+
+def _rollup_month(db: Database, period: Period, table: str, use_rollup: bool = True) -> Optional[date]:
+    """Месяц, за который отчет можно прочитать из агрегата table: период - один целый месяц и агрегат посчитан"""
+    if not use_rollup or period.from_date.day != 1:
+        return None
+    month_end = _month_end(period.from_date)
+    # Текущий месяц по сегодня тоже целый: данных за будущие дни нет
+    if not min(month_end, date.today()) <= period.to_date <= month_end:
+        return None
+    if not db.table_exists(table):
+        return None
+    db.cursor.execute(f"SELECT 1 AS found FROM {table} WHERE period_month = %s LIMIT 1", [period.from_date])
+    if not db.cursor.fetchall():
+        logger.info(f"{table} за {period.from_date:%Y-%m} не посчитан, отчет строится по fact_click_month")
+        return None
+    return period.from_date
+
+
+def _rollup_where(month: date, account_id: Optional[str], alias: str) -> Tuple[str, List[Any]]:
+    """Условие WHERE по агрегату за месяц и аккаунт"""
+    sql = f"{alias}.period_month = %s"
+    params: List[Any] = [month]
+    if account_id:
+        sql += f" AND {alias}.account_id = %s"
+        params.append(account_id)
+    return sql, params
+
+
+def _source_note(month: Optional[date], table: str) -> List[str]:
+    return [f"Источник: {table} за {month:%Y-%m}"] if month else []
+
+
+def _ratio(numerator: Any, denominator: Any, scale: float = 1.0) -> Optional[float]:
+    if not denominator:
+        return None
+    return float(numerator or 0) / float(denominator) * scale
+
+
+def summary(db: Database, period: Period, db_columns: List[str]) -> Report:
+    """Метрики новых игроков (FTD=1) и всех игроков за период"""
+    where, params = period.where(db_columns, 'f')
+    sql = f"""
+        WITH p AS ({_players_sql(where, 'f.clickid', '')})
+        SELECT 'new' AS segment, COUNT(*) AS players, SUM(ftd) AS ftd, SUM(dep_cnt) AS dep_cnt,
+               SUM(dep_sum) AS dep_sum, SUM(ngr) AS ngr, SUM(cpa) AS cpa
+        FROM p WHERE ftd >= 1
+        UNION ALL
+        SELECT 'all' AS segment, COUNT(*) AS players, SUM(ftd) AS ftd, SUM(dep_cnt) AS dep_cnt,
+               SUM(dep_sum) AS dep_sum, SUM(ngr) AS ngr, SUM(cpa) AS cpa
+        FROM p
+    """
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        segments = list(db.stream(sql, params))
+        total_players = next((row['players'] for row in segments if row['segment'] == 'all'), 0)
+        for row in segments:
+            # Средний чек - на FTD, а не на уникальных игроков; ROI - депозиты к Partner income
+            row['avg_check'] = _ratio(row['dep_sum'], row['ftd'])
+            row['avg_deposits'] = _ratio(row['dep_cnt'], row['players'])
+            row['roi'] = _ratio(row['dep_sum'], row['cpa'], 100)
+            row['share'] = _ratio(row['players'], total_players, 100)
+            yield row
+
+    return Report(
+        f"Метрики игроков за {period} (new - игроки с FTD)",
+        [('segment', 'Игроки', 'text', 8, False)] + METRIC_COLUMNS + [
+            ('avg_check', 'Ср. чек', 'money', 12, False),
+            ('avg_deposits', 'Деп./игрок', 'money', 11, False),
+            ('roi', 'ROI', 'pct', 10, False),
+            ('share', 'Доля', 'pct', 9, False),
+        ],
+        rows()
+    )
+
+
+def daily(db: Database, period: Period, db_columns: List[str], limit: int = 10, all_players: bool = False) -> Report:
+    """Последние дни периода: игроки и метрики по дням (по умолчанию только строки с FTD)"""
+    where, params = period.where(db_columns)
+    if not all_players:
+        where += " AND ftd >= 1"
+    sql = f"""
+        SELECT period_date, COUNT(DISTINCT clickid) AS players, SUM(ftd) AS ftd, SUM(dep_cnt) AS dep_cnt,
+               SUM(dep_sum) AS dep_sum, SUM(ngr) AS ngr, SUM(cpa) AS cpa
+        FROM fact_click_month
+        WHERE {where}
+        GROUP BY period_date
+        ORDER BY period_date DESC
+        LIMIT {int(limit)}
+    """
+    return Report(
+        f"Последние {limit} дней {'' if all_players else 'с FTD '}за {period}",
+        [('period_date', 'Дата', 'text', 12, False)] + METRIC_COLUMNS,
+        db.stream(sql, params),
+        totals=True
+    )
+
+
+def offers(
+    db: Database,
+    period: Period,
+    db_columns: List[str],
+    new_only: bool = False,
+    use_rollup: bool = True
+) -> Report:
+    """Игроки и метрики по offer_id (игрок - clickid, FTD игрока - максимум)"""
+    if 'offer_id' not in db_columns:
+        raise ValueError(f"В fact_click_month нет колонки offer_id (есть: {', '.join(db_columns)})")
+    where, params = period.where(db_columns, 'f')
+    offer_name = 'd.offer_name' if db.table_exists('dim_offer') else 'NULL'
+    month = _rollup_month(db, period, 'agg_offer_buyer_month', use_rollup)
+    if month:
+        # Строки агрегата - (аккаунт, оффер, байер); offer_id = 0 - без оффера
+        where, params = _rollup_where(month, period.account_id, 'a')
+        join = " LEFT JOIN dim_offer d ON d.offer_id = a.offer_id" if offer_name != 'NULL' else ''
+        prefix = 'new_' if new_only else ''
+        sql = f"""
+            SELECT NULLIF(a.offer_id, 0) AS offer_id, MAX({offer_name}) AS offer_name,
+                   SUM(a.{prefix}players) AS players, SUM(a.ftd) AS ftd, SUM(a.{prefix}dep_cnt) AS dep_cnt,
+                   SUM(a.{prefix}dep_sum) AS dep_sum, SUM(a.{prefix}ngr) AS ngr, SUM(a.{prefix}cpa) AS cpa
+            FROM agg_offer_buyer_month a{join}
+            WHERE {where}
+            GROUP BY a.offer_id
+            HAVING SUM(a.{prefix}players) > 0
+            ORDER BY players DESC, a.offer_id
+        """
+    else:
+        cohort = _cohort_filter(db, period, db_columns) if new_only else None
+        if cohort:
+            cohort_join, cohort_where, cohort_params = cohort
+            players = _players_sql(where + cohort_where, 'f.clickid, f.offer_id', 'f.offer_id, ', join=cohort_join)
+            params = params + cohort_params
+        else:
+            players = _players_sql(where, 'f.clickid, f.offer_id', 'f.offer_id, ', having_ftd=new_only)
+        join = " LEFT JOIN dim_offer d ON d.offer_id = p.offer_id" if offer_name != 'NULL' else ''
+        sql = f"""
+            SELECT p.offer_id, MAX({offer_name}) AS offer_name, COUNT(*) AS players, SUM(p.ftd) AS ftd,
+                   SUM(p.dep_cnt) AS dep_cnt, SUM(p.dep_sum) AS dep_sum, SUM(p.ngr) AS ngr, SUM(p.cpa) AS cpa
+            FROM ({players}) p{join}
+            GROUP BY p.offer_id
+            ORDER BY players DESC, p.offer_id
+        """
+
+    def notes(totals: Dict[str, float], count: int) -> List[str]:
+        return [f"Офферов: {count}"] + _source_note(month, 'agg_offer_buyer_month')
+
+    return Report(
+        f"Офферы {'новых игроков (FTD=1)' if new_only else 'всех игроков'} за {period}",
+        [('offer_id', 'Offer ID', 'text', 10, False), ('offer_name', 'Оффер', 'text', 40, False)] + METRIC_COLUMNS,
+        db.stream(sql, params),
+        totals=True,
+        notes=notes
+    )
+
+
+def mapping(
+    db: Database,
+    period: Period,
+    db_columns: List[str],
+    new_only: bool = False,
+    use_rollup: bool = True
+) -> Report:
+    """
+    Игроки и метрики по названию оффера из vw_clickid_buyer_offer и доля игроков с маппингом
+
+    Из агрегата оффер берется по offer_id, проставленному обогащением из Keitaro
+    (тот же v_click_dims, что и в vw_clickid_buyer_offer), и названию из dim_offer.
+    """
+    if not db.table_exists('vw_clickid_buyer_offer'):
+        raise ValueError("Нет представления vw_clickid_buyer_offer")
+    where, params = period.where(db_columns, 'f')
+    month = None
+    if db.table_exists('dim_offer'):
+        month = _rollup_month(db, period, 'agg_offer_buyer_month', use_rollup)
+    if month:
+        where, params = _rollup_where(month, period.account_id, 'a')
+        prefix = 'new_' if new_only else ''
+        sql = f"""
+            SELECT COALESCE(d.offer_name, 'NULL') AS offer_name, SUM(a.{prefix}players) AS players,
+                   CASE WHEN d.offer_name IS NULL THEN 0 ELSE SUM(a.{prefix}players) END AS mapped_players,
+                   SUM(a.ftd) AS ftd, SUM(a.{prefix}dep_cnt) AS dep_cnt, SUM(a.{prefix}dep_sum) AS dep_sum,
+                   SUM(a.{prefix}ngr) AS ngr, SUM(a.{prefix}cpa) AS cpa
+            FROM agg_offer_buyer_month a
+            LEFT JOIN dim_offer d ON d.offer_id = a.offer_id
+            WHERE {where}
+            GROUP BY d.offer_name
+            HAVING SUM(a.{prefix}players) > 0
+            ORDER BY players DESC
+        """
+    else:
+        join = ' LEFT JOIN vw_clickid_buyer_offer v ON f.clickid = v.clickid'
+        cohort = _cohort_filter(db, period, db_columns) if new_only else None
+        if cohort:
+            cohort_join, cohort_where, cohort_params = cohort
+            players = _players_sql(where + cohort_where, 'f.clickid, v.offer_name', 'v.offer_name, ',
+                                   join=cohort_join + join)
+            params = params + cohort_params
+        else:
+            players = _players_sql(where, 'f.clickid, v.offer_name', 'v.offer_name, ', join=join, having_ftd=new_only)
+        sql = f"""
+            SELECT COALESCE(p.offer_name, 'NULL') AS offer_name, COUNT(*) AS players,
+                   CASE WHEN p.offer_name IS NULL THEN 0 ELSE COUNT(*) END AS mapped_players,
+                   SUM(p.ftd) AS ftd, SUM(p.dep_cnt) AS dep_cnt, SUM(p.dep_sum) AS dep_sum,
+                   SUM(p.ngr) AS ngr, SUM(p.cpa) AS cpa
+            FROM ({players}) p
+            GROUP BY p.offer_name
+            ORDER BY players DESC
+        """
+
+    def notes(totals: Dict[str, float], count: int) -> List[str]:
+        mapped = totals.get('mapped_players', 0)
+        players = totals.get('players', 0)
+        rate = _ratio(mapped, players, 100)
+        return [
+            f"Игроков с маппингом: {int(mapped):,} из {int(players):,}"
+            + (f" ({rate:.2f}%)" if rate is not None else ''),
+            f"Игроков без маппинга (NULL): {int(players - mapped):,}",
+        ] + _source_note(month, 'agg_offer_buyer_month')
+
+    return Report(
+        f"Офферы через маппинг clickid ({'новые игроки' if new_only else 'все игроки'}) за {period}",
+        [('offer_name', 'Оффер', 'text', 50, False)] + METRIC_COLUMNS + [('mapped_players', '', 'int', 0, True)],
+        db.stream(sql, params),
+        totals=True,
+        notes=notes
+    )
+
+
+def offer_types(
+    db: Database,
+    month: date,
+    db_columns: List[str],
+    account_id: Optional[str] = None,
+    use_rollup: bool = True
+) -> Report:
+    """
+    Новые и старые игроки по офферам за месяц
+
+    new - игроки с FTD в месяце; old - игроки, которые были в предыдущем месяце и в этом
+    месяце депозитили или дали NGR; registration_only - остальные.
+    """
+    month_end = _month_end(month)
+    previous = _shift_month(month, -1)
+    period = Period(month, month_end, account_id)
+    where, params = period.where(db_columns, 'f')
+    previous_where, previous_params = Period(previous, _month_end(previous), account_id).where(db_columns)
+    has_dim_offer = db.table_exists('dim_offer')
+    rollup_month = _rollup_month(db, period, 'agg_offer_player_types', use_rollup)
+    if rollup_month:
+        rollup_where, rollup_params = _rollup_where(rollup_month, account_id, 'a')
+        offer_name = "COALESCE(MAX(d.offer_name), 'NULL')" if has_dim_offer else "'NULL'"
+        join = " LEFT JOIN dim_offer d ON a.offer_id = d.offer_id" if has_dim_offer else ''
+        sums = ', '.join(f"SUM(a.{column}) AS {column}" for column in PLAYER_TYPE_COLUMNS)
+        sql = f"""
+            SELECT a.offer_id, {sums}, {offer_name} AS offer_name
+            FROM agg_offer_player_types a{join}
+            WHERE {rollup_where}
+            GROUP BY a.offer_id
+            ORDER BY ftd DESC, dep_sum DESC
+        """
+        params, previous_params = rollup_params, []
+    else:
+        sql = _offer_types_sql(where, previous_where, has_dim_offer)
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        for row in db.stream(sql, params + previous_params):
+            row['avg_check'] = _ratio(row['dep_sum'], row['ftd'])
+            yield row
+
+    return Report(
+        f"Новые и старые игроки по офферам за {month:%Y-%m}" + (f", аккаунт {account_id}" if account_id else ''),
+        [
+            ('offer_id', 'Offer ID', 'text', 10, False),
+            ('offer_name', 'Оффер', 'text', 40, False),
+            ('new_players', 'Новые', 'int', 8, True),
+            ('old_players', 'Старые', 'int', 8, True),
+            ('reg_only_players', 'Рег.', 'int', 8, True),
+        ] + METRIC_COLUMNS + [
+            ('avg_check', 'Ср. чек', 'money', 12, False),
+            ('new_ftd', '', 'int', 0, False),
+            ('new_dep_cnt', '', 'int', 0, False),
+            ('old_dep_cnt', '', 'int', 0, False),
+            ('new_dep_sum', '', 'money', 0, False),
+            ('old_dep_sum', '', 'money', 0, False),
+            ('new_ngr', '', 'money', 0, False),
+            ('old_ngr', '', 'money', 0, False),
+            ('new_cpa', '', 'money', 0, False),
+            ('old_cpa', '', 'money', 0, False),
+        ],
+        rows(),
+        totals=True,
+        notes=lambda totals, count: _source_note(rollup_month, 'agg_offer_player_types')
+    )
+
+
+def _offer_types_sql(where: str, previous_where: str, has_dim_offer: bool) -> str:
+    """Запрос offer-types по fact_click_month (параметры: месяц, затем предыдущий месяц)"""
+    offer_name = "COALESCE(d.offer_name, 'NULL')" if has_dim_offer else "'NULL'"
+    join = " LEFT JOIN dim_offer d ON os.offer_id = d.offer_id" if has_dim_offer else ''
+    return f"""
+        WITH month_data AS (
+            SELECT f.clickid, f.offer_id, MAX(f.ftd) AS max_ftd, SUM(f.dep_cnt) AS dep_cnt,
+                   SUM(f.dep_sum) AS dep_sum, SUM(f.ngr) AS ngr, SUM(f.cpa) AS cpa
+            FROM fact_click_month f
+            WHERE {where}
+            GROUP BY f.clickid, f.offer_id
+        ),
+        previous_players AS (
+            SELECT DISTINCT clickid FROM fact_click_month WHERE {previous_where}
+        ),
+        players_classified AS (
+            SELECT md.*,
+                   CASE
+                       WHEN md.max_ftd >= 1 THEN 'new'
+                       WHEN pp.clickid IS NOT NULL AND (md.dep_cnt > 0 OR md.ngr > 0) THEN 'old'
+                       ELSE 'registration_only'
+                   END AS player_type
+            FROM month_data md
+            LEFT JOIN previous_players pp ON md.clickid = pp.clickid
+        ),
+        offer_stats AS (
+            SELECT
+                offer_id,
+                COUNT(DISTINCT CASE WHEN player_type = 'new' THEN clickid END) AS new_players,
+                COUNT(DISTINCT CASE WHEN player_type = 'old' THEN clickid END) AS old_players,
+                COUNT(DISTINCT CASE WHEN player_type = 'registration_only' THEN clickid END) AS reg_only_players,
+                COUNT(DISTINCT clickid) AS players,
+                SUM(CASE WHEN player_type = 'new' THEN max_ftd ELSE 0 END) AS new_ftd,
+                SUM(max_ftd) AS ftd,
+                SUM(CASE WHEN player_type = 'new' THEN dep_cnt ELSE 0 END) AS new_dep_cnt,
+                SUM(CASE WHEN player_type = 'old' THEN dep_cnt ELSE 0 END) AS old_dep_cnt,
+                SUM(dep_cnt) AS dep_cnt,
+                SUM(CASE WHEN player_type = 'new' THEN dep_sum ELSE 0 END) AS new_dep_sum,
+                SUM(CASE WHEN player_type = 'old' THEN dep_sum ELSE 0 END) AS old_dep_sum,
+                SUM(dep_sum) AS dep_sum,
+                SUM(CASE WHEN player_type = 'new' THEN ngr ELSE 0 END) AS new_ngr,
+                SUM(CASE WHEN player_type = 'old' THEN ngr ELSE 0 END) AS old_ngr,
+                SUM(ngr) AS ngr,
+                SUM(CASE WHEN player_type = 'new' THEN cpa ELSE 0 END) AS new_cpa,
+                SUM(CASE WHEN player_type = 'old' THEN cpa ELSE 0 END) AS old_cpa,
+                SUM(cpa) AS cpa
+            FROM players_classified
+            WHERE offer_id IS NOT NULL
+            GROUP BY offer_id
+        )
+        SELECT os.*, {offer_name} AS offer_name
+        FROM offer_stats os{join}
+        ORDER BY os.ftd DESC, os.dep_sum DESC
+    """
+
+
+def latest(db: Database, db_columns: List[str], limit: int = 10) -> Report:
+    """Последние записи fact_click_month и общее количество строк"""
+    sql = f"SELECT * FROM fact_click_month ORDER BY period_date DESC, clickid DESC LIMIT {int(limit)}"
+    rows = list(db.stream(sql))
+    db.cursor.execute("SELECT COUNT(*) AS total FROM fact_click_month")
+    total = db.cursor.fetchone()['total']
+    widths = {'clickid': 36, 'period_date': 12, 'source': 8, 'account_id': 12}
+    kinds = {'dep_sum': 'money', 'ngr': 'money', 'cpa': 'money', 'ftd': 'int', 'dep_cnt': 'int'}
+    return Report(
+        f"Последние {len(rows)} записей fact_click_month",
+        [(name, name, kinds.get(name, 'text'), widths.get(name, 12), False) for name in db_columns],
+        rows,
+        notes=lambda totals, count: [f"Всего записей в таблице: {total:,}"]
+    )
+
+
+def verify(db: Database, period: Period, db_columns: List[str], account_index: int = 1) -> Report:
+    """
+    Сравнивает метрики по clickid в БД с отчетом API за период
+
+    Отчет API группируется по дням и агрегируется так же, как в ETL (records.aggregate_records),
+    затем обе стороны суммируются по clickid. Метрики БД читаются потоком и сравниваются
+    по мере чтения, в памяти держатся только агрегаты API.
+    """
+    from affilka_api import AffilkaAPI
+    from config import get_affilka_accounts
+    from records import aggregate_records
+
+    accounts = get_affilka_accounts()
+    if not 1 <= account_index <= len(accounts):
+        raise ValueError(f"Нет аккаунта account_{account_index} (настроено аккаунтов: {len(accounts)})")
+    account = accounts[account_index - 1]
+    api = AffilkaAPI(account['token'], account['url'])
+    report = api.fetch_report(
+        from_date=str(period.from_date),
+        to_date=str(period.to_date),
+        columns=['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr'],
+        group_by=['day', 'dynamic_tag_visit_id'],
+        conversion_currency='EUR'
+    )
+    if not report:
+        raise RuntimeError("Не удалось получить данные из API")
+
+    api_players: Dict[str, List[float]] = {}
+    for group in aggregate_records(api.parse_report_data(report)):
+        values = api_players.setdefault(group.clickid, [0.0] * len(METRICS))
+        for index, name in enumerate(METRICS):
+            values[index] += getattr(group, name)
+
+    where, params = period.where(db_columns)
+    sql = f"""
+        SELECT clickid, SUM(ftd) AS ftd, SUM(dep_cnt) AS dep_cnt, SUM(dep_sum) AS dep_sum,
+               SUM(ngr) AS ngr, SUM(cpa) AS cpa
+        FROM fact_click_month
+        WHERE {where}
+        GROUP BY clickid
+    """
+    api_totals = [0.0] * len(METRICS)
+    db_totals = [0.0] * len(METRICS)
+    counts = {'common': 0, 'only_db': 0, 'mismatched': 0}
+    for row in db.stream(sql, params):
+        values = api_players.pop(row['clickid'], None)
+        if values is None:
+            counts['only_db'] += 1
+            continue
+        counts['common'] += 1
+        mismatch = False
+        for index, name in enumerate(METRICS):
+            db_value = float(row[name] or 0)
+            api_totals[index] += values[index]
+            db_totals[index] += db_value
+            mismatch = mismatch or abs(values[index] - db_value) >= VERIFY_TOLERANCE
+        counts['mismatched'] += mismatch
+    only_api = len(api_players)
+
+    rows = [
+        {'metric': name, 'api': api_totals[index], 'db': db_totals[index],
+         'diff': db_totals[index] - api_totals[index],
+         'ok': 'да' if abs(db_totals[index] - api_totals[index]) < VERIFY_TOLERANCE else 'НЕТ'}
+        for index, name in enumerate(METRICS)
+    ]
+    return Report(
+        f"Сравнение БД с API за {period}, метрики общих игроков",
+        [('metric', 'Метрика', 'text', 10, False), ('api', 'API', 'money', 16, False),
+         ('db', 'БД', 'money', 16, False), ('diff', 'БД - API', 'money', 14, False), ('ok', 'OK', 'text', 4, False)],
+        rows,
+        notes=lambda totals, count: [
+            f"Общих игроков: {counts['common']:,}, с расхождениями: {counts['mismatched']:,}",
+            f"Только в API: {only_api:,}, только в БД: {counts['only_db']:,}",
+        ]
+    )
+
+
+def cohort(db: Database, period: Period, db_columns: List[str], by_offer: bool = False) -> Report:
+    """
+    Когорты игроков по месяцу первого FTD в периоде и их метрики за период
+
+    Игроки когорты выбираются из player_cohort по индексу (ftd_month), метрики -
+    по их строкам fact_click_month за период.
+    """
+    if not db.table_exists('player_cohort'):
+        raise ValueError("Нет таблицы player_cohort (создается при загрузке, см. analytics rollup)")
+    fact_where, fact_params = period.where(db_columns, 'f')
+    has_account = 'account_id' in db_columns
+    account_join = " AND f.account_id = c.account_id" if has_account else ''
+    cohort_where = "c.ftd_month >= %s AND c.ftd_month <= %s"
+    cohort_params: List[Any] = [period.from_date.replace(day=1), period.to_date]
+    if period.account_id:
+        cohort_where += " AND c.account_id = %s"
+        cohort_params.append(period.account_id)
+    inner_offer = outer_offer = offer_select = join = ''
+    if by_offer:
+        inner_offer, outer_offer = ', c.offer_id', ', p.offer_id'
+        has_dim_offer = db.table_exists('dim_offer')
+        offer_select = f", p.offer_id, {'MAX(d.offer_name)' if has_dim_offer else 'NULL'} AS offer_name"
+        join = " LEFT JOIN dim_offer d ON d.offer_id = p.offer_id" if has_dim_offer else ''
+    sql = f"""
+        SELECT p.ftd_month{offer_select}, COUNT(*) AS players, SUM(p.ftd) AS ftd, SUM(p.dep_cnt) AS dep_cnt,
+               SUM(p.dep_sum) AS dep_sum, SUM(p.ngr) AS ngr, SUM(p.cpa) AS cpa
+        FROM (
+            SELECT c.ftd_month{inner_offer}, COALESCE(MAX(f.ftd), 0) AS ftd, COALESCE(SUM(f.dep_cnt), 0) AS dep_cnt,
+                   COALESCE(SUM(f.dep_sum), 0) AS dep_sum, COALESCE(SUM(f.ngr), 0) AS ngr, COALESCE(SUM(f.cpa), 0) AS cpa
+            FROM player_cohort c
+            LEFT JOIN fact_click_month f ON f.clickid = c.clickid{account_join} AND {fact_where}
+            WHERE {cohort_where}
+            GROUP BY c.ftd_month, c.clickid, c.account_id{inner_offer}
+        ) p{join}
+        GROUP BY p.ftd_month{outer_offer}
+        ORDER BY p.ftd_month{outer_offer}
+    """
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        for row in db.stream(sql, fact_params + cohort_params):
+            row['avg_check'] = _ratio(row['dep_sum'], row['ftd'])
+            yield row
+
+    columns: List[Column] = [('ftd_month', 'Месяц FTD', 'text', 12, False)]
+    if by_offer:
+        columns += [('offer_id', 'Offer ID', 'text', 10, False), ('offer_name', 'Оффер', 'text', 30, False)]
+    return Report(
+        f"Когорты по месяцу первого FTD, метрики за {period}",
+        columns + METRIC_COLUMNS + [
+            ('avg_check', 'Ср. чек', 'money', 12, False),
+        ],
+        rows(),
+        totals=True
+    )
+
+
+def rollup(db: Database, period: Period) -> Report:
+    """Пересчитывает агрегаты и когорты за период (например, за месяцы, загруженные до их появления)"""
+    account_ids = [period.account_id] if period.account_id else None
+    refreshed = db.refresh_rollups(str(period.from_date), str(period.to_date), account_ids)
+    cohort_players = db.rebuild_player_cohort(str(period.from_date), str(period.to_date), account_ids)
+    return Report(
+        f"Пересчет агрегатов за {period}",
+        [
+            ('period_month', 'Месяц', 'text', 12, False),
+            ('offer_buyer_rows', 'Оффер/байер', 'int', 12, True),
+            ('player_type_rows', 'Типы игроков', 'int', 13, True),
+        ],
+        refreshed,
+        totals=True,
+        notes=lambda totals, count: [f"player_cohort: {cohort_players:,} игроков с FTD за период"]
+    )
+
+
+def _month_end(month: date) -> date:
+    return date.fromordinal(_shift_month(month, 1).toordinal() - 1)
+
+
+def _shift_month(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _plain(value: Any, kind: str) -> Any:
+    """Значение для CSV / JSON: числа по типу колонки (суммы - 2 знака), даты -> ISO"""
+    if value is None:
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind in ('money', 'pct'):
+        return round(float(value), 2)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _cell(value: Any, kind: str, width: int) -> str:
+    if value is None:
+        text = 'NULL' if kind == 'text' else '-'
+        return f"{text:<{width}}" if kind == 'text' else f"{text:>{width}}"
+    if kind == 'int':
+        text = f"{int(value):,}"
+    elif kind == 'money':
+        text = f"{float(value):,.2f}"
+    elif kind == 'pct':
+        text = f"{float(value):.2f}%"
+    else:
+        text = str(value)
+        if len(text) > width:
+            text = text[:width - 3] + '...'
+        return f"{text:<{width}}"
+    return f"{text:>{width}}"
+
+
+def write_report(report: Report, fmt: str = 'table', out: TextIO = sys.stdout) -> int:
+    """
+    Выводит отчет по мере чтения строк
+
+    Returns:
+        Количество строк отчета
+    """
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow([column[0] for column in report.columns])
+        for row in report.rows:
+            writer.writerow([_plain(row.get(column[0]), column[2]) for column in report.columns])
+            count += 1
+        return count
+
+    if fmt == 'json':
+        out.write('[')
+        for row in report.rows:
+            item = {column[0]: _plain(row.get(column[0]), column[2]) for column in report.columns}
+            out.write((',\n ' if count else '\n ') + json.dumps(item, ensure_ascii=False))
+            count += 1
+        out.write('\n]\n' if count else ']\n')
+        return count
+
+    visible = [column for column in report.columns if column[3] > 0]
+    header = ' '.join(f"{title:<{width}}" if kind == 'text' else f"{title:>{width}}"
+                      for _key, title, kind, width, _total in visible)
+    print(report.title, file=out)
+    print('=' * len(header), file=out)
+    print(header, file=out)
+    print('-' * len(header), file=out)
+    totals: Dict[str, float] = {}
+    for row in report.rows:
+        print(' '.join(_cell(row.get(key), kind, width) for key, _title, kind, width, _total in visible), file=out)
+        for key, _title, _kind, _width, total in report.columns:
+            if total:
+                totals[key] = totals.get(key, 0) + float(row.get(key) or 0)
+        count += 1
+    if not count:
+        print("Нет данных за указанный период", file=out)
+    elif report.totals:
+        print('-' * len(header), file=out)
+        cells = []
+        for index, (key, _title, kind, width, total) in enumerate(visible):
+            if index == 0:
+                cells.append(f"{'ИТОГО':<{width}}")
+            elif total:
+                cells.append(_cell(totals.get(key), kind, width))
+            else:
+                cells.append(' ' * width)
+        print(' '.join(cells), file=out)
+    if report.notes:
+        for line in report.notes(totals, count):
+            print(line, file=out)
+    print(file=out)
+    return count
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_month(value: str) -> date:
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Подкоманды и параметры отчетов (для analytics.py и main.py analytics)"""
+    common = argparse.ArgumentParser(add_help=False)
+    # SUPPRESS: чтобы значения, указанные в main.py до подкоманды, не перезаписывались
+    common.add_argument('--from-date', type=str, default=argparse.SUPPRESS,
+                        help='Начальная дата YYYY-MM-DD (по умолчанию: 1 число текущего месяца)')
+    common.add_argument('--to-date', type=str, default=argparse.SUPPRESS,
+                        help='Конечная дата YYYY-MM-DD включительно (по умолчанию: сегодня)')
+    common.add_argument('--account', type=str, default=None, help='Только один аккаунт (account_1, ...)')
+    common.add_argument('--format', choices=FORMATS, default='table', help='Формат вывода (по умолчанию: table)')
+    common.add_argument('-o', '--output', type=str, default=None, help='Файл для вывода (по умолчанию: stdout)')
+
+    subparsers = parser.add_subparsers(dest='report', required=True)
+    subparsers.add_parser('summary', parents=[common], help='Метрики новых (FTD) и всех игроков за период')
+    daily_parser = subparsers.add_parser('daily', parents=[common], help='Метрики по дням')
+    daily_parser.add_argument('--limit', type=int, default=10, help='Количество последних дней (по умолчанию: 10)')
+    daily_parser.add_argument('--all-players', action='store_true', help='Все строки, а не только с FTD')
+    offers_parser = subparsers.add_parser('offers', parents=[common], help='Игроки и метрики по offer_id')
+    offers_parser.add_argument('--new', action='store_true', help='Только новые игроки (FTD=1)')
+    offers_parser.add_argument('--no-rollup', action='store_true', help='Не читать агрегаты, только fact_click_month')
+    mapping_parser = subparsers.add_parser('mapping', parents=[common],
+                                           help='Игроки и метрики по офферам через vw_clickid_buyer_offer')
+    mapping_parser.add_argument('--new', action='store_true', help='Только новые игроки (FTD=1)')
+    mapping_parser.add_argument('--no-rollup', action='store_true', help='Не читать агрегаты, только fact_click_month')
+    types_parser = subparsers.add_parser('offer-types', parents=[common],
+                                         help='Новые / старые игроки по офферам за месяц')
+    types_parser.add_argument('--month', type=_parse_month, default=None,
+                              help='Месяц YYYY-MM (по умолчанию: текущий)')
+    types_parser.add_argument('--no-rollup', action='store_true', help='Не читать агрегаты, только fact_click_month')
+    latest_parser = subparsers.add_parser('latest', parents=[common], help='Последние записи fact_click_month')
+    latest_parser.add_argument('--limit', type=int, default=10, help='Количество записей (по умолчанию: 10)')
+    subparsers.add_parser('verify', parents=[common],
+                          help='Сравнение метрик по clickid в БД с отчетом API (аккаунт --account, по умолчанию account_1)')
+    cohort_parser = subparsers.add_parser('cohort', parents=[common],
+                                          help='Когорты по месяцу первого FTD и их метрики за период')
+    cohort_parser.add_argument('--by-offer', action='store_true', help='Разбивка когорт по офферу')
+    subparsers.add_parser('rollup', parents=[common],
+                          help='Пересчет агрегатов и player_cohort за период')
+    reconcile_parser = subparsers.add_parser('reconcile', parents=[common],
+                                             help='Сверка всех аккаунтов (или --account) и месяцев с API '
+                                                  'по итогам дат и бакетам clickid')
+    reconcile_parser.add_argument('--details', action='store_true',
+                                  help='Вывести все расхождения по clickid вместо итогов по месяцам')
+
+
+def build_report(db: Database, args: argparse.Namespace) -> Report:
+    """Отчет по аргументам командной строки"""
+    today = date.today()
+    from_date = getattr(args, 'from_date', None)
+    to_date = getattr(args, 'to_date', None)
+    period = Period(
+        _parse_date(from_date) if from_date else today.replace(day=1),
+        _parse_date(to_date) if to_date else today,
+        args.account
+    )
+    db_columns = [column['Field'] for column in db.get_table_schema() or []]
+    if not db_columns:
+        raise RuntimeError("Не удалось получить схему fact_click_month")
+
+    if args.report == 'summary':
+        return summary(db, period, db_columns)
+    if args.report == 'daily':
+        return daily(db, period, db_columns, args.limit, args.all_players)
+    if args.report == 'offers':
+        return offers(db, period, db_columns, args.new, not args.no_rollup)
+    if args.report == 'mapping':
+        return mapping(db, period, db_columns, args.new, not args.no_rollup)
+    if args.report == 'offer-types':
+        return offer_types(db, args.month or today.replace(day=1), db_columns, args.account, not args.no_rollup)
+    if args.report == 'latest':
+        return latest(db, db_columns, args.limit)
+    if args.report == 'verify':
+        account = args.account or 'account_1'
+        if not account.startswith('account_') or not account[len('account_'):].isdigit():
+            raise ValueError(f"Аккаунт для verify задается как account_N: {account}")
+        return verify(db, Period(period.from_date, period.to_date, account), db_columns, int(account[len('account_'):]))
+    if args.report == 'cohort':
+        return cohort(db, period, db_columns, args.by_offer)
+    if args.report == 'rollup':
+        return rollup(db, period)
+    if args.report == 'reconcile':
+        from reconcile import reconcile
+        return reconcile(db, period, db_columns, args.details)
+    raise ValueError(f"Неизвестный отчет: {args.report}")
+
+
+def run(args: argparse.Namespace) -> bool:
+    """Строит и выводит отчет; возвращает False, если отчет построить не удалось"""
+    with Database() as db:
+        if not db.cursor:
+            logger.error("Не удалось подключиться к БД")
+            return False
+        report = None
+        try:
+            report = build_report(db, args)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8', newline='') as f:
+                    count = write_report(report, args.format, f)
+                logger.info(f"Отчет {args.report}: {count} строк сохранено в {args.output}")
+            else:
+                write_report(report, args.format)
+            if not report.ok:
+                return False
+        except (ValueError, RuntimeError) + DatabaseError as e:
+            logger.error(f"Отчет {args.report}: {e}")
+            return False
+        finally:
+            # Недочитанный результат закрывается до отключения от БД
+            close = getattr(report.rows, 'close', None) if report is not None else None
+            if close:
+                close()
+    return True
+
+
+def run_cli(argv: Optional[List[str]] = None) -> int:
+    """Разбирает аргументы и выводит отчет; возвращает код выхода (для оберток check_*)"""
+    parser = argparse.ArgumentParser(description='Аналитика по данным fact_click_month')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    return 0 if run(args) else 1
+
+
+def main():
+    sys.exit(run_cli())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Бенчмарк стадий ETL на синтетических отчетах (synthetic_report.py)
+
+Использование:
+    python bench_etl.py                                  # parse и transform на 10k/100k/1M строк
+    python bench_etl.py --rows 10000 100000 --repeat 5
+    python bench_etl.py --db                             # + upsert_fact_click_month и enrich_dims_from_keitaro
+    python bench_etl.py --api                            # + fetch_report через локальный mock API
+    python bench_etl.py --save-baseline bench_baseline.json
+    python bench_etl.py --baseline bench_baseline.json   # сравнение с сохраненными результатами
+    DB_BACKEND=sqlite python bench_etl.py --rows 10000 100000 --db --api \
+        --baseline bench_baseline/sqlite.json --tolerance 0.5 --memory-tolerance 0.1
+
+Для каждой стадии выводится лучшее время из --repeat повторов, строк в секунду
+и пиковая память стадии (отдельный прогон под tracemalloc, чтобы трассировка
+не искажала время). При сравнении с baseline стадия считается регрессией, если
+строк/с меньше baseline более чем на --tolerance или пиковая память больше
+более чем на --memory-tolerance (по умолчанию равен --tolerance);
+в этом случае скрипт завершается с кодом 1 (удобно для CI).
+
+Эталонные baseline лежат в bench_baseline/ (sqlite.json, duckdb.json): прогоны
+--rows 10000 100000 --db --api на встроенных БД. В файле записаны версия Python,
+бэкенд, количество CPU и платформа машины, на которой он снят (1 vCPU).
+Пиковая память детерминирована и от машины почти не зависит, а строк/с на общей
+виртуальной машине между одинаковыми прогонами расходятся до 2 раз. Поэтому с
+этими файлами сравнивается с --tolerance 0.5 --memory-tolerance 0.1: ловятся
+кратные замедления и рост памяти. Более строгий --tolerance (по умолчанию 20%)
+имеет смысл только для baseline, снятого на той же машине с версии до изменений.
+
+Бенчмарк fetch (--api) скачивает и декодирует тот же отчет с локального
+mock API (mock_affilka_server.py): HTTP-транспорт, распаковка gzip и JSON.
+
+Бенчмарки БД (--db) работают с бэкендом DB_BACKEND: MySQL или встроенные
+SQLite / DuckDB (db_backend.py), для которых внешние сервисы не нужны.
+Они пишут в fact_click_month (и player_cohort) строки с source = 'affilka',
+account_id = 'bench' и датами с BENCH_START_DATE (2000 год, не пересекается
+с реальными данными) и удаляют их после прогона.
+"""
+import gc
+import os
+import sys
+import json
+import platform
+import time
+import logging
+import argparse
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from affilka_api import AffilkaAPI
+from etl_process import AffilkaETL
+from database import Database
+from config import DEFAULT_REPORT_COLUMNS, DEFAULT_REPORT_GROUP_BY
+from mock_affilka_server import MockAffilkaServer
+from synthetic_report import generate_report
+
+# Период синтетических данных для бенчмарков БД
+BENCH_START_DATE = '2000-01-01'
+BENCH_DAYS = 28
+BENCH_ACCOUNT_ID = 'bench'
+
+DEFAULT_ROWS = (10000, 100000, 1000000)
+
+
+def best_time(run: Callable[[], Any], repeat: int, setup: Optional[Callable[[], None]] = None) -> float:
+    """Лучшее время run() из repeat повторов (сек); setup выполняется перед каждым повтором и не замеряется"""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def peak_memory(run: Callable[[], Any], setup: Optional[Callable[[], None]] = None) -> int:
+    """Пиковая память, выделенная во время run() (байты)"""
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def cleanup_bench_rows(db: Database):
+    """Удаляет строки бенчмарка из fact_click_month и player_cohort"""
+    end = date.fromisoformat(BENCH_START_DATE) + timedelta(days=BENCH_DAYS)
+    columns = [col['Field'] for col in db.get_table_schema() or []]
+    sql = "DELETE FROM fact_click_month WHERE source = 'affilka' AND period_date >= %s AND period_date < %s"
+    params = [BENCH_START_DATE, end.isoformat()]
+    if 'account_id' in columns:
+        sql += " AND account_id = %s"
+        params.append(BENCH_ACCOUNT_ID)
+    db.cursor.execute(sql, params)
+    if db.table_exists('player_cohort'):
+        db.cursor.execute(
+            "DELETE FROM player_cohort WHERE ftd_date >= %s AND ftd_date < %s AND account_id = %s",
+            [BENCH_START_DATE, end.isoformat(), BENCH_ACCOUNT_ID if 'account_id' in columns else '']
+        )
+    db.connection.commit()
+
+
+def bench_size(rows: int, repeat: int, with_db: bool, memory: bool, with_api: bool = False) -> List[Dict[str, Any]]:
+    """Все бенчмарки на отчете из rows строк"""
+    report = generate_report(rows, start_date=BENCH_START_DATE, days=BENCH_DAYS)
+    api = AffilkaAPI('bench', 'http://localhost')
+    etl = AffilkaETL.__new__(AffilkaETL)
+    etl.account_id = BENCH_ACCOUNT_ID
+
+    records = api.parse_report_data(report)
+    groups = etl.transform_data(records)
+
+    benches = [
+        ('parse', rows, lambda: api.parse_report_data(report), None),
+        ('transform', len(records), lambda: etl.transform_data(records), None),
+    ]
+
+    server = None
+    if with_api:
+        server = MockAffilkaServer(payloads=[json.dumps(report).encode('utf-8')]).start()
+        client = AffilkaAPI('bench', server.url)
+        # Кеш ответов отключен: замеряется скачивание, а не чтение с диска
+        client.cache = None
+        end = (date.fromisoformat(BENCH_START_DATE) + timedelta(days=BENCH_DAYS - 1)).isoformat()
+        benches.insert(0, ('fetch', rows, lambda: client.fetch_report(
+            BENCH_START_DATE, end, columns=DEFAULT_REPORT_COLUMNS, group_by=DEFAULT_REPORT_GROUP_BY), None))
+
+    db = None
+    if with_db:
+        db = Database()
+        db.connect()
+        if not db.cursor:
+            raise RuntimeError("Не удалось подключиться к БД (нужно для --db)")
+        end = (date.fromisoformat(BENCH_START_DATE) + timedelta(days=BENCH_DAYS - 1)).isoformat()
+        benches += [
+            # Перед каждым повтором таблица очищается: замеряется вставка, а не обновление
+            ('upsert', len(groups), lambda: db.upsert_fact_click_month(groups, account_id=BENCH_ACCOUNT_ID),
+             lambda: cleanup_bench_rows(db)),
+            ('enrich', len(groups), lambda: db.enrich_dims_from_keitaro(BENCH_START_DATE, end), None),
+        ]
+
+    results = []
+    try:
+        for name, count, run, setup in benches:
+            seconds = best_time(run, repeat, setup)
+            peak = peak_memory(run, setup) if memory else None
+            results.append({
+                'bench': name,
+                'rows': rows,
+                'input': count,
+                'seconds': round(seconds, 4),
+                'rows_per_sec': round(count / seconds) if seconds > 0 else None,
+                'peak_mb': round(peak / 1024 / 1024, 1) if peak is not None else None,
+            })
+    finally:
+        if server is not None:
+            server.stop()
+        if db is not None:
+            cleanup_bench_rows(db)
+            db.disconnect()
+    return results
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    tolerance: float,
+    memory_tolerance: Optional[float] = None
+) -> List[str]:
+    """Сравнивает результаты с baseline; возвращает описания регрессий"""
+    if memory_tolerance is None:
+        memory_tolerance = tolerance
+    previous = {(item['bench'], item['rows']): item for item in baseline}
+    regressions = []
+    for item in results:
+        base = previous.get((item['bench'], item['rows']))
+        item['baseline_rows_per_sec'] = base.get('rows_per_sec') if base else None
+        item['baseline_peak_mb'] = base.get('peak_mb') if base else None
+        if not base:
+            continue
+        label = f"{item['bench']} @ {item['rows']:,}"
+        if base.get('rows_per_sec') and item['rows_per_sec'] and item['rows_per_sec'] < base['rows_per_sec'] * (1 - tolerance):
+            regressions.append(f"{label}: {item['rows_per_sec']:,} строк/с против {base['rows_per_sec']:,} в baseline")
+        if base.get('peak_mb') and item['peak_mb'] and item['peak_mb'] > base['peak_mb'] * (1 + memory_tolerance):
+            regressions.append(f"{label}: пик памяти {item['peak_mb']} MB против {base['peak_mb']} MB в baseline")
+    return regressions
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print(f"{'стадия':<10} {'строк':>10} {'вход':>10} {'время, с':>10} {'строк/с':>12} {'пик, MB':>9} {'vs baseline':>12}")
+    print("-" * 80)
+    for item in results:
+        base = item.get('baseline_rows_per_sec')
+        ratio = f"{item['rows_per_sec'] / base:.2f}x" if base and item['rows_per_sec'] else ''
+        peak = '-' if item['peak_mb'] is None else f"{item['peak_mb']:.1f}"
+        print(f"{item['bench']:<10} {item['rows']:>10,} {item['input']:>10,} {item['seconds']:>10.3f} "
+              f"{item['rows_per_sec'] or 0:>12,} {peak:>9} {ratio:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк стадий ETL на синтетических отчетах Affilka')
+    parser.add_argument('--rows', type=int, nargs='+', default=list(DEFAULT_ROWS),
+                        help='Размеры отчетов в строках (по умолчанию 10000 100000 1000000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов (берется лучшее время)')
+    parser.add_argument('--db', action='store_true',
+                        help='Также замерить upsert_fact_click_month и enrich_dims_from_keitaro (нужна БД)')
+    parser.add_argument('--api', action='store_true',
+                        help='Также замерить fetch_report через локальный mock API (mock_affilka_server.py)')
+    parser.add_argument('--no-memory', action='store_true', help='Не замерять пиковую память (быстрее)')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON с результатами для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Допустимое ухудшение относительно baseline (по умолчанию 0.2 = 20%%)')
+    parser.add_argument('--memory-tolerance', type=float, default=None,
+                        help='Допустимый рост пиковой памяти (по умолчанию равен --tolerance)')
+    parser.add_argument('--save-baseline', type=str, default=None, help='Сохранить результаты как baseline')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    results = []
+    for rows in args.rows:
+        print(f"Отчет на {rows:,} строк...", file=sys.stderr)
+        results.extend(bench_size(rows, args.repeat, args.db, not args.no_memory, args.api))
+
+    backend = Database().backend.name if args.db else None
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if args.db and baseline.get('backend') and baseline['backend'] != backend:
+            print(f"Внимание: baseline снят на {baseline['backend']}, текущий бэкенд - {backend}", file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.tolerance, args.memory_tolerance)
+
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            saved = [{key: value for key, value in item.items() if not key.startswith('baseline_')} for item in results]
+            json.dump({
+                'python': sys.version.split()[0],
+                'backend': backend,
+                'cpus': os.cpu_count(),
+                'platform': platform.platform(),
+                'results': saved,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline сохранен: {args.save_baseline}")
+
+    if regressions:
+        print("\nРегрессии относительно baseline:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Микро-бенчмарк декодирования JSON ответов отчета: stdlib json vs orjson / ujson
+
+Использование:
+    python bench_json_decode.py                       # все ответы из хранилища сырых ответов (RAW_STORE_DIR)
+    python bench_json_decode.py report.json ...       # сохраненные JSON-ответы API
+    python bench_json_decode.py --synthetic-rows 200000
+
+Если записанных ответов нет, используется синтетический отчет в формате Affilka.
+"""
+import os
+import json
+import time
+import argparse
+from affilka_api import load_json_backend, JSON_BACKENDS, JSON_BACKEND_NAME
+from raw_store import RawStore
+from synthetic_report import generate_payload
+
+
+def load_payloads(paths, synthetic_rows):
+    """Возвращает список (имя, bytes) для бенчмарка"""
+    payloads = []
+    for path in paths:
+        if path.endswith(('.ndjson.gz', '.ndjson.zst')):
+            report = RawStore().load(path)
+            payloads.append((os.path.basename(path), json.dumps(report).encode('utf-8')))
+        else:
+            with open(path, 'rb') as f:
+                payloads.append((os.path.basename(path), f.read()))
+
+    if not paths and not synthetic_rows:
+        # Записанные ответы из хранилища (по одному самому большому файлу на аккаунт)
+        largest = {}
+        for partition in RawStore().list_partitions():
+            size = os.path.getsize(partition['path'])
+            if size > largest.get(partition['account_id'], (0, None))[0]:
+                largest[partition['account_id']] = (size, partition['path'])
+        for account_id, (_size, path) in sorted(largest.items()):
+            report = RawStore().load(path)
+            payloads.append((f"{account_id}:{os.path.basename(path)}", json.dumps(report).encode('utf-8')))
+
+    if not payloads:
+        rows = synthetic_rows or 100000
+        payloads.append((f"synthetic-{rows}", generate_payload(rows)))
+    return payloads
+
+
+def bench(loads, payload: bytes, repeat: int) -> float:
+    """Лучшее время декодирования из repeat попыток (сек)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        loads(payload)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк JSON-библиотек на ответах отчета Affilka')
+    parser.add_argument('paths', nargs='*', help='Файлы ответов (.json или файлы хранилища .ndjson.gz/.zst)')
+    parser.add_argument('--synthetic-rows', type=int, default=None, help='Размер синтетического отчета (строк)')
+    parser.add_argument('--repeat', type=int, default=5, help='Количество повторов (берется лучшее время)')
+    args = parser.parse_args()
+
+    backends = []
+    for name in JSON_BACKENDS:
+        loaded_name, loads = load_json_backend(name, quiet=True)
+        if loaded_name == name:
+            backends.append((name, loads))
+
+    print(f"Текущий backend (AFFILKA_JSON_BACKEND): {JSON_BACKEND_NAME}")
+    print(f"Установлены: {', '.join(name for name, _ in backends)}")
+    print()
+
+    for payload_name, payload in load_payloads(args.paths, args.synthetic_rows):
+        rows = len(json.loads(payload).get('rows', {}).get('data', []))
+        print("=" * 72)
+        print(f"{payload_name}: {len(payload) / 1024 / 1024:.1f} MB, {rows:,} строк")
+        print("=" * 72)
+        print(f"{'Backend':<10} {'Время, мс':>12} {'MB/с':>10} {'Строк/с':>14} {'vs json':>10}")
+        print("-" * 72)
+        baseline = None
+        for name, loads in reversed(backends):
+            elapsed = bench(loads, payload, args.repeat)
+            if name == 'json':
+                baseline = elapsed
+            speedup = f"{baseline / elapsed:.2f}x" if baseline else ''
+            print(f"{name:<10} {elapsed * 1000:>12.1f} {len(payload) / 1024 / 1024 / elapsed:>10.1f} "
+                  f"{rows / elapsed:>14,.0f} {speedup:>10}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
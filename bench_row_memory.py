@@ -0,0 +1,81 @@
+"""
+Бенчмарк памяти на строку отчета: dict (прежнее представление) vs ClickRecord
+
+Использование:
+    python bench_row_memory.py                      # синтетический отчет на 200000 строк
+    python bench_row_memory.py --rows 1000000
+    python bench_row_memory.py --extra-fields 0     # без немаппящихся полей в ответе
+
+Сравниваются:
+- dict + debug     - прежний формат parse_report_data: dict с метриками и всеми '_<field>' полями;
+- record + debug   - ClickRecord с включенным AFFILKA_KEEP_DEBUG_FIELDS;
+- record           - ClickRecord по умолчанию (без debug-полей);
+- группы dict / record - результат transform_data в старом и новом формате.
+"""
+import gc
+import argparse
+import tracemalloc
+import logging
+from synthetic_report import generate_report
+from affilka_api import AffilkaAPI
+from etl_process import AffilkaETL
+from records import RECORD_FIELDS
+
+
+def measure(build):
+    """Объем памяти, который удерживает результат build() (байты)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память на строку: dict vs ClickRecord')
+    parser.add_argument('--rows', type=int, default=200000, help='Количество строк в синтетическом отчете')
+    parser.add_argument('--extra-fields', type=int, default=3,
+                        help='Количество немаппящихся полей в каждой строке ответа (по умолчанию 3)')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    report = generate_report(args.rows, extra_fields=args.extra_fields)
+    api = AffilkaAPI('bench', 'http://localhost')
+    etl = AffilkaETL.__new__(AffilkaETL)
+    etl.account_id = 'bench'
+
+    def legacy_rows():
+        # Прежний формат: dict на строку со всеми полями, включая '_<field>'
+        records = api.parse_report_data(report, keep_debug_fields=True)
+        return [record.to_dict() for record in records]
+
+    results = []
+    rows, size = measure(legacy_rows)
+    results.append(('dict + debug', len(rows), size))
+    del rows
+
+    rows, size = measure(lambda: api.parse_report_data(report, keep_debug_fields=True))
+    results.append(('record + debug', len(rows), size))
+    del rows
+
+    rows, size = measure(lambda: api.parse_report_data(report, keep_debug_fields=False))
+    results.append(('record', len(rows), size))
+
+    groups, size = measure(lambda: [{key: getattr(g, key) for key in RECORD_FIELDS} for g in etl.transform_data(rows)])
+    results.append(('группы dict', len(groups), size))
+    del groups
+
+    groups, size = measure(lambda: etl.transform_data(rows))
+    results.append(('группы record', len(groups), size))
+
+    print(f"Строк в отчете: {args.rows:,}, немаппящихся полей: {args.extra_fields}")
+    print(f"{'представление':<16} {'объектов':>10} {'МБ':>9} {'байт/строку':>12}")
+    for name, count, size in results:
+        print(f"{name:<16} {count:>10,} {size / 1024 / 1024:>9.1f} {size / max(count, 1):>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,9 @@
 Показывает статистику по данным, которые возвращает API
 """
 from datetime import datetime, timedelta
-from config import get_affilka_accounts
+from config import get_affilka_accounts, RAW_STORE_REUSE_MINUTES
 from affilka_api import AffilkaAPI
+from raw_store import RawStore
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -34,7 +35,11 @@ def check_api_data():
     print()
     
     # Получаем данные из API
-    report = api.fetch_report(
+    # Ответ берется из хранилища сырых ответов, если ETL или другой скрипт уже запрашивал его недавно
+    report = RawStore().fetch(
+        api,
+        max_age_minutes=RAW_STORE_REUSE_MINUTES,
+        account_id='account_1',
         from_date=str(month_start),
         to_date=str(today),
         columns=['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr'],
@@ -3,8 +3,9 @@
 Разделяет на новых (FTD=1) и старых (FTD=0) игроков
 """
 from datetime import datetime, date
-from config import get_affilka_accounts
+from config import get_affilka_accounts, RAW_STORE_REUSE_MINUTES
 from affilka_api import AffilkaAPI
+from raw_store import RawStore
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -36,7 +37,11 @@ def check_api_data_monthly():
     # Получаем данные из API с группировкой по дням и visit_id
     # Потом агрегируем по visit_id в скрипте
     # Используем конвертацию в EUR для сравнения со скриншотом
-    report = api.fetch_report(
+    # Ответ берется из хранилища сырых ответов, если ETL или другой скрипт уже запрашивал его недавно
+    report = RawStore().fetch(
+        api,
+        max_age_minutes=RAW_STORE_REUSE_MINUTES,
+        account_id='account_1',
         from_date=str(month_start),
         to_date=str(today),
         columns=['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr'],
@@ -0,0 +1,131 @@
+"""
+Словарное кодирование clickid
+
+Одни и те же visit_id повторяются по дням, аккаунтам и запускам. Вместо того чтобы
+на каждую строку отчета создавать новые строки (strip, lower) и хешировать их при
+группировке, clickid один раз нормализуется и получает целочисленный код в общей
+таблице строк. Ключи группировки в transform_data - (period_date, код).
+
+Таблица общая для процесса (get_clickid_table) и живет один запуск ETL: в конце
+запуска (process_all_accounts, срабатывание расписания serve) она очищается
+reset_clickid_table(), чтобы долгоживущий процесс не держал строки clickid между
+запусками. Коды действительны, пока таблица не сброшена: внутри запуска сброс
+выполняется в начале каждой пачки агрегации (aggregate_records,
+SpillingAggregator.add), когда размер таблицы превышает CLICKID_TABLE_MAX_SIZE.
+Коды не переживают пачку: SpillingAggregator хранит в ключах групп уже
+декодированные строки, поэтому сброс между пачками не меняет накопленные группы.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+from config import CLICKID_TABLE_MAX_SIZE
+
+# Значения, которые не считаются clickid
+NULL_CLICKIDS = frozenset(['', 'null', 'none'])
+
+_MISSING = object()
+
+
+def normalize_clickid(clickid: Any) -> Optional[str]:
+    """Удаляет пробелы и приводит к нижнему регистру; пустые и null-значения -> None"""
+    if not clickid:
+        return None
+    normalized = str(clickid).strip().lower()
+    if normalized in NULL_CLICKIDS:
+        return None
+    return normalized
+
+
+class ClickidTable:
+    """Таблица строк clickid: исходное значение -> нормализованная строка -> код"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        """
+        Args:
+            max_size: Максимальное количество исходных значений в таблице (по умолчанию CLICKID_TABLE_MAX_SIZE)
+        """
+        self.max_size = max_size or CLICKID_TABLE_MAX_SIZE
+        # Блокировка на время пачки агрегации: коды не должны меняться посреди пачки
+        self.lock = threading.RLock()
+        self._codes: Dict[str, int] = {}
+        self._raw: Dict[Any, Optional[int]] = {}
+        self._strings: List[str] = []
+        self._cleaned: Dict[Any, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def clean(self, value: Any) -> Optional[str]:
+        """
+        Очищает значение clickid из ответа API (strip, без приведения регистра)
+
+        Для одинаковых значений возвращается один и тот же объект строки,
+        поэтому повторяющиеся clickid не занимают память в каждой строке отчета.
+        """
+        cleaned = self._cleaned.get(value, _MISSING)
+        if cleaned is _MISSING:
+            cleaned = str(value).strip() if value is not None else None
+            if not cleaned or cleaned.lower() in NULL_CLICKIDS:
+                cleaned = None
+            if len(self._cleaned) >= self.max_size:
+                self._cleaned.clear()
+            self._cleaned[value] = cleaned
+        return cleaned
+
+    def encode(self, value: Any) -> Optional[int]:
+        """
+        Возвращает код нормализованного clickid (None для пустых и null-значений)
+
+        Нормализация выполняется один раз на каждое различное исходное значение.
+        """
+        code = self._raw.get(value, _MISSING)
+        if code is _MISSING:
+            normalized = normalize_clickid(value)
+            if normalized is None:
+                code = None
+            else:
+                code = self._codes.get(normalized)
+                if code is None:
+                    code = len(self._strings)
+                    self._codes[normalized] = code
+                    self._strings.append(normalized)
+            self._raw[value] = code
+        return code
+
+    def decode(self, code: int) -> str:
+        """Нормализованный clickid по коду"""
+        return self._strings[code]
+
+    def reset(self):
+        """Очищает таблицу (вызывать только между пачками)"""
+        with self.lock:
+            self._codes = {}
+            self._raw = {}
+            self._strings = []
+            self._cleaned = {}
+
+    def reset_if_full(self) -> bool:
+        """Сбрасывает таблицу, если она превысила max_size (вызывать только между пачками)"""
+        if len(self._raw) <= self.max_size:
+            return False
+        self.reset()
+        return True
+
+
+_table: Optional[ClickidTable] = None
+_table_lock = threading.Lock()
+
+
+def get_clickid_table() -> ClickidTable:
+    """Общая таблица clickid для процесса"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = ClickidTable()
+    return _table
+
+
+def reset_clickid_table():
+    """Очищает общую таблицу clickid в конце запуска ETL"""
+    if _table is not None:
+        _table.reset()
@@ -16,9 +16,144 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME'),
 }
 
+# Размер пула соединений с БД (используется в режиме serve, где соединения держатся "теплыми")
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 3))
+
+# Бэкенд БД: mysql (по умолчанию) или встроенные sqlite / duckdb для офлайн-бенчмарков (см. db_backend.py)
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+# Файл встроенной БД (по умолчанию affilka_etl.sqlite / affilka_etl.duckdb)
+DB_PATH = os.getenv('DB_PATH', '')
+
 # Affilka API configuration
 AFFILKA_API_ENDPOINT = '/api/customer/v1/partner/report'
 
+# HTTP-транспорт для Affilka API (см. transport.py)
+# Таймауты: подключение и ожидание данных (большие отчеты считаются долго), секунды
+AFFILKA_HTTP_CONNECT_TIMEOUT = float(os.getenv('AFFILKA_HTTP_CONNECT_TIMEOUT', 10))
+AFFILKA_HTTP_READ_TIMEOUT = float(os.getenv('AFFILKA_HTTP_READ_TIMEOUT', 300))
+# Количество соединений на хост (должно быть не меньше ETL_PIPELINE_FETCHERS)
+AFFILKA_HTTP_POOL_SIZE = int(os.getenv('AFFILKA_HTTP_POOL_SIZE', 10))
+# Повторы при ошибках подключения и ответах 429/502/503/504
+AFFILKA_HTTP_RETRIES = int(os.getenv('AFFILKA_HTTP_RETRIES', 3))
+AFFILKA_HTTP_BACKOFF = float(os.getenv('AFFILKA_HTTP_BACKOFF', 1.0))
+# Сжатие ответов (gzip/deflate, br - если установлен brotli)
+AFFILKA_HTTP_COMPRESSION = os.getenv('AFFILKA_HTTP_COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+# HTTP/2 (несколько отчетов к одному хосту по одному соединению), нужен пакет httpx[http2]
+AFFILKA_HTTP2 = os.getenv('AFFILKA_HTTP2', '').lower() in ('1', 'true', 'yes')
+# Значение заголовка Version, который исторически отправляется в API (пустая строка - не отправлять)
+AFFILKA_HTTP_VERSION_HEADER = os.getenv('AFFILKA_HTTP_VERSION_HEADER', 'HTTP/1.0')
+
+# Хранилище сырых ответов API (см. raw_store.py)
+RAW_STORE_ENABLED = os.getenv('RAW_STORE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RAW_STORE_DIR = os.getenv('RAW_STORE_DIR', 'raw_store')
+# Сколько дней хранить сырые ответы (0 - бессрочно)
+RAW_STORE_RETENTION_DAYS = int(os.getenv('RAW_STORE_RETENTION_DAYS', 90))
+# ETL использует сохраненный ответ не старше этого возраста (в минутах) вместо запроса к API.
+# По умолчанию 0: ETL всегда запрашивает API и только архивирует ответ. Включать явно,
+# например для повторного запуска после ошибки загрузки
+RAW_STORE_MAX_AGE_MINUTES = float(os.getenv('RAW_STORE_MAX_AGE_MINUTES', 0))
+# Возраст сохраненного ответа (в минутах), который используют диагностические скрипты
+# (debug_api_response.py, check_api_data*.py) вместо повторного запроса к API
+RAW_STORE_REUSE_MINUTES = float(os.getenv('RAW_STORE_REUSE_MINUTES', 60))
+
+# Дисковый кеш HTTP-ответов API (см. http_cache.py), включается явно
+HTTP_CACHE_ENABLED = os.getenv('HTTP_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', '.http_cache')
+HTTP_CACHE_MAX_MB = float(os.getenv('HTTP_CACHE_MAX_MB', 512))
+# TTL для отчетов по прошлым дням текущего месяца и для отчетов, включающих сегодня (минуты).
+# Отчеты за закрытые прошлые месяцы кешируются бессрочно
+HTTP_CACHE_TTL_PAST_MINUTES = float(os.getenv('HTTP_CACHE_TTL_PAST_MINUTES', 360))
+HTTP_CACHE_TTL_TODAY_MINUTES = float(os.getenv('HTTP_CACHE_TTL_TODAY_MINUTES', 10))
+
+# Библиотека для декодирования JSON ответов API: auto (orjson > ujson > json), orjson, ujson, json
+AFFILKA_JSON_BACKEND = os.getenv('AFFILKA_JSON_BACKEND', 'auto').lower()
+
+# Сохранять поля ответа API, которые не маппятся в fact_click_month, в строках отчета (для отладки)
+AFFILKA_KEEP_DEBUG_FIELDS = os.getenv('AFFILKA_KEEP_DEBUG_FIELDS', '').lower() in ('1', 'true', 'yes')
+
+# Кеш /report/attributes (доступные колонки и группировки) на каждый base_url, минуты
+AFFILKA_ATTRIBUTES_TTL_MINUTES = float(os.getenv('AFFILKA_ATTRIBUTES_TTL_MINUTES', 60))
+# Проверка columns/group_by перед запросом отчета:
+#   trim   - неподдерживаемые колонки удаляются из запроса (по умолчанию)
+#   reject - запрос с неподдерживаемыми колонками не отправляется
+#   off    - без проверки
+AFFILKA_COLUMN_VALIDATION = os.getenv('AFFILKA_COLUMN_VALIDATION', 'trim').lower()
+
+# Колонки отчета, которые реально сохраняются в fact_click_month (см. parse_report_data)
+PERSISTED_REPORT_COLUMNS = [
+    'first_deposits_count',  # ftd
+    'deposits_count',        # dep_cnt
+    'deposits_sum',          # dep_sum
+    'partner_income',        # cpa
+    'clean_net_revenue',     # cpa (альтернатива partner_income)
+    'ngr',                   # ngr
+]
+
+# Стандартные колонки и группировка для запуска ETL (main.py, режим serve)
+DEFAULT_REPORT_COLUMNS = ['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr']
+DEFAULT_REPORT_GROUP_BY = ['month', 'dynamic_tag_visit_id']
+
+# Расписание по умолчанию для режима serve: интервал (15m, 1h, 1d) или cron-выражение
+ETL_SCHEDULE = os.getenv('ETL_SCHEDULE', '1d')
+
+# Ограничение времени запуска (--time-budget / --deadline в main.py)
+# Ожидаемая длительность обработки аккаунта, для которого еще нет истории запусков (сек)
+ETL_DEFAULT_ACCOUNT_DURATION = float(os.getenv('ETL_DEFAULT_ACCOUNT_DURATION', 120))
+# Бюджет времени на запуск в минутах (0 - без ограничения)
+ETL_TIME_BUDGET_MINUTES = float(os.getenv('ETL_TIME_BUDGET_MINUTES', 0))
+
+# Конвейерный режим (fetch/transform/load параллельно, см. pipeline.py)
+ETL_PIPELINE = os.getenv('ETL_PIPELINE', '').lower() in ('1', 'true', 'yes')
+ETL_PIPELINE_FETCHERS = int(os.getenv('ETL_PIPELINE_FETCHERS', 4))
+ETL_PIPELINE_LOADERS = int(os.getenv('ETL_PIPELINE_LOADERS', 2))
+ETL_PIPELINE_QUEUE_SIZE = int(os.getenv('ETL_PIPELINE_QUEUE_SIZE', 4))
+ETL_PIPELINE_WINDOW_DAYS = int(os.getenv('ETL_PIPELINE_WINDOW_DAYS', 7))
+
+# Параллельный парсинг больших отчетов в пуле процессов (см. parallel_parse.py):
+# количество процессов (0 или 1 - выключено) и минимальный размер отчета в строках
+AFFILKA_PARSE_PROCESSES = int(os.getenv('AFFILKA_PARSE_PROCESSES', 0))
+AFFILKA_PARSE_PARALLEL_THRESHOLD = int(os.getenv('AFFILKA_PARSE_PARALLEL_THRESHOLD', 200000))
+
+# Размер общей таблицы clickid (словарное кодирование в transform, см. clickid_codes.py);
+# при превышении таблица сбрасывается между пачками, в конце каждого запуска - всегда
+CLICKID_TABLE_MAX_SIZE = int(os.getenv('CLICKID_TABLE_MAX_SIZE', 2000000))
+
+# Агрегация с ограничением памяти (см. external_agg.py): сколько групп (period_date, clickid)
+# держать в памяти до сброса на диск, количество хеш-партиций и каталог временных файлов
+ETL_AGG_MAX_GROUPS = int(os.getenv('ETL_AGG_MAX_GROUPS', 500000))
+ETL_AGG_SPILL_PARTITIONS = int(os.getenv('ETL_AGG_SPILL_PARTITIONS', 16))
+ETL_AGG_SPILL_DIR = os.getenv('ETL_AGG_SPILL_DIR', '')
+# Размер пачки при загрузке в БД
+ETL_LOAD_BATCH_SIZE = int(os.getenv('ETL_LOAD_BATCH_SIZE', 50000))
+
+# Учет пропущенных строк (см. reject_sink.py): каталог для выборки (пусто - без файла),
+# доля строк в выборке, количество примеров на причину в логе и максимум строк в файле выборки
+REJECT_SINK_DIR = os.getenv('REJECT_SINK_DIR', 'rejects')
+REJECT_SAMPLE_RATE = float(os.getenv('REJECT_SAMPLE_RATE', 0.01))
+REJECT_MAX_EXAMPLES = int(os.getenv('REJECT_MAX_EXAMPLES', 5))
+REJECT_MAX_FILE_ROWS = int(os.getenv('REJECT_MAX_FILE_ROWS', 10000))
+
+# Метрики запуска (см. run_metrics.py): каталог JSON-отчетов (пусто - не сохранять),
+# файл для textfile collector node_exporter и адрес Prometheus Pushgateway (пусто - выключено)
+ETL_METRICS_DIR = os.getenv('ETL_METRICS_DIR', 'metrics')
+ETL_METRICS_TEXTFILE = os.getenv('ETL_METRICS_TEXTFILE', '')
+ETL_METRICS_PUSHGATEWAY = os.getenv('ETL_METRICS_PUSHGATEWAY', '')
+# Сохранять каждый запуск и его стадии в таблицы etl_runs / etl_run_stages (для main.py stats)
+ETL_RUNS_LEDGER = os.getenv('ETL_RUNS_LEDGER', 'true').lower() in ('1', 'true', 'yes')
+
+# Профилирование стадий (см. profiling.py, main.py --profile): cprofile, tracemalloc, sampling (пусто - выключено),
+# каталог артефактов, интервал сэмплирования (мс) и размер топа в текстовых отчетах
+ETL_PROFILE = os.getenv('ETL_PROFILE', '').lower()
+ETL_PROFILE_DIR = os.getenv('ETL_PROFILE_DIR', 'profiles')
+ETL_PROFILE_INTERVAL_MS = float(os.getenv('ETL_PROFILE_INTERVAL_MS', 5))
+ETL_PROFILE_TOP = int(os.getenv('ETL_PROFILE_TOP', 30))
+
+# Аналитика (analytics.py, main.py analytics): сколько строк результата читать с сервера за раз
+ANALYTICS_FETCH_SIZE = int(os.getenv('ANALYTICS_FETCH_SIZE', 5000))
+# Пересчитывать агрегаты agg_offer_buyer_month / agg_offer_player_types после загрузки
+# (только месяцы и аккаунты, затронутые запуском; отчеты offers, mapping, offer-types читают их)
+ETL_ROLLUPS = os.getenv('ETL_ROLLUPS', 'true').lower() in ('1', 'true', 'yes')
+
 # Поддержка множественных аккаунтов (URL + токен)
 def get_affilka_accounts() -> List[Dict[str, str]]:
     """
@@ -33,12 +168,20 @@ def get_affilka_accounts() -> List[Dict[str, str]]:
     - AFFILKA_TOKEN_2 - основной токен для второй группы
     - и т.д.
     
+    Расписание для режима serve (опционально):
+    - AFFILKA_SCHEDULE_N - расписание для всей группы N
+    - AFFILKA_SCHEDULE_N_M - расписание для токена AFFILKA_TOKEN_N_M
+    Если расписание не задано (schedule=None), используется ETL_SCHEDULE.
+    
     Также поддерживается старый формат для обратной совместимости:
     - AFFILKA_BASE_URL + AFFILKA_TOKEN (один аккаунт)
     - AFFILKA_ACCOUNTS=url1|token1,url2|token2 (пары через запятую)
     
+    AFFILKA_API_OVERRIDE (или main.py --api-override) заменяет URL всех аккаунтов,
+    например на локальный mock API; без настроенных аккаунтов создается один с токеном 'mock'.
+    
     Returns:
-        Список словарей с ключами 'url' и 'token'
+        Список словарей с ключами 'url', 'token' и 'schedule'
     """
     accounts = []
     
@@ -49,13 +192,14 @@ def get_affilka_accounts() -> List[Dict[str, str]]:
         if not base_url:
             break
         
-        # Ищем все токены для этого URL
+        # Ищем все токены для этого URL (вместе с расписанием для режима serve)
         tokens_for_url = []
+        group_schedule = os.getenv(f'AFFILKA_SCHEDULE_{i}')
         
         # Основной токен: AFFILKA_TOKEN_N
         main_token = os.getenv(f'AFFILKA_TOKEN_{i}')
         if main_token:
-            tokens_for_url.append(main_token)
+            tokens_for_url.append((main_token, group_schedule))
         
         # Дополнительные токены: AFFILKA_TOKEN_N_M (где M = 1, 2, 3...)
         j = 1
@@ -63,12 +207,12 @@ def get_affilka_accounts() -> List[Dict[str, str]]:
             additional_token = os.getenv(f'AFFILKA_TOKEN_{i}_{j}')
             if not additional_token:
                 break
-            tokens_for_url.append(additional_token)
+            tokens_for_url.append((additional_token, os.getenv(f'AFFILKA_SCHEDULE_{i}_{j}') or group_schedule))
             j += 1
         
         # Создаем аккаунты для каждого токена с этим URL
-        for token in tokens_for_url:
-            accounts.append({'url': base_url, 'token': token})
+        for token, schedule in tokens_for_url:
+            accounts.append({'url': base_url, 'token': token, 'schedule': schedule})
         
         i += 1
     
@@ -84,14 +228,14 @@ def get_affilka_accounts() -> List[Dict[str, str]]:
                         url = parts[0].strip()
                         token = parts[1].strip()
                         if url and token:
-                            accounts.append({'url': url, 'token': token})
+                            accounts.append({'url': url, 'token': token, 'schedule': None})
     
     # Старый формат 2: один аккаунт AFFILKA_BASE_URL + AFFILKA_TOKEN (для обратной совместимости)
     if not accounts:
         base_url = os.getenv('AFFILKA_BASE_URL', 'https://admin.kawaii.partners')
         token = os.getenv('AFFILKA_TOKEN')
         if token:
-            accounts.append({'url': base_url, 'token': token})
+            accounts.append({'url': base_url, 'token': token, 'schedule': None})
     
     # Старый формат 3: только токены с дефолтным URL (для обратной совместимости)
     if not accounts:
@@ -101,7 +245,15 @@ def get_affilka_accounts() -> List[Dict[str, str]]:
             for token in tokens_env.split(','):
                 token = token.strip()
                 if token:
-                    accounts.append({'url': base_url, 'token': token})
+                    accounts.append({'url': base_url, 'token': token, 'schedule': None})
+    
+    # Подмена адреса API для всех аккаунтов (локальный mock, см. mock_affilka_server.py)
+    api_override = os.getenv('AFFILKA_API_OVERRIDE')
+    if api_override:
+        if not accounts:
+            accounts.append({'url': api_override, 'token': 'mock', 'schedule': None})
+        for account in accounts:
+            account['url'] = api_override.rstrip('/')
     
     return accounts
 
@@ -1,29 +1,107 @@
 """
 Модуль для работы с базой данных
+
+Диалект SQL и драйвер определяет бэкенд (db_backend.py): MySQL по умолчанию
+или встроенные SQLite / DuckDB (DB_BACKEND).
 """
-import mysql.connector
-from mysql.connector import Error
-from typing import List, Dict, Any, Optional
-from config import DB_CONFIG
+from datetime import date, datetime, timedelta
+from mysql.connector.pooling import MySQLConnectionPool
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+from config import DB_CONFIG, DB_POOL_SIZE, ANALYTICS_FETCH_SIZE
+from db_backend import DatabaseError as Error, create_backend
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def create_connection_pool(pool_size: Optional[int] = None) -> Optional[MySQLConnectionPool]:
+    """
+    Создает пул соединений с БД
+    
+    Используется в долгоживущем режиме (serve), чтобы не устанавливать
+    новое соединение на каждый запуск ETL.
+    
+    Args:
+        pool_size: Размер пула (по умолчанию DB_POOL_SIZE)
+    
+    Returns:
+        Пул или None для встроенных БД (соединение с файлом открывается быстро и пул не нужен)
+    """
+    backend = create_backend()
+    if backend.embedded:
+        logger.debug(f"Пул соединений не используется для встроенной БД {backend}")
+        return None
+    pool = MySQLConnectionPool(
+        pool_name='affilka_etl',
+        pool_size=pool_size or DB_POOL_SIZE,
+        pool_reset_session=True,
+        **DB_CONFIG
+    )
+    logger.info(f"Создан пул соединений с БД (размер: {pool.pool_size})")
+    return pool
+
+
+def _as_date(value: Any) -> Optional[date]:
+    """Дата из date / datetime / строки YYYY-MM-DD (встроенные БД возвращают даты строками)"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _rollup_months(from_date: str, to_date: str, today: Optional[date] = None) -> List[date]:
+    """Первые числа месяцев периода и следующего за ним месяца, если он уже наступил"""
+    today = today or datetime.now().date()
+    start = _as_date(from_date).replace(day=1)
+    end = _as_date(to_date).replace(day=1)
+    months = []
+    month = start
+    while month <= end or (month == _next_month(end) and month <= today):
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
 class Database:
     """Класс для работы с базой данных"""
     
-    def __init__(self):
+    def __init__(self, pool: Optional[MySQLConnectionPool] = None, backend=None):
+        """
+        Args:
+            pool: Пул соединений (опционально). Если указан, соединение берется из пула
+                  и возвращается в него при отключении
+            backend: Бэкенд БД (по умолчанию по DB_BACKEND, см. db_backend.create_backend)
+        """
+        self.pool = pool
+        self.backend = backend or create_backend()
         self.connection = None
         self.cursor = None
+        self._cohort_ready = False
     
     def connect(self):
         """Подключение к базе данных"""
         try:
-            self.connection = mysql.connector.connect(**DB_CONFIG)
+            if self.pool is not None:
+                self.connection = self.pool.get_connection()
+                # Соединение могло быть закрыто сервером, пока лежало в пуле
+                if not self.connection.is_connected():
+                    self.connection.reconnect(attempts=3, delay=1)
+            else:
+                self.connection = self.backend.connect()
             if self.connection.is_connected():
                 self.cursor = self.connection.cursor(dictionary=True)
-                logger.info("Успешное подключение к базе данных")
+                if self.pool is not None:
+                    logger.debug("Получено соединение из пула")
+                else:
+                    logger.info("Успешное подключение к базе данных")
                 return True
         except Error as e:
             logger.error(f"Ошибка подключения к БД: {e}")
@@ -33,7 +111,13 @@ class Database:
         """Отключение от базы данных"""
         if self.cursor:
             self.cursor.close()
-        if self.connection and self.connection.is_connected():
+            self.cursor = None
+        if self.pool is not None and self.connection is not None:
+            # Для соединения из пула close() возвращает его в пул
+            self.connection.close()
+            self.connection = None
+            logger.debug("Соединение возвращено в пул")
+        elif self.connection and self.connection.is_connected():
             self.connection.close()
             logger.info("Отключение от базы данных")
     
@@ -46,28 +130,65 @@ class Database:
             logger.error(f"Ошибка получения схемы таблицы {table_name}: {e}")
             return None
     
-    def upsert_fact_click_month(self, data: List[Dict[str, Any]], account_id: Optional[str] = None):
+    def begin(self):
+        """
+        Начинает транзакцию для загрузки из нескольких пачек (upsert_fact_click_month с commit=False)
+        
+        mysql.connector работает без autocommit, и транзакция начинается неявно;
+        во встроенных БД она открывается явно на курсоре.
+        """
+        if self.backend.embedded:
+            self.cursor.begin()
+    
+    def commit(self):
+        """Фиксирует транзакцию, начатую begin()"""
+        if self.backend.embedded:
+            self.cursor.commit()
+        else:
+            self.connection.commit()
+    
+    def rollback(self):
+        """Откатывает транзакцию, начатую begin()"""
+        if not self.connection:
+            return
+        if not self.backend.embedded:
+            self.connection.rollback()
+            return
+        try:
+            self.cursor.rollback()
+        except Error:
+            # Нет открытой транзакции (запрос уже зафиксирован или откатан)
+            pass
+    
+    def upsert_fact_click_month(self, data: List[Dict[str, Any]], account_id: Optional[str] = None, commit: bool = True):
         """
         Выполняет upsert данных в таблицу fact_click_month
         
         Args:
             data: Список словарей с данными для вставки
             account_id: Идентификатор аккаунта (для масштабирования)
+            commit: Фиксировать транзакцию; False - пачка входит в транзакцию,
+                начатую begin() (загрузка окна из нескольких пачек целиком или никак)
+        
+        Returns:
+            Количество затронутых строк (rowcount MySQL: 1 - вставка, 2 - обновление, 0 - без изменений)
         """
         if not data:
             logger.warning("Нет данных для загрузки")
-            return
+            return 0
         
         try:
             # Получаем схему таблицы для определения полей
             schema = self.get_table_schema()
             if not schema:
                 logger.error("Не удалось получить схему таблицы")
-                return
+                return 0
             
             # Извлекаем имена колонок и их типы
             columns = [col['Field'] for col in schema]
             column_types = {col['Field']: col['Type'] for col in schema}
+            # DDL в MySQL неявно коммитит транзакцию, поэтому таблица когорт создается до загрузки
+            self.ensure_cohort_table()
             
             # Определяем ключевые поля для upsert
             # Проверяем наличие полей в таблице
@@ -93,7 +214,7 @@ class Database:
             
             if not key_fields:
                 logger.error("Не найдены ключевые поля для upsert (period_date/period/date, clickid)")
-                return
+                return 0
             
             # Маппинг полей из данных к полям БД
             field_mapping = {
@@ -123,22 +244,25 @@ class Database:
             
             if not insert_columns:
                 logger.error("Не найдено полей для вставки")
-                return
+                return 0
             
             placeholders = ', '.join(['%s'] * len(insert_columns))
             columns_str = ', '.join(insert_columns)
             
             # Для ON DUPLICATE KEY UPDATE обновляем все поля кроме ключевых
-            update_fields = [f"{col} = VALUES({col})" for col in insert_columns if col not in key_fields]
+            inserted = self.backend.inserted
+            update_fields = [f"{col} = {inserted(col)}" for col in insert_columns if col not in key_fields]
             if not update_fields:
                 # Если нет полей для обновления, просто обновляем все
-                update_fields = [f"{col} = VALUES({col})" for col in insert_columns if col not in key_fields]
-            update_str = ', '.join(update_fields) if update_fields else f"{insert_columns[0]} = VALUES({insert_columns[0]})"
+                update_fields = [f"{col} = {inserted(col)}" for col in insert_columns if col not in key_fields]
+            update_str = ', '.join(update_fields) if update_fields else f"{insert_columns[0]} = {inserted(insert_columns[0])}"
             
+            # Конфликт во встроенных БД определяется по первичному ключу (в MySQL - по любому уникальному)
+            conflict_columns = [col['Field'] for col in schema if col.get('Key') == 'PRI'] or key_fields
             sql = f"""
                 INSERT INTO fact_click_month ({columns_str})
                 VALUES ({placeholders})
-                ON DUPLICATE KEY UPDATE {update_str}
+                {self.backend.upsert_clause(conflict_columns)} {update_str}
             """
             
             # Подготавливаем данные для вставки
@@ -174,14 +298,54 @@ class Database:
             
             # Выполняем batch insert
             self.cursor.executemany(sql, values_list)
-            self.connection.commit()
+            affected = self.cursor.rowcount
+            # Первые FTD игроков - в player_cohort в той же транзакции
+            self._upsert_player_cohort(data, account_id if 'account_id' in columns and account_id else '')
+            if commit:
+                self.connection.commit()
             
             logger.info(f"Успешно загружено {len(data)} записей в fact_click_month")
+            return max(affected, 0)
             
         except Error as e:
             logger.error(f"Ошибка при загрузке данных: {e}")
-            if self.connection:
-                self.connection.rollback()
+            self.rollback()
+            raise
+    
+    def delete_fact_click_month(self, account_id: Optional[str], from_date: date, to_date: date, commit: bool = True) -> int:
+        """
+        Удаляет строки Affilka из fact_click_month за период (перед повторной загрузкой периода)
+        
+        Args:
+            account_id: Аккаунт (если в таблице нет account_id - строки всех аккаунтов)
+            from_date: Начальная дата period_date включительно
+            to_date: Конечная дата period_date включительно
+            commit: Фиксировать транзакцию; False - удаление входит в транзакцию, начатую begin()
+        
+        Returns:
+            Количество удаленных строк
+        """
+        try:
+            schema = self.get_table_schema()
+            if not schema:
+                logger.error("Не удалось получить схему таблицы")
+                return 0
+            columns = [col['Field'] for col in schema]
+            
+            where = "source = 'affilka' AND period_date >= %s AND period_date <= %s"
+            params: List[Any] = [from_date, to_date]
+            if 'account_id' in columns and account_id:
+                where += " AND account_id = %s"
+                params.append(account_id)
+            self.cursor.execute(f"DELETE FROM fact_click_month WHERE {where}", params)
+            deleted = max(self.cursor.rowcount, 0)
+            if commit:
+                self.connection.commit()
+            return deleted
+            
+        except Error as e:
+            logger.error(f"Ошибка при удалении данных из fact_click_month: {e}")
+            self.rollback()
             raise
     
     def enrich_dims_from_keitaro(self, period_date_start: Optional[str] = None, period_date_end: Optional[str] = None):
@@ -215,13 +379,7 @@ class Database:
             columns = [col['Field'] for col in schema]
             
             # Формируем список полей для обновления
-            update_fields = []
-            if 'buyer_id' in columns:
-                update_fields.append('f.buyer_id = v.buyer_id')
-            if 'offer_id' in columns:
-                update_fields.append('f.offer_id = v.offer_id')
-            if 'creative_id' in columns:
-                update_fields.append('f.creative_id = v.creative_id')
+            update_fields = [field for field in ('buyer_id', 'offer_id', 'creative_id') if field in columns]
             
             if not update_fields:
                 logger.warning("Не найдено полей для обогащения (buyer_id, offer_id, creative_id)")
@@ -230,10 +388,7 @@ class Database:
             # Формируем WHERE условие для периода
             # Обновляем только записи, где хотя бы одно из полей NULL
             where_conditions = ["f.source = 'affilka'"]
-            where_conditions.append("(" + " OR ".join([
-                f"f.{field.split('=')[0].split('.')[-1].strip()} IS NULL" 
-                for field in update_fields
-            ]) + ")")
+            where_conditions.append("(" + " OR ".join([f"f.{field} IS NULL" for field in update_fields]) + ")")
             
             params = []
             if period_date_start:
@@ -244,24 +399,37 @@ class Database:
                 where_conditions.append("f.period_date <= %s")
                 params.append(period_date_end)
             
-            where_clause = "WHERE " + " AND ".join(where_conditions)
+            where_conditions.append("v.clickid IS NOT NULL")
             
             # Обновляем поля через JOIN с v_click_dims
             # Используем LOWER(TRIM()) для нормализации clickid при сравнении (как в v_click_dims)
-            update_sql = f"""
-                UPDATE fact_click_month f
-                INNER JOIN v_click_dims v ON LOWER(TRIM(f.clickid)) = LOWER(TRIM(v.clickid))
-                SET {', '.join(update_fields)}
-                {where_clause}
-                    AND v.clickid IS NOT NULL
-            """
+            update_sql = self.backend.update_join_sql(
+                'fact_click_month', 'f', 'v_click_dims', 'v',
+                keys=("LOWER(TRIM(f.clickid))", "LOWER(TRIM(v.clickid))"),
+                assignments={field: f"v.{field}" for field in update_fields},
+                where=where_conditions
+            )
             
             self.cursor.execute(update_sql, params)
             updated_count = self.cursor.rowcount
+            
+            # Оффер когорты берется из того же v_click_dims, с той же нормализацией clickid
+            if 'offer_id' in update_fields and self.table_exists('player_cohort'):
+                cohort_where = ["c.offer_id IS NULL", "v.offer_id IS NOT NULL"]
+                if period_date_start:
+                    cohort_where.append("c.ftd_date >= %s")
+                if period_date_end:
+                    cohort_where.append("c.ftd_date <= %s")
+                self.cursor.execute(self.backend.update_join_sql(
+                    'player_cohort', 'c', 'v_click_dims', 'v',
+                    keys=("LOWER(TRIM(c.clickid))", "LOWER(TRIM(v.clickid))"),
+                    assignments={'offer_id': "v.offer_id"},
+                    where=cohort_where
+                ), params)
             self.connection.commit()
             
             if updated_count > 0:
-                fields_str = ', '.join([f.split('=')[0].split('.')[-1].strip() for f in update_fields])
+                fields_str = ', '.join(update_fields)
                 logger.info(f"Обновлено {updated_count} записей с полями ({fields_str}) из Keitaro через v_click_dims")
             else:
                 logger.debug("Нет записей для обогащения из Keitaro")
@@ -274,6 +442,624 @@ class Database:
                 self.connection.rollback()
             raise
     
+    def ensure_account_state_table(self):
+        """Создает таблицу etl_account_state (время последней успешной загрузки и длительность по аккаунтам)"""
+        if self.backend.embedded:
+            # Встроенные БД создают служебные таблицы при подключении (db_backend.EMBEDDED_SCHEMA)
+            return
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS etl_account_state (
+                account_id VARCHAR(64) NOT NULL PRIMARY KEY,
+                base_url VARCHAR(255) NULL,
+                last_success_at DATETIME NULL,
+                last_failure_at DATETIME NULL,
+                last_duration_sec DOUBLE NULL,
+                avg_duration_sec DOUBLE NULL,
+                successful_runs INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+        self.connection.commit()
+    
+    def get_account_states(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Возвращает состояние аккаунтов из etl_account_state
+        
+        Returns:
+            Словарь account_id -> строка etl_account_state
+        """
+        try:
+            self.ensure_account_state_table()
+            self.cursor.execute("SELECT * FROM etl_account_state")
+            return {row['account_id']: row for row in self.cursor.fetchall()}
+        except Error as e:
+            logger.warning(f"Не удалось прочитать etl_account_state: {e}")
+            return {}
+    
+    def record_account_run(
+        self,
+        account_id: str,
+        success: bool,
+        duration_sec: Optional[float] = None,
+        base_url: Optional[str] = None
+    ):
+        """
+        Записывает результат обработки аккаунта в etl_account_state
+        
+        Средняя длительность считается как экспоненциальное скользящее среднее
+        (новый запуск с весом 0.3), чтобы ожидание подстраивалось под рост данных.
+        
+        Args:
+            account_id: Идентификатор аккаунта
+            success: Успешно ли завершилась обработка
+            duration_sec: Длительность обработки в секундах (учитывается только для успешных)
+            base_url: URL аккаунта (для информации)
+        """
+        try:
+            self.ensure_account_state_table()
+            inserted = self.backend.inserted
+            upsert = self.backend.upsert_clause(['account_id'])
+            if success:
+                self.cursor.execute(f"""
+                    INSERT INTO etl_account_state
+                        (account_id, base_url, last_success_at, last_duration_sec, avg_duration_sec, successful_runs)
+                    VALUES (%s, %s, %s, %s, %s, 1)
+                    {upsert}
+                        base_url = {inserted('base_url')},
+                        last_success_at = {inserted('last_success_at')},
+                        avg_duration_sec = CASE
+                            WHEN {inserted('last_duration_sec')} IS NULL THEN avg_duration_sec
+                            WHEN avg_duration_sec IS NULL THEN {inserted('last_duration_sec')}
+                            ELSE avg_duration_sec * 0.7 + {inserted('last_duration_sec')} * 0.3
+                        END,
+                        last_duration_sec = COALESCE({inserted('last_duration_sec')}, last_duration_sec),
+                        successful_runs = successful_runs + 1
+                """, (account_id, base_url, datetime.now(), duration_sec, duration_sec))
+            else:
+                self.cursor.execute(f"""
+                    INSERT INTO etl_account_state (account_id, base_url, last_failure_at)
+                    VALUES (%s, %s, %s)
+                    {upsert}
+                        base_url = {inserted('base_url')},
+                        last_failure_at = {inserted('last_failure_at')}
+                """, (account_id, base_url, datetime.now()))
+            self.connection.commit()
+        except Error as e:
+            logger.warning(f"Не удалось записать состояние аккаунта {account_id}: {e}")
+            if self.connection:
+                self.connection.rollback()
+    
+    def ensure_run_tables(self):
+        """Создает таблицы etl_runs (запуски) и etl_run_stages (стадии запусков по аккаунтам)"""
+        if self.backend.embedded:
+            return
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS etl_runs (
+                run_id VARCHAR(64) NOT NULL PRIMARY KEY,
+                mode VARCHAR(16) NOT NULL,
+                version VARCHAR(64) NULL,
+                started_at DATETIME NOT NULL,
+                finished_at DATETIME NULL,
+                duration_sec DOUBLE NULL,
+                cpu_sec DOUBLE NULL,
+                peak_rss_bytes BIGINT NULL,
+                rows_loaded BIGINT NOT NULL DEFAULT 0,
+                api_bytes BIGINT NOT NULL DEFAULT 0,
+                success TINYINT(1) NOT NULL,
+                error_class VARCHAR(128) NULL,
+                KEY idx_etl_runs_started (started_at)
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS etl_run_stages (
+                id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                run_id VARCHAR(64) NOT NULL,
+                account_id VARCHAR(64) NULL,
+                stage VARCHAR(32) NOT NULL,
+                started_at DATETIME(3) NOT NULL,
+                finished_at DATETIME(3) NULL,
+                duration_sec DOUBLE NOT NULL,
+                cpu_sec DOUBLE NULL,
+                rows_in BIGINT NOT NULL DEFAULT 0,
+                rows_out BIGINT NOT NULL DEFAULT 0,
+                api_bytes BIGINT NOT NULL DEFAULT 0,
+                db_rows BIGINT NOT NULL DEFAULT 0,
+                peak_rss_bytes BIGINT NULL,
+                status VARCHAR(16) NOT NULL,
+                error_class VARCHAR(128) NULL,
+                version VARCHAR(64) NULL,
+                KEY idx_etl_run_stages_run (run_id),
+                KEY idx_etl_run_stages_started (started_at, stage)
+            )
+        """)
+        self.connection.commit()
+    
+    def record_run(self, report: Dict[str, Any]):
+        """
+        Сохраняет запуск и все его стадии в etl_runs / etl_run_stages
+        
+        Args:
+            report: Отчет о запуске (RunMetrics.report())
+        """
+        try:
+            self.ensure_run_tables()
+            stages = report.get('stages') or []
+            self.cursor.execute(f"""
+                {self.backend.replace_into} etl_runs
+                    (run_id, mode, version, started_at, finished_at, duration_sec, cpu_sec,
+                     peak_rss_bytes, rows_loaded, api_bytes, success, error_class)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                report['run_id'], report['mode'], report.get('version'),
+                report['started_at'], report.get('finished_at'), report.get('wall'), report.get('cpu'),
+                report.get('peak_rss'),
+                sum(stage['rows_out'] for stage in stages if stage['stage'] == 'load'),
+                sum(stage['bytes'] for stage in stages),
+                1 if report.get('success') else 0, report.get('error'),
+            ))
+            self.cursor.execute("DELETE FROM etl_run_stages WHERE run_id = %s", (report['run_id'],))
+            if stages:
+                self.cursor.executemany("""
+                    INSERT INTO etl_run_stages
+                        (run_id, account_id, stage, started_at, finished_at, duration_sec, cpu_sec,
+                         rows_in, rows_out, api_bytes, db_rows, peak_rss_bytes, status, error_class, version)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, [
+                    (
+                        report['run_id'], stage['account_id'], stage['stage'],
+                        stage['started_at'], stage['finished_at'], stage['wall'], stage['cpu'],
+                        stage['rows_in'], stage['rows_out'], stage['bytes'], stage['db_rows'],
+                        stage['process_peak_rss'], stage['status'], stage['error'], report.get('version'),
+                    )
+                    for stage in stages
+                ])
+            self.connection.commit()
+            logger.info(f"Запуск {report['run_id']} сохранен в etl_runs ({len(stages)} стадий)")
+        except Error as e:
+            logger.warning(f"Не удалось сохранить запуск {report.get('run_id')} в etl_runs: {e}")
+            if self.connection:
+                self.connection.rollback()
+    
+    def get_run_stages(self, days: int = 30, account_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает стадии запусков за последние days дней (для main.py stats)
+        
+        Args:
+            days: Глубина истории в днях
+            account_id: Только стадии этого аккаунта (опционально)
+        
+        Returns:
+            Строки etl_run_stages: run_id, stage, account_id, duration_sec, cpu_sec, rows_in, rows_out,
+            api_bytes, db_rows, status, error_class, version, started_at
+        """
+        self.ensure_run_tables()
+        sql = """
+            SELECT run_id, stage, account_id, duration_sec, cpu_sec, rows_in, rows_out, api_bytes, db_rows,
+                   status, error_class, version, started_at
+            FROM etl_run_stages
+            WHERE started_at >= %s
+        """
+        params: List[Any] = [datetime.now() - timedelta(days=days)]
+        if account_id:
+            sql += " AND account_id = %s"
+            params.append(account_id)
+        self.cursor.execute(sql + " ORDER BY started_at", params)
+        return self.cursor.fetchall()
+
+    def ensure_rollup_tables(self):
+        """Создает агрегаты agg_offer_buyer_month и agg_offer_player_types (см. refresh_rollups)"""
+        if self.backend.embedded:
+            return
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agg_offer_buyer_month (
+                period_month DATE NOT NULL,
+                account_id VARCHAR(64) NOT NULL,
+                offer_id INT NOT NULL,
+                buyer_id INT NOT NULL,
+                players INT NOT NULL DEFAULT 0,
+                new_players INT NOT NULL DEFAULT 0,
+                ftd INT NOT NULL DEFAULT 0,
+                dep_cnt INT NOT NULL DEFAULT 0,
+                dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                new_dep_cnt INT NOT NULL DEFAULT 0,
+                new_dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                new_ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                new_cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (period_month, account_id, offer_id, buyer_id)
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agg_offer_player_types (
+                period_month DATE NOT NULL,
+                account_id VARCHAR(64) NOT NULL,
+                offer_id INT NOT NULL,
+                new_players INT NOT NULL DEFAULT 0,
+                old_players INT NOT NULL DEFAULT 0,
+                reg_only_players INT NOT NULL DEFAULT 0,
+                players INT NOT NULL DEFAULT 0,
+                new_ftd INT NOT NULL DEFAULT 0,
+                ftd INT NOT NULL DEFAULT 0,
+                new_dep_cnt INT NOT NULL DEFAULT 0,
+                old_dep_cnt INT NOT NULL DEFAULT 0,
+                dep_cnt INT NOT NULL DEFAULT 0,
+                new_dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                old_dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                new_ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                old_ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                new_cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                old_cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (period_month, account_id, offer_id)
+            )
+        """)
+        self.connection.commit()
+    
+    def refresh_rollups(
+        self,
+        from_date: str,
+        to_date: str,
+        account_ids: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Пересчитывает агрегаты для аналитики за месяцы периода
+        
+        agg_offer_buyer_month - игроки (clickid) и метрики по (месяц, аккаунт, оффер, байер);
+        agg_offer_player_types - новые / старые игроки по (месяц, аккаунт, оффер), как в
+        analytics.offer_types. Каждая партиция (месяц, аккаунт) пересобирается целиком
+        из fact_click_month (DELETE + INSERT ... SELECT, коммит на месяц). Следующий
+        за периодом месяц тоже пересчитывается: старые игроки определяются по предыдущему месяцу.
+        
+        Args:
+            from_date: Начальная дата (YYYY-MM-DD)
+            to_date: Конечная дата (YYYY-MM-DD)
+            account_ids: Аккаунты для пересчета (по умолчанию все)
+        
+        Returns:
+            По строке на месяц: period_month, offer_buyer_rows, player_type_rows
+        """
+        try:
+            self.ensure_rollup_tables()
+            schema = self.get_table_schema()
+            if not schema:
+                logger.error("Не удалось получить схему таблицы fact_click_month")
+                return []
+            columns = [col['Field'] for col in schema]
+            
+            # Без колонки account_id все строки относятся к аккаунту ''
+            account = 'f.account_id' if 'account_id' in columns else "''"
+            offer = 'COALESCE(f.offer_id, 0)' if 'offer_id' in columns else '0'
+            buyer = 'COALESCE(f.buyer_id, 0)' if 'buyer_id' in columns else '0'
+            # Константы в GROUP BY не попадают (числа там означают номер колонки)
+            group_by = ', '.join(expr for expr in (account, 'f.clickid', offer, buyer) if expr.startswith(('f.', 'COALESCE')))
+            types_group_by = ', '.join(expr for expr in (account, 'f.clickid', 'f.offer_id') if expr.startswith('f.'))
+            
+            account_filter, fact_filter, account_params = '', '', []
+            if account_ids and 'account_id' in columns:
+                placeholders = ', '.join(['%s'] * len(account_ids))
+                account_filter = f" AND account_id IN ({placeholders})"
+                fact_filter = f" AND f.account_id IN ({placeholders})"
+                account_params = list(account_ids)
+            where = "f.source = 'affilka' AND f.period_date >= %s AND f.period_date <= %s" + fact_filter
+            
+            results = []
+            for month in _rollup_months(from_date, to_date):
+                month_end = _next_month(month) - timedelta(days=1)
+                previous = (month - timedelta(days=1)).replace(day=1)
+                params = [month, month_end] + account_params
+                previous_params = [previous, month - timedelta(days=1)] + account_params
+                
+                for table in ('agg_offer_buyer_month', 'agg_offer_player_types'):
+                    self.cursor.execute(
+                        f"DELETE FROM {table} WHERE period_month = %s{account_filter}", [month] + account_params
+                    )
+                
+                self.cursor.execute(f"""
+                    INSERT INTO agg_offer_buyer_month
+                        (period_month, account_id, offer_id, buyer_id, players, new_players, ftd,
+                         dep_cnt, dep_sum, ngr, cpa, new_dep_cnt, new_dep_sum, new_ngr, new_cpa)
+                    SELECT %s, p.account_id, p.offer_id, p.buyer_id, COUNT(*),
+                           SUM(CASE WHEN p.ftd >= 1 THEN 1 ELSE 0 END), SUM(p.ftd),
+                           SUM(p.dep_cnt), SUM(p.dep_sum), SUM(p.ngr), SUM(p.cpa),
+                           SUM(CASE WHEN p.ftd >= 1 THEN p.dep_cnt ELSE 0 END),
+                           SUM(CASE WHEN p.ftd >= 1 THEN p.dep_sum ELSE 0 END),
+                           SUM(CASE WHEN p.ftd >= 1 THEN p.ngr ELSE 0 END),
+                           SUM(CASE WHEN p.ftd >= 1 THEN p.cpa ELSE 0 END)
+                    FROM (
+                        SELECT {account} AS account_id, f.clickid, {offer} AS offer_id, {buyer} AS buyer_id,
+                               MAX(f.ftd) AS ftd, SUM(f.dep_cnt) AS dep_cnt, SUM(f.dep_sum) AS dep_sum,
+                               SUM(f.ngr) AS ngr, SUM(f.cpa) AS cpa
+                        FROM fact_click_month f
+                        WHERE {where}
+                        GROUP BY {group_by}
+                    ) p
+                    GROUP BY p.account_id, p.offer_id, p.buyer_id
+                """, [month] + params)
+                offer_buyer_rows = max(self.cursor.rowcount, 0)
+                
+                player_type_rows = 0
+                if 'offer_id' in columns:
+                    # Классификация как в analytics.offer_types, но в пределах аккаунта
+                    self.cursor.execute(f"""
+                        INSERT INTO agg_offer_player_types
+                            (period_month, account_id, offer_id, new_players, old_players, reg_only_players, players,
+                             new_ftd, ftd, new_dep_cnt, old_dep_cnt, dep_cnt, new_dep_sum, old_dep_sum, dep_sum,
+                             new_ngr, old_ngr, ngr, new_cpa, old_cpa, cpa)
+                        SELECT %s, c.account_id, c.offer_id,
+                               SUM(CASE WHEN c.player_type = 'new' THEN 1 ELSE 0 END),
+                               SUM(CASE WHEN c.player_type = 'old' THEN 1 ELSE 0 END),
+                               SUM(CASE WHEN c.player_type = 'registration_only' THEN 1 ELSE 0 END),
+                               COUNT(*),
+                               SUM(CASE WHEN c.player_type = 'new' THEN c.max_ftd ELSE 0 END), SUM(c.max_ftd),
+                               SUM(CASE WHEN c.player_type = 'new' THEN c.dep_cnt ELSE 0 END),
+                               SUM(CASE WHEN c.player_type = 'old' THEN c.dep_cnt ELSE 0 END), SUM(c.dep_cnt),
+                               SUM(CASE WHEN c.player_type = 'new' THEN c.dep_sum ELSE 0 END),
+                               SUM(CASE WHEN c.player_type = 'old' THEN c.dep_sum ELSE 0 END), SUM(c.dep_sum),
+                               SUM(CASE WHEN c.player_type = 'new' THEN c.ngr ELSE 0 END),
+                               SUM(CASE WHEN c.player_type = 'old' THEN c.ngr ELSE 0 END), SUM(c.ngr),
+                               SUM(CASE WHEN c.player_type = 'new' THEN c.cpa ELSE 0 END),
+                               SUM(CASE WHEN c.player_type = 'old' THEN c.cpa ELSE 0 END), SUM(c.cpa)
+                        FROM (
+                            SELECT md.account_id, md.offer_id, md.max_ftd, md.dep_cnt, md.dep_sum, md.ngr, md.cpa,
+                                   CASE
+                                       WHEN md.max_ftd >= 1 THEN 'new'
+                                       WHEN pp.clickid IS NOT NULL AND (md.dep_cnt > 0 OR md.ngr > 0) THEN 'old'
+                                       ELSE 'registration_only'
+                                   END AS player_type
+                            FROM (
+                                SELECT {account} AS account_id, f.clickid, f.offer_id, MAX(f.ftd) AS max_ftd,
+                                       SUM(f.dep_cnt) AS dep_cnt, SUM(f.dep_sum) AS dep_sum,
+                                       SUM(f.ngr) AS ngr, SUM(f.cpa) AS cpa
+                                FROM fact_click_month f
+                                WHERE {where} AND f.offer_id IS NOT NULL
+                                GROUP BY {types_group_by}
+                            ) md
+                            LEFT JOIN (
+                                SELECT DISTINCT {account} AS account_id, f.clickid
+                                FROM fact_click_month f
+                                WHERE {where}
+                            ) pp ON pp.clickid = md.clickid AND pp.account_id = md.account_id
+                        ) c
+                        GROUP BY c.account_id, c.offer_id
+                    """, [month] + params + previous_params)
+                    player_type_rows = max(self.cursor.rowcount, 0)
+                
+                self.connection.commit()
+                results.append({
+                    'period_month': month,
+                    'offer_buyer_rows': offer_buyer_rows,
+                    'player_type_rows': player_type_rows,
+                })
+            
+            accounts = ', '.join(account_ids) if account_ids else 'все аккаунты'
+            logger.info(f"Агрегаты пересчитаны за {len(results)} мес. ({accounts})")
+            return results
+            
+        except Error as e:
+            logger.error(f"Ошибка при пересчете агрегатов: {e}")
+            if self.connection:
+                self.connection.rollback()
+            raise
+    
+    def ensure_cohort_table(self):
+        """Создает таблицу player_cohort (первый FTD игрока в аккаунте)"""
+        if self._cohort_ready or self.backend.embedded:
+            return
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS player_cohort (
+                clickid VARCHAR(255) NOT NULL,
+                account_id VARCHAR(64) NOT NULL,
+                ftd_date DATE NOT NULL,
+                ftd_month DATE NOT NULL,
+                offer_id INT NULL,
+                PRIMARY KEY (clickid, account_id),
+                KEY idx_player_cohort_month (ftd_month, account_id),
+                KEY idx_player_cohort_date (ftd_date)
+            )
+        """)
+        self.connection.commit()
+        self._cohort_ready = True
+    
+    def _cohort_upsert_sql(self) -> str:
+        """
+        Upsert в player_cohort: остается самая ранняя дата FTD, оффер заполняется один раз
+        
+        ftd_month присваивается раньше ftd_date: в MySQL присваивания ON DUPLICATE KEY UPDATE
+        выполняются по порядку и следующие видят уже новое значение.
+        """
+        inserted = self.backend.inserted
+        return f"""
+            INSERT INTO player_cohort (clickid, account_id, ftd_date, ftd_month, offer_id)
+            VALUES (%s, %s, %s, %s, %s)
+            {self.backend.upsert_clause(['clickid', 'account_id'])}
+                ftd_month = CASE WHEN {inserted('ftd_date')} < ftd_date THEN {inserted('ftd_month')} ELSE ftd_month END,
+                ftd_date = CASE WHEN {inserted('ftd_date')} < ftd_date THEN {inserted('ftd_date')} ELSE ftd_date END,
+                offer_id = COALESCE(offer_id, {inserted('offer_id')})
+        """
+    
+    def _upsert_player_cohort(self, data: List[Dict[str, Any]], account_id: str) -> int:
+        """
+        Добавляет в player_cohort игроков с FTD из загружаемых строк (без коммита)
+        
+        Returns:
+            Количество игроков с FTD в data
+        """
+        firsts: Dict[str, Tuple[date, Any]] = {}
+        for row in data:
+            if (row.get('ftd') or 0) < 1 or not row.get('clickid'):
+                continue
+            ftd_date = _as_date(row.get('period_date'))
+            if ftd_date is None:
+                continue
+            known = firsts.get(row['clickid'])
+            if known is None or ftd_date < known[0]:
+                firsts[row['clickid']] = (ftd_date, row.get('offer_id'))
+        if firsts:
+            self.cursor.executemany(self._cohort_upsert_sql(), [
+                (clickid, account_id, ftd_date, ftd_date.replace(day=1), offer_id)
+                for clickid, (ftd_date, offer_id) in firsts.items()
+            ])
+        return len(firsts)
+    
+    def rebuild_player_cohort(
+        self,
+        from_date: str,
+        to_date: str,
+        account_ids: Optional[List[str]] = None
+    ) -> int:
+        """
+        Пересобирает player_cohort по fact_click_month за период
+        
+        Нужно для данных, загруженных до появления таблицы, и после ручных правок
+        fact_click_month. Игроки с первым FTD раньше периода сохраняют свою дату.
+        
+        Args:
+            from_date: Начальная дата (YYYY-MM-DD)
+            to_date: Конечная дата (YYYY-MM-DD)
+            account_ids: Аккаунты (по умолчанию все)
+        
+        Returns:
+            Количество игроков с FTD в периоде
+        """
+        try:
+            self.ensure_cohort_table()
+            schema = self.get_table_schema()
+            if not schema:
+                logger.error("Не удалось получить схему таблицы fact_click_month")
+                return 0
+            columns = [col['Field'] for col in schema]
+            
+            has_account = 'account_id' in columns
+            where = "source = 'affilka' AND period_date >= %s AND period_date <= %s AND ftd >= 1"
+            params: List[Any] = [from_date, to_date]
+            account_filter, account_params = '', []
+            if account_ids and has_account:
+                account_filter = f" AND account_id IN ({', '.join(['%s'] * len(account_ids))})"
+                account_params = list(account_ids)
+            
+            self.cursor.execute(f"""
+                SELECT clickid, {'account_id' if has_account else "''"} AS account_id,
+                       MIN(period_date) AS ftd_date, {'MAX(offer_id)' if 'offer_id' in columns else 'NULL'} AS offer_id
+                FROM fact_click_month
+                WHERE {where}{account_filter}
+                GROUP BY clickid{', account_id' if has_account else ''}
+            """, params + account_params)
+            players = self.cursor.fetchall()
+            
+            self.cursor.execute(
+                f"DELETE FROM player_cohort WHERE ftd_date >= %s AND ftd_date <= %s{account_filter}",
+                params + account_params
+            )
+            if players:
+                values = []
+                for row in players:
+                    ftd_date = _as_date(row['ftd_date'])
+                    values.append((row['clickid'], row['account_id'], ftd_date, ftd_date.replace(day=1), row['offer_id']))
+                self.cursor.executemany(self._cohort_upsert_sql(), values)
+            self.connection.commit()
+            logger.info(f"player_cohort пересобрана за {from_date} - {to_date}: {len(players)} игроков с FTD")
+            return len(players)
+            
+        except Error as e:
+            logger.error(f"Ошибка при пересборке player_cohort: {e}")
+            if self.connection:
+                self.connection.rollback()
+            raise
+    
+    def ensure_reconcile_table(self):
+        """Создает таблицу reconcile_gap (разница итогов API и БД после успешной сверки, reconcile.py)"""
+        if self.backend.embedded:
+            return
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reconcile_gap (
+                account_id VARCHAR(64) NOT NULL,
+                period_date DATE NOT NULL,
+                ftd DOUBLE NOT NULL DEFAULT 0,
+                dep_cnt DOUBLE NOT NULL DEFAULT 0,
+                dep_sum DOUBLE NOT NULL DEFAULT 0,
+                ngr DOUBLE NOT NULL DEFAULT 0,
+                cpa DOUBLE NOT NULL DEFAULT 0,
+                checked_at DATETIME NULL,
+                PRIMARY KEY (account_id, period_date)
+            )
+        """)
+        self.connection.commit()
+    
+    def get_reconcile_gaps(self, account_id: str, from_date: date, to_date: date) -> Dict[str, Dict[str, float]]:
+        """
+        Возвращает сохраненную разницу итогов API и БД по датам периода
+        
+        Returns:
+            Словарь дата (YYYY-MM-DD) -> {метрика: API - БД}
+        """
+        self.ensure_reconcile_table()
+        self.cursor.execute("""
+            SELECT period_date, ftd, dep_cnt, dep_sum, ngr, cpa
+            FROM reconcile_gap
+            WHERE account_id = %s AND period_date >= %s AND period_date <= %s
+        """, (account_id, from_date, to_date))
+        return {
+            str(_as_date(row['period_date'])): {
+                name: float(row[name] or 0) for name in ('ftd', 'dep_cnt', 'dep_sum', 'ngr', 'cpa')
+            }
+            for row in self.cursor.fetchall()
+        }
+    
+    def save_reconcile_gap(self, account_id: str, period_date: date, gap: Dict[str, float]):
+        """Сохраняет разницу итогов API и БД за дату после успешной сверки"""
+        try:
+            self.ensure_reconcile_table()
+            inserted = self.backend.inserted
+            names = ('ftd', 'dep_cnt', 'dep_sum', 'ngr', 'cpa')
+            self.cursor.execute(f"""
+                INSERT INTO reconcile_gap (account_id, period_date, {', '.join(names)}, checked_at)
+                VALUES (%s, %s, {', '.join(['%s'] * len(names))}, %s)
+                {self.backend.upsert_clause(['account_id', 'period_date'])}
+                    {', '.join(f"{name} = {inserted(name)}" for name in names + ('checked_at',))}
+            """, (account_id, period_date) + tuple(gap.get(name, 0.0) for name in names) + (datetime.now(),))
+            self.connection.commit()
+        except Error as e:
+            logger.warning(f"Не удалось сохранить reconcile_gap ({account_id}, {period_date}): {e}")
+            if self.connection:
+                self.connection.rollback()
+    
+    def table_exists(self, table_name: str) -> bool:
+        """Проверяет, есть ли таблица или представление table_name"""
+        try:
+            self.cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
+            return bool(self.cursor.fetchall())
+        except Error as e:
+            logger.warning(f"Не удалось проверить таблицу {table_name}: {e}")
+            return False
+
+    def stream(self, sql: str, params: Optional[List[Any]] = None, fetch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Выполняет запрос и отдает строки результата по мере чтения с сервера
+
+        Используется отдельный небуферизованный курсор: результат не копируется
+        в память клиента целиком, а читается пачками по fetch_size строк.
+        Пока строки не прочитаны, self.cursor использовать нельзя.
+
+        Args:
+            sql: Запрос с плейсхолдерами %s
+            params: Параметры запроса
+            fetch_size: Строк за одно чтение (по умолчанию ANALYTICS_FETCH_SIZE)
+        """
+        fetch_size = max(fetch_size or ANALYTICS_FETCH_SIZE, 1)
+        cursor = self.connection.cursor(dictionary=True, buffered=False)
+        try:
+            cursor.execute(sql, params or [])
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
     def __enter__(self):
         """Контекстный менеджер для автоматического подключения"""
         self.connect()
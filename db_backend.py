@@ -0,0 +1,625 @@
+"""
+Бэкенды БД для database.Database
+
+Три варианта:
+- MySQLBackend (по умолчанию) - mysql.connector и DB_CONFIG, как в продакшене;
+- SQLiteBackend - встроенный sqlite3, файл DB_PATH;
+- DuckDBBackend - встроенный DuckDB (нужен пакет duckdb), файл DB_PATH.
+
+Встроенные бэкенды нужны для офлайн-бенчмарков полного конвейера (вместе с
+mock_affilka_server.py) на одной машине без внешних сервисов. При первом подключении
+они создают таблицы той же формы, что и в MySQL: fact_click_month, служебные таблицы
+ETL, а также минимальную сторону Keitaro (fact_conversions, dim_offer) с представлениями
+v_click_dims и vw_clickid_buyer_offer.
+
+Соединения встроенных бэкендов повторяют то, чем Database и скрипты check_*
+пользуются у mysql.connector: cursor(dictionary=True), плейсхолдеры %s, DESCRIBE <таблица>,
+SHOW TABLES LIKE '...', commit/rollback. Диалектные части SQL (upsert, UPDATE с JOIN,
+REPLACE) бэкенд формирует сам - см. inserted(), upsert_clause(), update_join_sql().
+"""
+import os
+import re
+import csv
+import sqlite3
+import logging
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import mysql.connector
+from config import DB_CONFIG, DB_BACKEND, DB_PATH
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# Ошибки всех драйверов (для except в Database)
+DatabaseError = (mysql.connector.Error, sqlite3.Error) + ((duckdb.Error,) if duckdb is not None else ())
+
+# Схема встроенной БД: формы таблиц и представлений совпадают с MySQL
+EMBEDDED_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS fact_click_month (
+        period_date DATE NOT NULL,
+        clickid VARCHAR(255) NOT NULL,
+        source VARCHAR(32) NOT NULL,
+        account_id VARCHAR(64) NOT NULL DEFAULT '',
+        ftd INTEGER DEFAULT 0,
+        dep_cnt INTEGER DEFAULT 0,
+        dep_sum DECIMAL(18, 2) DEFAULT 0,
+        ngr DECIMAL(18, 2) DEFAULT 0,
+        cpa DECIMAL(18, 2) DEFAULT 0,
+        buyer_id INTEGER,
+        offer_id INTEGER,
+        creative_id INTEGER,
+        PRIMARY KEY (period_date, clickid, source, account_id)
+    )
+    """,
+    # Сторона Keitaro: конверсии с байером, оффером и креативом по clickid
+    """
+    CREATE TABLE IF NOT EXISTS fact_conversions (
+        clickid VARCHAR(255),
+        conversion_at TIMESTAMP,
+        buyer_id INTEGER,
+        offer_id INTEGER,
+        creative_id INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_fact_conversions_clickid ON fact_conversions (clickid)",
+    """
+    CREATE TABLE IF NOT EXISTS dim_offer (
+        offer_id INTEGER PRIMARY KEY,
+        offer_name VARCHAR(255)
+    )
+    """,
+    # Как в MySQL: самая ранняя конверсия по нормализованному clickid
+    """
+    CREATE VIEW IF NOT EXISTS v_click_dims AS
+    SELECT clickid, buyer_id, offer_id, creative_id
+    FROM (
+        SELECT LOWER(TRIM(clickid)) AS clickid, buyer_id, offer_id, creative_id,
+               ROW_NUMBER() OVER (PARTITION BY LOWER(TRIM(clickid)) ORDER BY conversion_at) AS rn
+        FROM fact_conversions
+        WHERE clickid IS NOT NULL AND TRIM(clickid) <> ''
+    ) c
+    WHERE rn = 1
+    """,
+    """
+    CREATE VIEW IF NOT EXISTS vw_clickid_buyer_offer AS
+    SELECT v.clickid, v.buyer_id, v.offer_id, o.offer_name
+    FROM v_click_dims v
+    LEFT JOIN dim_offer o ON o.offer_id = v.offer_id
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS etl_account_state (
+        account_id VARCHAR(64) NOT NULL PRIMARY KEY,
+        base_url VARCHAR(255),
+        last_success_at TIMESTAMP,
+        last_failure_at TIMESTAMP,
+        last_duration_sec DOUBLE,
+        avg_duration_sec DOUBLE,
+        successful_runs INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS etl_runs (
+        run_id VARCHAR(64) NOT NULL PRIMARY KEY,
+        mode VARCHAR(16) NOT NULL,
+        version VARCHAR(64),
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP,
+        duration_sec DOUBLE,
+        cpu_sec DOUBLE,
+        peak_rss_bytes BIGINT,
+        rows_loaded BIGINT NOT NULL DEFAULT 0,
+        api_bytes BIGINT NOT NULL DEFAULT 0,
+        success INTEGER NOT NULL,
+        error_class VARCHAR(128)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_etl_runs_started ON etl_runs (started_at)",
+    """
+    CREATE TABLE IF NOT EXISTS etl_run_stages (
+        run_id VARCHAR(64) NOT NULL,
+        account_id VARCHAR(64),
+        stage VARCHAR(32) NOT NULL,
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP,
+        duration_sec DOUBLE NOT NULL,
+        cpu_sec DOUBLE,
+        rows_in BIGINT NOT NULL DEFAULT 0,
+        rows_out BIGINT NOT NULL DEFAULT 0,
+        api_bytes BIGINT NOT NULL DEFAULT 0,
+        db_rows BIGINT NOT NULL DEFAULT 0,
+        peak_rss_bytes BIGINT,
+        status VARCHAR(16) NOT NULL,
+        error_class VARCHAR(128),
+        version VARCHAR(64)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_etl_run_stages_run ON etl_run_stages (run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_etl_run_stages_started ON etl_run_stages (started_at, stage)",
+    # Агрегаты для аналитики (Database.refresh_rollups); offer_id / buyer_id = 0 - без оффера / байера
+    """
+    CREATE TABLE IF NOT EXISTS agg_offer_buyer_month (
+        period_month DATE NOT NULL,
+        account_id VARCHAR(64) NOT NULL,
+        offer_id INTEGER NOT NULL,
+        buyer_id INTEGER NOT NULL,
+        players INTEGER NOT NULL DEFAULT 0,
+        new_players INTEGER NOT NULL DEFAULT 0,
+        ftd INTEGER NOT NULL DEFAULT 0,
+        dep_cnt INTEGER NOT NULL DEFAULT 0,
+        dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        new_dep_cnt INTEGER NOT NULL DEFAULT 0,
+        new_dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        new_ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        new_cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (period_month, account_id, offer_id, buyer_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS agg_offer_player_types (
+        period_month DATE NOT NULL,
+        account_id VARCHAR(64) NOT NULL,
+        offer_id INTEGER NOT NULL,
+        new_players INTEGER NOT NULL DEFAULT 0,
+        old_players INTEGER NOT NULL DEFAULT 0,
+        reg_only_players INTEGER NOT NULL DEFAULT 0,
+        players INTEGER NOT NULL DEFAULT 0,
+        new_ftd INTEGER NOT NULL DEFAULT 0,
+        ftd INTEGER NOT NULL DEFAULT 0,
+        new_dep_cnt INTEGER NOT NULL DEFAULT 0,
+        old_dep_cnt INTEGER NOT NULL DEFAULT 0,
+        dep_cnt INTEGER NOT NULL DEFAULT 0,
+        new_dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        old_dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        dep_sum DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        new_ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        old_ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        ngr DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        new_cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        old_cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        cpa DECIMAL(18, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (period_month, account_id, offer_id)
+    )
+    """,
+    # Когорты: первый FTD игрока (clickid) в аккаунте (Database.upsert_fact_click_month)
+    """
+    CREATE TABLE IF NOT EXISTS player_cohort (
+        clickid VARCHAR(255) NOT NULL,
+        account_id VARCHAR(64) NOT NULL,
+        ftd_date DATE NOT NULL,
+        ftd_month DATE NOT NULL,
+        offer_id INTEGER,
+        PRIMARY KEY (clickid, account_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_player_cohort_month ON player_cohort (ftd_month, account_id)",
+    "CREATE INDEX IF NOT EXISTS idx_player_cohort_date ON player_cohort (ftd_date)",
+    # Сверка с API: разница итогов API и БД после успешной сверки даты (reconcile.py)
+    """
+    CREATE TABLE IF NOT EXISTS reconcile_gap (
+        account_id VARCHAR(64) NOT NULL,
+        period_date DATE NOT NULL,
+        ftd DOUBLE NOT NULL DEFAULT 0,
+        dep_cnt DOUBLE NOT NULL DEFAULT 0,
+        dep_sum DOUBLE NOT NULL DEFAULT 0,
+        ngr DOUBLE NOT NULL DEFAULT 0,
+        cpa DOUBLE NOT NULL DEFAULT 0,
+        checked_at TIMESTAMP,
+        PRIMARY KEY (account_id, period_date)
+    )
+    """,
+]
+
+_DESCRIBE_RE = re.compile(r'^\s*(?:DESCRIBE|DESC)\s+`?(\w+)`?\s*;?\s*$', re.IGNORECASE)
+_SHOW_TABLES_RE = re.compile(r"^\s*SHOW\s+TABLES\s+LIKE\s+'([^']*)'\s*;?\s*$", re.IGNORECASE)
+_DML_RE = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_INSERT_VALUES_RE = re.compile(
+    r'^\s*INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES\s*\(\s*\?(?:\s*,\s*\?)*\s*\)(.*)$',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+class MySQLBackend:
+    """MySQL через mysql.connector (DB_CONFIG)"""
+
+    name = 'mysql'
+    embedded = False
+    replace_into = 'REPLACE INTO'
+
+    def connect(self):
+        """Новое соединение (без пула)"""
+        return mysql.connector.connect(**DB_CONFIG)
+
+    @staticmethod
+    def inserted(column: str) -> str:
+        """Значение колонки из вставляемой строки в части UPDATE upsert-а"""
+        return f"VALUES({column})"
+
+    @staticmethod
+    def upsert_clause(key_columns: Sequence[str]) -> str:
+        """Начало части UPDATE upsert-а (после VALUES (...))"""
+        return "ON DUPLICATE KEY UPDATE"
+
+    @staticmethod
+    def update_join_sql(
+        table: str,
+        alias: str,
+        source: str,
+        source_alias: str,
+        keys: Tuple[str, str],
+        assignments: Dict[str, str],
+        where: List[str]
+    ) -> str:
+        """
+        UPDATE table alias по JOIN с source
+
+        Args:
+            keys: Выражения ключа соединения (для table, для source), сравниваются на равенство
+            assignments: Колонка table -> выражение
+            where: Условия (через AND)
+        """
+        set_clause = ', '.join(f"{alias}.{column} = {value}" for column, value in assignments.items())
+        return (f"UPDATE {table} {alias} INNER JOIN {source} {source_alias} ON {keys[0]} = {keys[1]} "
+                f"SET {set_clause} WHERE {' AND '.join(where)}")
+
+    def __repr__(self) -> str:
+        return f"{self.name} ({DB_CONFIG.get('host')}/{DB_CONFIG.get('database')})"
+
+
+class EmbeddedCursor:
+    """Курсор встроенной БД с интерфейсом курсора mysql.connector (dictionary=True)"""
+
+    def __init__(self, backend: 'EmbeddedBackend', connection):
+        self.backend = backend
+        self._cursor = connection.cursor()
+        # Строки DESCRIBE / SHOW TABLES, собранные курсором (остальные читаются из курсора БД)
+        self._rows: Optional[List[Dict[str, Any]]] = None
+        # Колонки результата SELECT: строки читаются из курсора БД по мере fetch*,
+        # поэтому большие выборки не материализуются целиком
+        self._columns: Optional[List[str]] = None
+        self.rowcount = -1
+
+    def _translate(self, sql: str, params: Optional[Iterable[Any]]):
+        # Плейсхолдеры mysql.connector (%s, %% при наличии параметров) -> ?
+        if params is None:
+            return sql, None
+        sql = sql.replace('%s', '?').replace('%%', '%')
+        return sql, [self.backend.adapt(value) for value in params]
+
+    def _result(self, sql: str):
+        self._rows = None
+        self._columns = None
+        if self._cursor.description is None:
+            return
+        columns = [column[0] for column in self._cursor.description]
+        if _DML_RE.match(sql) and columns == ['Count']:
+            # DuckDB возвращает количество измененных строк результатом запроса
+            row = self._cursor.fetchone()
+            self.rowcount = row[0] if row else 0
+        else:
+            self._columns = columns
+
+    def execute(self, sql: str, params: Optional[Iterable[Any]] = None):
+        self._columns = None
+        describe = _DESCRIBE_RE.match(sql)
+        if describe:
+            self._rows = self.backend.describe(self._cursor, describe.group(1))
+            self.rowcount = len(self._rows)
+            return
+        show_tables = _SHOW_TABLES_RE.match(sql)
+        if show_tables:
+            self._rows = [{'Tables': name} for name in self.backend.tables(self._cursor, show_tables.group(1))]
+            self.rowcount = len(self._rows)
+            return
+        sql, params = self._translate(sql, params)
+        self._cursor.execute(sql, params or [])
+        self.rowcount = self._cursor.rowcount
+        self._result(sql)
+        if self.rowcount < 0 and self._columns is None:
+            self.rowcount = self.backend.changes(self._cursor)
+
+    def executemany(self, sql: str, seq_params: Iterable[Iterable[Any]]):
+        self._rows = None
+        self._columns = None
+        rows = list(seq_params)
+        if not rows:
+            self.rowcount = 0
+            return
+        sql, _ = self._translate(sql, [])
+        self.rowcount = self.backend.executemany(
+            self._cursor, sql, [[self.backend.adapt(value) for value in row] for row in rows]
+        )
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        if self._columns is not None:
+            row = self._cursor.fetchone()
+            return dict(zip(self._columns, row)) if row is not None else None
+        if not self._rows:
+            return None
+        return self._rows.pop(0)
+
+    def fetchmany(self, size: int = 1) -> List[Dict[str, Any]]:
+        if self._columns is not None:
+            columns = self._columns
+            return [dict(zip(columns, row)) for row in self._cursor.fetchmany(size)]
+        rows, self._rows = (self._rows or [])[:size], (self._rows or [])[size:]
+        return rows
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        if self._columns is not None:
+            columns = self._columns
+            return [dict(zip(columns, row)) for row in self._cursor.fetchall()]
+        rows, self._rows = self._rows or [], []
+        return rows
+
+    # Явная транзакция на курсоре: в duckdb курсор - отдельное соединение со своей транзакцией,
+    # и commit/rollback соединения ее не затрагивают
+    def begin(self):
+        self._cursor.execute('BEGIN TRANSACTION')
+
+    def commit(self):
+        self._cursor.execute('COMMIT')
+
+    def rollback(self):
+        self._cursor.execute('ROLLBACK')
+
+    def close(self):
+        self._cursor.close()
+
+
+class EmbeddedConnection:
+    """Соединение встроенной БД с интерфейсом соединения mysql.connector"""
+
+    def __init__(self, backend: 'EmbeddedBackend', connection):
+        self.backend = backend
+        self._connection = connection
+        self._closed = False
+
+    def cursor(self, dictionary: bool = True, buffered: bool = False) -> EmbeddedCursor:
+        return EmbeddedCursor(self.backend, self._connection)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def is_connected(self) -> bool:
+        return not self._closed
+
+    def close(self):
+        if not self._closed:
+            self._connection.close()
+            self._closed = True
+
+
+class EmbeddedBackend:
+    """Общая часть встроенных бэкендов: схема, upsert через ON CONFLICT, UPDATE ... FROM"""
+
+    name = ''
+    embedded = True
+    replace_into = 'INSERT OR REPLACE INTO'
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: Файл БД (по умолчанию DB_PATH или affilka_etl.<бэкенд>)
+        """
+        self.path = path or DB_PATH or f"affilka_etl.{self.name}"
+        self._schema_ready = False
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def connect(self) -> EmbeddedConnection:
+        """Новое соединение; при первом подключении создается схема"""
+        connection = EmbeddedConnection(self, self._connect())
+        if not self._schema_ready:
+            cursor = connection.cursor()
+            for statement in EMBEDDED_SCHEMA:
+                cursor.execute(statement)
+            connection.commit()
+            self._schema_ready = True
+            logger.info(f"Встроенная БД {self.name}: {os.path.abspath(self.path)}")
+        return connection
+
+    @staticmethod
+    def adapt(value: Any) -> Any:
+        """Значение параметра для драйвера"""
+        return value
+
+    def describe(self, cursor, table: str) -> List[Dict[str, Any]]:
+        """Колонки таблицы в форме DESCRIBE MySQL: Field, Type, Null, Key, Default, Extra"""
+        raise NotImplementedError
+
+    def tables(self, cursor, pattern: str) -> List[str]:
+        """Таблицы и представления, имя которых подходит под LIKE-шаблон"""
+        raise NotImplementedError
+
+    def executemany(self, cursor, sql: str, rows: List[List[Any]]) -> int:
+        """Выполняет sql для каждой строки; возвращает количество строк"""
+        cursor.executemany(sql, rows)
+        return cursor.rowcount if cursor.rowcount >= 0 else len(rows)
+
+    @staticmethod
+    def inserted(column: str) -> str:
+        return f"excluded.{column}"
+
+    @staticmethod
+    def upsert_clause(key_columns: Sequence[str]) -> str:
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET"
+
+    @staticmethod
+    def update_join_sql(
+        table: str,
+        alias: str,
+        source: str,
+        source_alias: str,
+        keys: Tuple[str, str],
+        assignments: Dict[str, str],
+        where: List[str]
+    ) -> str:
+        # В SET колонка целевой таблицы указывается без алиаса
+        set_clause = ', '.join(f"{column} = {value}" for column, value in assignments.items())
+        return (f"UPDATE {table} AS {alias} SET {set_clause} FROM {source} AS {source_alias} "
+                f"WHERE {' AND '.join([f'{keys[0]} = {keys[1]}'] + where)}")
+
+    def changes(self, cursor) -> int:
+        """Количество строк, измененных последним запросом, если драйвер не сообщил rowcount"""
+        return -1
+
+    def __repr__(self) -> str:
+        return f"{self.name} ({self.path})"
+
+
+class SQLiteBackend(EmbeddedBackend):
+    """Встроенный SQLite (sqlite3 из стандартной библиотеки)"""
+
+    name = 'sqlite'
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        # WAL: чтение не блокируется записью из соседних потоков конвейера
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    @staticmethod
+    def adapt(value: Any) -> Any:
+        # Даты храним строками ISO (сравнение строк совпадает со сравнением дат), Decimal - числами
+        if isinstance(value, datetime):
+            return value.isoformat(sep=' ')
+        if isinstance(value, date):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return float(value)
+        return value
+
+    def describe(self, cursor, table: str) -> List[Dict[str, Any]]:
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [
+            {
+                'Field': name, 'Type': (column_type or '').lower(), 'Null': 'NO' if not_null else 'YES',
+                'Key': 'PRI' if pk else '', 'Default': default, 'Extra': '',
+            }
+            for _, name, column_type, not_null, default, pk in cursor.fetchall()
+        ]
+
+    def tables(self, cursor, pattern: str) -> List[str]:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name LIKE ?", [pattern])
+        return [row[0] for row in cursor.fetchall()]
+
+    def changes(self, cursor) -> int:
+        # sqlite3 не заполняет rowcount для запросов, начинающихся с WITH
+        cursor.execute("SELECT changes()")
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def update_join_sql(
+        table: str,
+        alias: str,
+        source: str,
+        source_alias: str,
+        keys: Tuple[str, str],
+        assignments: Dict[str, str],
+        where: List[str]
+    ) -> str:
+        # Ключ source вычисляется один раз в материализованном CTE: по нему SQLite строит
+        # автоматический индекс, иначе соединение по выражению - полный перебор на каждую строку
+        set_clause = ', '.join(f"{column} = {value}" for column, value in assignments.items())
+        return (f"WITH {source_alias} AS MATERIALIZED "
+                f"(SELECT {source_alias}.*, {keys[1]} AS join_key FROM {source} {source_alias}) "
+                f"UPDATE {table} AS {alias} SET {set_clause} FROM {source_alias} "
+                f"WHERE {' AND '.join([f'{keys[0]} = {source_alias}.join_key'] + where)}")
+
+
+class DuckDBBackend(EmbeddedBackend):
+    """Встроенный DuckDB (пакет duckdb)"""
+
+    name = 'duckdb'
+
+    # С какого количества строк пачка вставляется через временный CSV:
+    # executemany в DuckDB выполняет запрос построчно и на сотнях тысяч строк работает минутами
+    CSV_THRESHOLD = 1000
+
+    def __init__(self, path: Optional[str] = None):
+        if duckdb is None:
+            raise RuntimeError("Для DB_BACKEND=duckdb нужен пакет duckdb (pip install duckdb)")
+        super().__init__(path)
+
+    def _connect(self):
+        # Соединения с одним файлом в процессе используют общий экземпляр БД
+        return duckdb.connect(self.path)
+
+    def describe(self, cursor, table: str) -> List[Dict[str, Any]]:
+        cursor.execute(f"DESCRIBE {table}")
+        return [
+            {
+                'Field': name, 'Type': (column_type or '').lower(), 'Null': null,
+                'Key': key or '', 'Default': default, 'Extra': extra or '',
+            }
+            for name, column_type, null, key, default, extra in cursor.fetchall()
+        ]
+
+    def tables(self, cursor, pattern: str) -> List[str]:
+        cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_name LIKE ?", [pattern])
+        return [row[0] for row in cursor.fetchall()]
+
+    def executemany(self, cursor, sql: str, rows: List[List[Any]]) -> int:
+        insert = _INSERT_VALUES_RE.match(sql)
+        if insert is None or len(rows) < self.CSV_THRESHOLD:
+            return super().executemany(cursor, sql, rows)
+
+        table, columns, rest = insert.group(1), [c.strip() for c in insert.group(2).split(',')], insert.group(3)
+        types = {column['Field']: column['Type'].upper() for column in self.describe(cursor, table)}
+        spec = ', '.join(f"'{column}': '{types.get(column, 'VARCHAR')}'" for column in columns)
+        fd, path = tempfile.mkstemp(prefix='duckdb_batch_', suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerows([r'\N' if value is None else value for value in row] for row in rows)
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"SELECT * FROM read_csv(?, header = false, nullstr = '\\N', columns = {{{spec}}}) {rest}",
+                [path]
+            )
+            result = cursor.fetchall()
+            return result[0][0] if result else len(rows)
+        finally:
+            os.remove(path)
+
+
+BACKENDS = {
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend,
+    'duckdb': DuckDBBackend,
+}
+
+_backends: Dict[tuple, Any] = {}
+
+
+def create_backend(name: Optional[str] = None, path: Optional[str] = None):
+    """
+    Бэкенд БД по имени (по умолчанию DB_BACKEND)
+
+    Бэкенд создается один раз на (имя, файл): встроенные бэкенды запоминают, что схема уже создана.
+
+    Returns:
+        MySQLBackend, SQLiteBackend или DuckDBBackend
+    """
+    name = (name or DB_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный DB_BACKEND: {name} (доступны: {', '.join(BACKENDS)})")
+    key = (name, path)
+    if key not in _backends:
+        _backends[key] = BACKENDS[name]() if name == 'mysql' else BACKENDS[name](path)
+    return _backends[key]
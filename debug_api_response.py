@@ -3,8 +3,9 @@
 """
 import json
 from datetime import datetime, timedelta
-from config import get_affilka_accounts
+from config import get_affilka_accounts, RAW_STORE_REUSE_MINUTES
 from affilka_api import AffilkaAPI
+from raw_store import RawStore
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -25,7 +26,11 @@ def debug_api_response():
     to_date = datetime.now().date()
     from_date = to_date - timedelta(days=7)
     
-    report = api.fetch_report(
+    # Ответ берется из хранилища сырых ответов, если ETL или другой скрипт уже запрашивал его недавно
+    report = RawStore().fetch(
+        api,
+        max_age_minutes=RAW_STORE_REUSE_MINUTES,
+        account_id='account_1',
         from_date=str(from_date),
         to_date=str(to_date),
         columns=['first_deposits_count', 'deposits_count', 'deposits_sum'],
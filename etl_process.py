@@ -1,13 +1,20 @@
 """
 Основной модуль ETL процесса для загрузки данных из Affilka API
 """
+import time
 import logging
-from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
-from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+from datetime import datetime, timedelta, date
 from affilka_api import AffilkaAPI
 from database import Database
-from config import get_affilka_accounts
+from raw_store import get_raw_store, purge_raw_store
+from clickid_codes import normalize_clickid, reset_clickid_table
+from records import ClickRecord, aggregate_records
+from parallel_parse import iter_report_chunks
+from external_agg import SpillingAggregator
+from reject_sink import RejectSink
+from run_metrics import RunMetrics, StageMetrics
+from config import get_affilka_accounts, ETL_PIPELINE, ETL_DEFAULT_ACCOUNT_DURATION, ETL_ROLLUPS
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,17 +26,30 @@ logger = logging.getLogger(__name__)
 class AffilkaETL:
     """Класс для выполнения ETL процесса"""
     
-    def __init__(self, token: str, base_url: str, account_id: Optional[str] = None):
+    def __init__(
+        self,
+        token: str,
+        base_url: str,
+        account_id: Optional[str] = None,
+        db: Optional[Database] = None,
+        metrics: Optional[RunMetrics] = None
+    ):
         """
         Args:
             token: Токен для подключения к API
             base_url: Базовый URL API
             account_id: Идентификатор аккаунта (для масштабирования)
+            db: Экземпляр Database (например, с пулом соединений); по умолчанию создается новый
+            metrics: Метрики запуска, в которые пишутся замеры стадий (по умолчанию - свои)
         """
         self.api = AffilkaAPI(token, base_url)
         self.base_url = base_url
         self.account_id = account_id or token[:8]  # Используем первые 8 символов токена как ID
-        self.db = Database()
+        self.db = db or Database()
+        self.raw_store = get_raw_store()
+        self.metrics = metrics or RunMetrics()
+        # Строк, обогащенных из Keitaro в последнем process_date_range (для пересчета агрегатов)
+        self.enriched_rows = 0
     
     def normalize_clickid(self, clickid: str) -> str:
         """
@@ -41,19 +61,10 @@ class AffilkaETL:
         Returns:
             Нормализованный clickid
         """
-        if not clickid:
-            return None
-        
-        # Удаляем пробелы и приводим к нижнему регистру для нормализации
-        normalized = str(clickid).strip().lower()
-        
-        # Удаляем пустые значения
-        if not normalized or normalized == 'none' or normalized == 'null':
-            return None
-        
-        return normalized
+        # Удаляем пробелы и приводим к нижнему регистру, пустые и null-значения -> None
+        return normalize_clickid(clickid)
     
-    def transform_data(self, raw_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def transform_data(self, raw_data: List[ClickRecord]) -> List[ClickRecord]:
         """
         Трансформирует данные: нормализует clickid и группирует по (period_date, clickid)
         
@@ -66,51 +77,47 @@ class AffilkaETL:
         if not raw_data:
             return []
         
-        # Группируем по (period_date, clickid) и суммируем метрики
-        grouped = defaultdict(lambda: {
-            'period_date': None,
-            'clickid': None,
-            'ftd': 0.0,
-            'dep_cnt': 0.0,
-            'dep_sum': 0.0,
-            'ngr': 0.0,
-            'cpa': 0.0,
-        })
-        
-        for row in raw_data:
-            # Нормализуем clickid
-            clickid = self.normalize_clickid(row.get('clickid'))
-            if not clickid:
-                logger.warning(f"Пропущена строка без валидного clickid: {row}")
-                continue
-            
-            period_date = row.get('period_date')
-            if not period_date:
-                logger.warning(f"Пропущена строка без period_date: {row}")
-                continue
-            
-            # Создаем ключ для группировки
-            key = (period_date, clickid)
-            
-            # Инициализируем группу если нужно
-            if grouped[key]['period_date'] is None:
-                grouped[key]['period_date'] = period_date
-                grouped[key]['clickid'] = clickid
-            
-            # Суммируем метрики
-            # FTD - это флаг (0 или 1), берем максимальное значение (если хотя бы одна запись имеет FTD=1, то FTD=1)
-            grouped[key]['ftd'] = max(grouped[key]['ftd'], row.get('ftd', 0.0) or 0.0)
-            grouped[key]['dep_cnt'] += row.get('dep_cnt', 0.0) or 0.0
-            grouped[key]['dep_sum'] += row.get('dep_sum', 0.0) or 0.0
-            grouped[key]['ngr'] += row.get('ngr', 0.0) or 0.0
-            grouped[key]['cpa'] += row.get('cpa', 0.0) or 0.0
-        
-        # Преобразуем в список
-        transformed = list(grouped.values())
+        # Группируем по (period_date, clickid) и суммируем метрики (clickid кодируются в общей таблице строк)
+        rejects = RejectSink('transform', self.account_id)
+        transformed = aggregate_records(raw_data, rejects)
+        rejects.summary()
         
         logger.info(f"Трансформировано {len(raw_data)} записей в {len(transformed)} уникальных групп")
         return transformed
     
+    def extract(
+        self,
+        from_date: str,
+        to_date: str,
+        columns: Optional[List[str]] = None,
+        group_by: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Получает отчет из API через хранилище сырых ответов
+        
+        Ответ всегда запрашивается у API и сохраняется в хранилище; сохраненный ответ
+        используется, только если это явно включено RAW_STORE_MAX_AGE_MINUTES > 0
+        (например, при повторном запуске после ошибки загрузки).
+        
+        Args:
+            from_date: Начальная дата (YYYY-MM-DD)
+            to_date: Конечная дата (YYYY-MM-DD)
+            columns: Список колонок для запроса
+            group_by: Список полей для группировки
+        """
+        # Запрашиваем только колонки, которые сохраняются в БД
+        columns = self.api.project_columns(columns)
+        # Используем конвертацию в EUR для всех валют
+        if self.raw_store is None:
+            return self.api.fetch_report(
+                from_date, to_date, columns, group_by,
+                conversion_currency='EUR'
+            )
+        return self.raw_store.fetch(
+            self.api, self.account_id, from_date, to_date, columns, group_by,
+            conversion_currency='EUR'
+        )
+    
     def load_data(self, data: List[Dict[str, Any]]):
         """
         Загружает данные в БД
@@ -130,13 +137,49 @@ class AffilkaETL:
             logger.error(f"Ошибка при загрузке данных: {e}")
             raise
     
+    def load_batches(self, batches: Iterable[List[ClickRecord]], stage: Optional[StageMetrics] = None) -> int:
+        """
+        Загружает данные в БД пачками через одно соединение и одну транзакцию
+        
+        Ошибка на любой пачке откатывает всю загрузку: в БД не остается
+        наполовину перезаписанного периода.
+        
+        Args:
+            batches: Пачки записей (например, SpillingAggregator.iter_batches())
+            stage: Метрики стадии загрузки (заполняются строки и db_rows)
+        
+        Returns:
+            Количество загруженных записей
+        """
+        loaded = 0
+        try:
+            with self.db:
+                self.db.begin()
+                try:
+                    for batch in batches:
+                        affected = self.db.upsert_fact_click_month(batch, account_id=self.account_id, commit=False)
+                        loaded += len(batch)
+                        if stage is not None:
+                            stage.rows_in = stage.rows_out = loaded
+                            stage.db_rows += affected or 0
+                    self.db.commit()
+                except BaseException:
+                    self.db.rollback()
+                    raise
+            if loaded:
+                logger.info(f"Успешно загружено {loaded} записей для аккаунта {self.account_id}")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке данных: {e}")
+            raise
+        return loaded
+    
     def process_date_range(
         self,
         from_date: str,
         to_date: str,
         columns: Optional[List[str]] = None,
         group_by: Optional[List[str]] = None
-    ):
+    ) -> bool:
         """
         Выполняет полный ETL процесс для указанного диапазона дат
         
@@ -145,68 +188,215 @@ class AffilkaETL:
             to_date: Конечная дата (YYYY-MM-DD)
             columns: Список колонок для запроса
             group_by: Список полей для группировки
+        
+        Returns:
+            True, если данные получены и обработаны (в том числе если данных нет), иначе False
         """
         logger.info(f"Начало ETL процесса для аккаунта {self.account_id}, период: {from_date} - {to_date}")
         
+        metrics = self.metrics
+        self.enriched_rows = 0
+        
         # 1. Extract: Получаем данные из API
         logger.info("Шаг 1: Извлечение данных из API")
-        # Используем конвертацию в EUR для всех валют
-        report_data = self.api.fetch_report(
-            from_date, to_date, columns, group_by,
-            conversion_currency='EUR'
-        )
+        with metrics.stage('extract', self.account_id) as stage:
+            received = getattr(self.api.session, 'bytes_received', 0)
+            report_data = self.extract(from_date, to_date, columns, group_by)
+            stage.bytes = getattr(self.api.session, 'bytes_received', 0) - received
+            stage.rows_out = len(((report_data or {}).get('rows') or {}).get('data') or [])
         
         if not report_data:
             logger.error("Не удалось получить данные из API")
-            return
-        
-        # 2. Parse: Парсим данные из формата API
-        logger.info("Шаг 2: Парсинг данных API")
-        raw_data = self.api.parse_report_data(report_data)
-        
-        if not raw_data:
-            logger.warning("Нет данных для обработки после парсинга")
-            return
+            return False
         
-        # Валидация: проверяем наличие clickid
-        missing_clickid = [row for row in raw_data if not row.get('clickid')]
-        if missing_clickid:
-            logger.error(f"Найдено {len(missing_clickid)} записей без clickid. Прерываем обработку.")
-            return
-        
-        # 3. Transform: Трансформируем данные
-        logger.info("Шаг 3: Трансформация данных")
-        transformed_data = self.transform_data(raw_data)
+        # 2. Parse + Transform: парсим ответ частями и сразу группируем по (period_date, clickid)
+        # с ограничением памяти (при большом количестве групп частичные агрегаты сбрасываются на диск).
+        # Разобранные строки ответа освобождаются по ходу, поэтому весь ответ, все записи
+        # и все группы одновременно в памяти не находятся
+        logger.info("Шаг 2: Парсинг и трансформация данных")
+        with SpillingAggregator(rejects=RejectSink('transform', self.account_id)) as aggregator:
+            with metrics.stage('parse', self.account_id) as parse_stage:
+                rows_in = parse_stage.rows_in = len((report_data.get('rows') or {}).get('data') or [])
+                parse_rejects = RejectSink('parse', self.account_id)
+                for records in iter_report_chunks(self.api, report_data, rejects=parse_rejects):
+                    aggregator.add(records)
+                    del records
+                parse_rejects.summary()
+                parse_stage.rows_out = aggregator.groups_in_memory
+            del report_data
+            
+            if not aggregator.rows_in:
+                logger.warning("Нет данных для обработки после парсинга")
+                return True
+            
+            # 3. Load: Загружаем в БД пачками по мере слияния групп, одной транзакцией
+            # (слияние сброшенных на диск частей попадает во время этой стадии)
+            logger.info("Шаг 3: Загрузка данных в БД")
+            with metrics.stage('load', self.account_id) as stage:
+                loaded = self.load_batches(aggregator.iter_batches(), stage)
+            # После сброса на диск точное количество групп известно только после слияния
+            parse_stage.rows_out = loaded
         
-        if not transformed_data:
+        logger.info(f"Обработано {rows_in} строк отчета: {loaded} уникальных групп")
+        if not loaded:
             logger.warning("Нет данных после трансформации")
-            return
-        
-        # 4. Load: Загружаем в БД
-        logger.info("Шаг 4: Загрузка данных в БД")
-        self.load_data(transformed_data)
+            return True
         
-        # 5. Обогащаем данными из Keitaro через v_click_dims
-        logger.info("Шаг 5: Обогащение данными из Keitaro (buyer_id, offer_id, creative_id)")
+        # 4. Обогащаем данными из Keitaro через v_click_dims
+        logger.info("Шаг 4: Обогащение данными из Keitaro (buyer_id, offer_id, creative_id)")
         try:
-            with self.db:
+            with metrics.stage('enrich', self.account_id) as stage, self.db:
                 updated_count = self.db.enrich_dims_from_keitaro(
                     period_date_start=from_date,
                     period_date_end=to_date
                 )
+                stage.db_rows = self.enriched_rows = updated_count or 0
                 if updated_count > 0:
                     logger.info(f"Обновлено {updated_count} записей с данными из Keitaro")
         except Exception as e:
             logger.warning(f"Не удалось обогатить данные из Keitaro (это не критично): {e}")
         
         logger.info(f"ETL процесс завершен успешно для аккаунта {self.account_id}")
+        return True
+
+
+def current_month_range(today: Optional[date] = None):
+    """
+    Возвращает период по умолчанию: с 1 числа текущего месяца по текущее число
+    
+    Returns:
+        Кортеж (from_date, to_date) в формате YYYY-MM-DD
+    """
+    today = today or datetime.now().date()
+    month_start = date(today.year, today.month, 1)
+    return month_start.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+
+
+def create_account_etls(accounts: List[Dict[str, str]], pool=None, metrics: Optional[RunMetrics] = None) -> List[AffilkaETL]:
+    """
+    Создает экземпляры AffilkaETL для всех аккаунтов
+    
+    account_id назначается так же, как в process_all_accounts (account_1, account_2, ...),
+    чтобы данные разных режимов запуска попадали под один и тот же account_id.
+    
+    Args:
+        accounts: Список аккаунтов из get_affilka_accounts()
+        pool: Пул соединений с БД (опционально)
+        metrics: Метрики запуска (опционально)
+    """
+    return [
+        AffilkaETL(account['token'], account['url'], account_id=f"account_{i}", db=Database(pool), metrics=metrics)
+        for i, account in enumerate(accounts, 1)
+    ]
+
+
+def enrich_all_accounts(from_date: str, to_date: str, pool=None, metrics: Optional[RunMetrics] = None) -> int:
+    """
+    Финальное обогащение данными из Keitaro для всего периода (после загрузки всех аккаунтов)
+    
+    Args:
+        from_date: Начальная дата (YYYY-MM-DD)
+        to_date: Конечная дата (YYYY-MM-DD)
+        pool: Пул соединений с БД (опционально)
+        metrics: Метрики запуска (опционально)
+    
+    Returns:
+        Количество обновленных записей (0, если обогащение не удалось)
+    """
+    metrics = metrics or RunMetrics()
+    logger.info("\n" + "="*60)
+    logger.info("Финальное обогащение данными из Keitaro для всех загруженных данных")
+    logger.info("="*60)
+    try:
+        db = Database(pool)
+        with metrics.stage('enrich_all') as stage, db:
+            updated_count = db.enrich_dims_from_keitaro(
+                period_date_start=from_date,
+                period_date_end=to_date
+            )
+            stage.db_rows = updated_count or 0
+            if updated_count > 0:
+                logger.info(f"Итого обновлено {updated_count} записей с данными из Keitaro (buyer_id, offer_id, creative_id)")
+            return updated_count or 0
+    except Exception as e:
+        logger.warning(f"Не удалось выполнить финальное обогащение из Keitaro (это не критично): {e}")
+    return 0
+
+
+def refresh_rollups(
+    from_date: str,
+    to_date: str,
+    account_ids: Optional[List[str]] = None,
+    pool=None,
+    metrics: Optional[RunMetrics] = None
+):
+    """
+    Пересчитывает агрегаты для аналитики (Database.refresh_rollups) после загрузки и обогащения
+    
+    Пересчитываются только партиции, затронутые запуском: месяцы периода по загруженным
+    аккаунтам. Обогащение из Keitaro обновляет строки всех аккаунтов за период, поэтому
+    если оно изменило строки, вызывающий передает account_ids=None (все аккаунты).
+    
+    Args:
+        from_date: Начальная дата (YYYY-MM-DD)
+        to_date: Конечная дата (YYYY-MM-DD)
+        account_ids: Загруженные аккаунты (None - все аккаунты, пустой список - пересчет не нужен)
+        pool: Пул соединений с БД (опционально)
+        metrics: Метрики запуска (опционально)
+    """
+    if not ETL_ROLLUPS or (account_ids is not None and not account_ids):
+        return
+    metrics = metrics or RunMetrics()
+    try:
+        db = Database(pool)
+        with metrics.stage('rollup') as stage, db:
+            refreshed = db.refresh_rollups(from_date, to_date, account_ids)
+            stage.rows_out = stage.db_rows = sum(
+                item['offer_buyer_rows'] + item['player_type_rows'] for item in refreshed
+            )
+    except Exception as e:
+        logger.warning(
+            f"Не удалось пересчитать агрегаты (отчеты offers, mapping, offer-types могут показывать "
+            f"устаревшие данные до следующего пересчета, см. main.py analytics rollup): {e}"
+        )
+
+
+def order_accounts_by_staleness(
+    indexed_accounts: List[Tuple[int, Dict[str, str]]],
+    states: Dict[str, Dict[str, Any]]
+) -> List[Tuple[int, Dict[str, str]]]:
+    """
+    Упорядочивает аккаунты по давности последней успешной загрузки
+    
+    Аккаунты, которые еще ни разу не загружались успешно, идут первыми,
+    затем - от самой старой успешной загрузки к самой свежей. При равенстве
+    сохраняется порядок из конфигурации.
+    
+    Args:
+        indexed_accounts: Список пар (номер аккаунта, аккаунт)
+        states: Состояние аккаунтов из etl_account_state
+    """
+    def staleness_key(item):
+        i, _account = item
+        last_success = (states.get(f"account_{i}") or {}).get('last_success_at')
+        return (last_success is not None, last_success or datetime.min, i)
+    
+    return sorted(indexed_accounts, key=staleness_key)
+
+
+def expected_account_duration(account_id: str, states: Dict[str, Dict[str, Any]]) -> float:
+    """Ожидаемая длительность обработки аккаунта (по прошлым запускам) в секундах"""
+    avg_duration = (states.get(account_id) or {}).get('avg_duration_sec')
+    return float(avg_duration) if avg_duration is not None else ETL_DEFAULT_ACCOUNT_DURATION
 
 
 def process_all_accounts(
     from_date: str,
     to_date: str,
     columns: Optional[List[str]] = None,
-    group_by: Optional[List[str]] = None
+    group_by: Optional[List[str]] = None,
+    pipeline: Optional[bool] = None,
+    deadline: Optional[datetime] = None
 ):
     """
     Обрабатывает все аккаунты из конфигурации
@@ -216,6 +406,9 @@ def process_all_accounts(
         to_date: Конечная дата (YYYY-MM-DD)
         columns: Список колонок для запроса
         group_by: Список полей для группировки
+        pipeline: Использовать конвейерный режим (по умолчанию ETL_PIPELINE)
+        deadline: Время, к которому запуск должен завершиться. Аккаунт запускается,
+                  только если его ожидаемая длительность укладывается в оставшееся время
     """
     accounts = get_affilka_accounts()
     
@@ -237,41 +430,128 @@ def process_all_accounts(
     for url, url_accounts in accounts_by_url.items():
         logger.info(f"  - {url}: {len(url_accounts)} токен(ов)")
     
-    for i, account in enumerate(accounts, 1):
+    # Порядок обработки: сначала аккаунты, которые дольше всего не обновлялись
+    states = {}
+    try:
+        with Database() as state_db:
+            if state_db.cursor:
+                states = state_db.get_account_states()
+    except Exception as e:
+        logger.warning(f"Не удалось получить состояние аккаунтов, используем порядок из конфигурации: {e}")
+    indexed_accounts = order_accounts_by_staleness(list(enumerate(accounts, 1)), states)
+    
+    if deadline:
+        logger.info(f"Запуск должен завершиться к {deadline:%Y-%m-%d %H:%M:%S}")
+    
+    if pipeline is None:
+        pipeline = ETL_PIPELINE
+    
+    # Замеры стадий всех аккаунтов: JSON-отчет и метрики Prometheus по завершении запуска
+    metrics = RunMetrics('pipeline' if pipeline else 'once')
+    
+    if pipeline:
+        # Конвейер: запросы к API, трансформация и загрузка всех аккаунтов идут параллельно
+        from pipeline import ETLPipeline, build_jobs
+        if columns is None:
+            columns = ['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr']
+        if group_by is None:
+            group_by = ['day', 'dynamic_tag_visit_id']
+        etls = [
+            AffilkaETL(account['token'], account['url'], account_id=f"account_{i}", metrics=metrics)
+            for i, account in indexed_accounts
+        ]
+        jobs = build_jobs(etls, from_date, to_date, columns, group_by)
+        expected_durations = {etl.account_id: expected_account_duration(etl.account_id, states) for etl in etls}
+        etl_pipeline = ETLPipeline(deadline=deadline, metrics=metrics, expected_durations=expected_durations)
+        etl_pipeline.run(jobs)
+        # Длительность отдельного аккаунта в конвейере не измеряется, обновляем только время успеха
+        try:
+            with Database() as state_db:
+                if state_db.cursor:
+                    for etl in etls:
+                        if etl.account_id in etl_pipeline.skipped_accounts:
+                            continue
+                        success = etl.account_id not in etl_pipeline.failed_accounts
+                        state_db.record_account_run(etl.account_id, success, base_url=etl.base_url)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние аккаунтов: {e}")
+        enriched = enrich_all_accounts(from_date, to_date, metrics=metrics)
+        # Агрегаты пересчитываются по всем аккаунтам, загрузившим хоть одно окно,
+        # в том числе если остальные окна пропущены или завершились ошибкой
+        loaded_accounts = sorted(etl_pipeline.loaded_accounts)
+        refresh_rollups(from_date, to_date, None if enriched else loaded_accounts, metrics=metrics)
+        purge_raw_store()
+        reset_clickid_table()
+        metrics.finish(success=not etl_pipeline.failed_accounts)
+        logger.info("Обработка всех аккаунтов завершена")
+        return
+    
+    failed = []
+    
+    skipped = []
+    processed = []
+    enriched = 0
+    for position, (i, account) in enumerate(indexed_accounts, 1):
         url = account['url']
         token = account['token']
+        account_id = f"account_{i}"
         token_preview = token[:8] + "..." if len(token) > 8 else token
+        
+        if deadline:
+            remaining = (deadline - datetime.now()).total_seconds()
+            expected = expected_account_duration(account_id, states)
+            if expected > remaining:
+                logger.warning(
+                    f"Пропускаем {account_id} ({url}): ожидаемая длительность {expected:.0f} сек "
+                    f"не укладывается в оставшееся время {max(remaining, 0):.0f} сек"
+                )
+                skipped.append(account_id)
+                continue
+        
         logger.info(f"\n{'='*60}")
-        logger.info(f"Обработка аккаунта {i}/{len(accounts)}")
+        logger.info(f"Обработка аккаунта {position}/{len(accounts)} ({account_id})")
         logger.info(f"URL: {url}")
         logger.info(f"Token: {token_preview}")
         logger.info(f"{'='*60}")
+        started = time.monotonic()
+        success = False
         try:
-            etl = AffilkaETL(token, url, account_id=f"account_{i}")
+            etl = AffilkaETL(token, url, account_id=account_id, metrics=metrics)
             # Используем стандартные параметры, если не указаны
             if columns is None:
                 columns = ['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr']
             if group_by is None:
                 group_by = ['day', 'dynamic_tag_visit_id']
-            etl.process_date_range(from_date, to_date, columns, group_by)
+            processed.append(account_id)
+            success = etl.process_date_range(from_date, to_date, columns, group_by)
+            enriched += etl.enriched_rows
         except Exception as e:
             logger.error(f"Ошибка при обработке аккаунта {i} ({url}): {e}", exc_info=True)
-            continue
+        
+        if not success:
+            failed.append(account_id)
+        
+        # Запоминаем время успешной загрузки и длительность для планирования следующих запусков
+        duration = time.monotonic() - started
+        try:
+            with Database() as state_db:
+                if state_db.cursor:
+                    state_db.record_account_run(account_id, success, duration if success else None, base_url=url)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние аккаунта {account_id}: {e}")
+    
+    if skipped:
+        logger.warning(f"Не обработаны из-за ограничения по времени: {', '.join(skipped)}")
     
     # После загрузки всех аккаунтов, обогащаем данными из Keitaro для всего периода
-    logger.info("\n" + "="*60)
-    logger.info("Финальное обогащение данными из Keitaro для всех загруженных данных")
-    logger.info("="*60)
-    try:
-        db = Database()
-        with db:
-            updated_count = db.enrich_dims_from_keitaro(
-                period_date_start=from_date,
-                period_date_end=to_date
-            )
-            if updated_count > 0:
-                logger.info(f"Итого обновлено {updated_count} записей с данными из Keitaro (buyer_id, offer_id, creative_id)")
-    except Exception as e:
-        logger.warning(f"Не удалось выполнить финальное обогащение из Keitaro (это не критично): {e}")
+    enriched += enrich_all_accounts(from_date, to_date, metrics=metrics)
+    
+    # Пересчитываем агрегаты аналитики за месяцы периода
+    refresh_rollups(from_date, to_date, None if enriched else processed, metrics=metrics)
+    
+    # Очистка хранилища сырых ответов - один раз за запуск, когда сохранения уже завершены
+    purge_raw_store()
+    reset_clickid_table()
     
+    metrics.finish(success=not failed)
     logger.info("Обработка всех аккаунтов завершена")
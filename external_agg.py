@@ -0,0 +1,201 @@
+"""
+Агрегация по (period_date, clickid) с ограничением памяти и сбросом на диск
+
+transform_data держит все группы в одном словаре, поэтому многомесячная
+перезагрузка с группировкой по дню может не поместиться в память контейнера.
+SpillingAggregator держит в памяти не больше max_groups групп: при превышении
+группы разбиваются по хешу clickid на партиции, сортируются по ключу и
+сбрасываются во временные файлы (JSON lines). При чтении каждая партиция
+сливается потоково (heapq.merge) из отсортированных файлов и остатка в памяти,
+одинаковые ключи объединяются (FTD - максимум, остальные метрики - сумма),
+и группы отдаются загрузчику пачками.
+
+Пока лимит не превышен, на диск ничего не пишется.
+"""
+import os
+import json
+import heapq
+import shutil
+import logging
+import tempfile
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from clickid_codes import get_clickid_table
+from records import ClickRecord, add_into
+from reject_sink import RejectSink
+from config import ETL_AGG_MAX_GROUPS, ETL_AGG_SPILL_PARTITIONS, ETL_AGG_SPILL_DIR, ETL_LOAD_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def _sort_key(record: ClickRecord) -> Tuple[str, str]:
+    return record.period_date.isoformat(), record.clickid
+
+
+def write_records(path: str, records: Iterable[ClickRecord]) -> int:
+    """Пишет группы в файл JSON lines (формат частей, сброшенных на диск); возвращает количество"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for r in records:
+            f.write(json.dumps([r.period_date.isoformat(), r.clickid, r.ftd, r.dep_cnt, r.dep_sum, r.ngr, r.cpa]))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def read_records(path: str) -> Iterator[ClickRecord]:
+    """Потоково читает файл групп, записанный write_records"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            period_date, clickid, ftd, dep_cnt, dep_sum, ngr, cpa = json.loads(line)
+            yield ClickRecord(date.fromisoformat(period_date), clickid, ftd, dep_cnt, dep_sum, ngr, cpa)
+
+
+def batched(records: Iterable[ClickRecord], batch_size: Optional[int] = None) -> Iterator[List[ClickRecord]]:
+    """Разбивает поток групп на пачки по batch_size (по умолчанию ETL_LOAD_BATCH_SIZE)"""
+    batch_size = batch_size or ETL_LOAD_BATCH_SIZE
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SpillingAggregator:
+    """Агрегатор групп (period_date, clickid) с лимитом памяти и сбросом отсортированных частей на диск"""
+
+    def __init__(
+        self,
+        max_groups: Optional[int] = None,
+        partitions: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        rejects: Optional[RejectSink] = None
+    ):
+        """
+        Args:
+            max_groups: Максимальное количество групп в памяти (по умолчанию ETL_AGG_MAX_GROUPS)
+            partitions: Количество хеш-партиций при сбросе на диск (по умолчанию ETL_AGG_SPILL_PARTITIONS)
+            spill_dir: Каталог для временных файлов (по умолчанию ETL_AGG_SPILL_DIR или системный temp)
+            rejects: Учет пропущенных строк (итог пишется в лог при close)
+        """
+        self.max_groups = max_groups or ETL_AGG_MAX_GROUPS
+        self.partitions = max(1, partitions or ETL_AGG_SPILL_PARTITIONS)
+        self.spill_dir = spill_dir or ETL_AGG_SPILL_DIR or None
+        self._groups: Dict[Tuple[date, str], ClickRecord] = {}
+        # Файлы сброшенных частей по партициям
+        self._runs: List[List[str]] = [[] for _ in range(self.partitions)]
+        self._tmp_dir: Optional[str] = None
+        self.rejects = rejects or RejectSink('transform')
+        self.rows_in = 0
+        self.spills = 0
+
+    @property
+    def spilled(self) -> bool:
+        return self.spills > 0
+
+    @property
+    def groups_in_memory(self) -> int:
+        """Количество групп в памяти (без сброшенных на диск)"""
+        return len(self._groups)
+
+    def add(self, rows: Iterable[ClickRecord]):
+        """Добавляет строки отчета (ClickRecord) в агрегацию"""
+        table = get_clickid_table()
+        groups = self._groups
+        with table.lock:
+            # Ключи групп - декодированные строки, поэтому сброс таблицы между пачками безопасен
+            table.reset_if_full()
+            encode = table.encode
+            decode = table.decode
+            for row in rows:
+                self.rows_in += 1
+                code = encode(row.clickid)
+                if code is None:
+                    self.rejects.reject('invalid_clickid', row)
+                    continue
+                if not row.period_date:
+                    self.rejects.reject('missing_period_date', row)
+                    continue
+                # Ключ - нормализованная строка из общей таблицы (один объект на clickid),
+                # коды таблицы не используются: таблица сбрасывается между вызовами
+                key = (row.period_date, decode(code))
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = ClickRecord(key[0], key[1], max(row.ftd, 0.0), row.dep_cnt, row.dep_sum, row.ngr, row.cpa)
+                    if len(groups) >= self.max_groups:
+                        self._spill()
+                else:
+                    add_into(group, row)
+
+    def _partition(self, clickid: str) -> int:
+        return hash(clickid) % self.partitions
+
+    def _spill(self):
+        """Сбрасывает группы из памяти на диск: по файлу на партицию, отсортированному по ключу"""
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='etl_agg_', dir=self.spill_dir)
+        parts: List[List[ClickRecord]] = [[] for _ in range(self.partitions)]
+        for record in self._groups.values():
+            parts[self._partition(record.clickid)].append(record)
+        self._groups.clear()
+
+        for index, records in enumerate(parts):
+            if not records:
+                continue
+            records.sort(key=_sort_key)
+            path = os.path.join(self._tmp_dir, f"run{self.spills:04d}_p{index:03d}.jsonl")
+            write_records(path, records)
+            self._runs[index].append(path)
+        self.spills += 1
+        logger.info(f"Агрегация: лимит {self.max_groups} групп превышен, часть #{self.spills} сброшена на диск ({self._tmp_dir})")
+
+    def __iter__(self) -> Iterator[ClickRecord]:
+        """Итоговые группы; при сбросе на диск - потоковое слияние по партициям"""
+        if not self.spilled:
+            yield from self._groups.values()
+            return
+
+        in_memory: List[List[ClickRecord]] = [[] for _ in range(self.partitions)]
+        for record in self._groups.values():
+            in_memory[self._partition(record.clickid)].append(record)
+        self._groups.clear()
+
+        for index in range(self.partitions):
+            memory_part = sorted(in_memory[index], key=_sort_key)
+            in_memory[index] = None
+            sources = [read_records(path) for path in self._runs[index]] + [iter(memory_part)]
+            current = None
+            current_key = None
+            for record in heapq.merge(*sources, key=_sort_key):
+                key = (record.period_date, record.clickid)
+                if key == current_key:
+                    add_into(current, record)
+                    continue
+                if current is not None:
+                    yield current
+                current, current_key = record, key
+            if current is not None:
+                yield current
+
+    def iter_batches(self, batch_size: Optional[int] = None) -> Iterator[List[ClickRecord]]:
+        """Итоговые группы пачками для загрузки в БД"""
+        return batched(self, batch_size)
+
+    def close(self):
+        """Удаляет временные файлы и пишет в лог итог по пропущенным строкам"""
+        self.rejects.summary()
+        self.rejects = RejectSink(self.rejects.stage, self.rejects.account_id)
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self._runs = [[] for _ in range(self.partitions)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
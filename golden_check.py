@@ -0,0 +1,291 @@
+"""
+Регрессионная проверка parse/transform на эталонном наборе отчетов (golden/)
+
+Каждый случай набора - отчет в формате Affilka API (golden/<случай>.json) и ожидаемый
+результат parse + transform (golden/<случай>.expected.jsonl). Набор фиксирует тонкие
+места преобразования: выбор clickid из нескольких полей, денежные объекты
+(amount / amount_cents / value), семантику FTD (максимум, а не сумма), нормализацию
+clickid и причины пропуска строк.
+
+Группы и метрики ожидаемых результатов сверены с исходной реализацией
+(parse_report_data + transform_data до ускорения); счетчики пропусков в ней не велись.
+
+Все движки прогоняются на каждом случае в одном запуске. Результат движка
+сериализуется канонически (группы отсортированы по (period_date, clickid), метрики -
+в масштабе fact_click_month, DECIMAL(18, 2)) и должен совпасть с ожидаемым байт в байт.
+Метрики сравниваются в масштабе БД, а не как float: движки суммируют строки в разном
+порядке (части отчета в пуле процессов, партиции при сбросе на диск), и суммы
+отличаются в последних битах, которые в БД не попадают.
+
+Движки:
+    legacy        - parse_report_data + aggregate_records (как transform_data)
+    spill         - parse_report_data + SpillingAggregator с маленьким лимитом групп (сброс на диск)
+    multiprocess  - parallel_parse.parse_report в пуле процессов + aggregate_records
+
+Использование:
+    python golden_check.py                         # все случаи, все движки, время каждого движка
+    python golden_check.py --engine legacy spill --repeat 5
+    python golden_check.py --update                # пересоздать ожидаемые результаты (движок legacy)
+    python golden_check.py record raw_store/.../report.ndjson.gz --name acc1_jan --limit 5000
+
+record записывает ответ API (JSON или файл raw_store) как новый случай набора,
+анонимизируя clickid, campaign_id и player_id (стабильные псевдонимы с сохранением
+регистра и пробелов по краям) и удаляя поля, которые парсер не читает.
+При расхождении с ожидаемым результатом скрипт завершается с кодом 1 (удобно для CI).
+"""
+import os
+import gc
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from affilka_api import AffilkaAPI
+from external_agg import SpillingAggregator
+from mock_affilka_server import load_payload
+from parallel_parse import parse_report
+from records import ClickRecord, aggregate_records
+from reject_sink import RejectSink
+from synthetic_report import generate_report
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+REFERENCE_ENGINE = 'legacy'
+
+# Масштаб метрик в каноническом результате (DECIMAL(18, 2) в fact_click_month)
+CANONICAL_SCALE = 2
+
+# Параметры движков: маленький лимит групп, чтобы spill сбрасывал части на диск даже на
+# маленьких случаях; пул процессов включается на любом размере отчета
+SPILL_MAX_GROUPS = 16
+SPILL_PARTITIONS = 3
+MULTIPROCESS_PROCESSES = 2
+
+# Поля, из которых парсер берет clickid (анонимизируются при record)
+CLICKID_FIELDS = frozenset([
+    'dynamic_tag_visit_id', 'dynamic_tag_sub_id', 'dynamic_tag_click_id', 'dynamic_tag_subid',
+    'dynamic_tag_web_id', 'dynamic_tag_webid', 'visit_id', 'sub_id', 'clickid',
+    'campaign_id', 'campaign', 'player_id', 'player',
+])
+# Поля, которые читает парсер (остальные при record удаляются)
+PARSED_FIELDS = CLICKID_FIELDS | frozenset([
+    'date', 'first_deposits_count', 'deposits_count', 'deposits_sum', 'ngr',
+    'partner_income', 'clean_net_revenue',
+])
+# Значения clickid, которые сохраняются как есть: на них проверяются пропуски строк
+KEPT_CLICKIDS = frozenset(['', 'null', 'none'])
+
+_api = AffilkaAPI('golden', 'http://localhost')
+
+
+def _legacy(report: Dict[str, Any], rejects: RejectSink) -> List[ClickRecord]:
+    return aggregate_records(_api.parse_report_data(report, keep_debug_fields=False, rejects=rejects), rejects)
+
+
+def _spill(report: Dict[str, Any], rejects: RejectSink) -> List[ClickRecord]:
+    rows = _api.parse_report_data(report, keep_debug_fields=False, rejects=rejects)
+    with SpillingAggregator(max_groups=SPILL_MAX_GROUPS, partitions=SPILL_PARTITIONS, rejects=rejects) as aggregator:
+        aggregator.add(rows)
+        return list(aggregator)
+
+
+def _multiprocess(report: Dict[str, Any], rejects: RejectSink) -> List[ClickRecord]:
+    rows = parse_report(_api, report, processes=MULTIPROCESS_PROCESSES, threshold=0, rejects=rejects)
+    return aggregate_records(rows, rejects)
+
+
+ENGINES: Dict[str, Callable[[Dict[str, Any], RejectSink], List[ClickRecord]]] = OrderedDict([
+    ('legacy', _legacy),
+    ('spill', _spill),
+    ('multiprocess', _multiprocess),
+])
+
+
+def canonical(groups: List[ClickRecord], rejects: RejectSink) -> bytes:
+    """Канонический результат движка: счетчики пропусков и группы, отсортированные по ключу"""
+    lines = [json.dumps({'rejects': dict(sorted(rejects.counts.items()))}, ensure_ascii=False)]
+    rows = sorted(
+        (group.period_date.isoformat(), group.clickid,
+         *(f"{getattr(group, field):.{CANONICAL_SCALE}f}" for field in ('ftd', 'dep_cnt', 'dep_sum', 'ngr', 'cpa')))
+        for group in groups
+    )
+    lines.extend(json.dumps(row, ensure_ascii=False) for row in rows)
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def run_engine(name: str, report: Dict[str, Any]) -> bytes:
+    """Прогоняет отчет через движок и возвращает канонический результат"""
+    # Без файла выборки: пропуски эталонного набора не должны попадать в REJECT_SINK_DIR
+    rejects = RejectSink('golden', name, directory='')
+    return canonical(ENGINES[name](report, rejects), rejects)
+
+
+def list_cases(names: Optional[List[str]] = None) -> List[str]:
+    """Имена случаев набора (все или выбранные)"""
+    cases = sorted(
+        entry[:-len('.json')] for entry in os.listdir(GOLDEN_DIR)
+        if entry.endswith('.json') and not entry.endswith('.expected.json')
+    )
+    if names:
+        missing = [name for name in names if name not in cases]
+        if missing:
+            raise SystemExit(f"Нет случаев в {GOLDEN_DIR}: {', '.join(missing)}")
+        cases = [name for name in cases if name in names]
+    return cases
+
+
+def load_case(name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Описание случая и отчет (записанный или синтетический по параметрам synthetic)"""
+    with open(os.path.join(GOLDEN_DIR, f'{name}.json'), 'r', encoding='utf-8') as f:
+        case = json.load(f)
+    report = case.get('report')
+    if report is None:
+        report = generate_report(**case['synthetic'])
+    return case, report
+
+
+def expected_path(name: str) -> str:
+    return os.path.join(GOLDEN_DIR, f'{name}.expected.jsonl')
+
+
+def first_difference(actual: bytes, expected: bytes) -> str:
+    """Первая отличающаяся строка канонического результата (для вывода)"""
+    actual_lines = actual.decode('utf-8').splitlines()
+    expected_lines = expected.decode('utf-8').splitlines()
+    for number, (got, want) in enumerate(zip(actual_lines, expected_lines), 1):
+        if got != want:
+            return f"строка {number}: {got} != ожидается {want}"
+    return f"строк {len(actual_lines)} против {len(expected_lines)} ожидаемых"
+
+
+def check(cases: List[str], engines: List[str], repeat: int, update: bool) -> List[str]:
+    """Прогоняет движки на случаях набора; возвращает описания расхождений"""
+    failures = []
+    print(f"{'случай':<24} {'строк':>7} {'групп':>7} {'движок':<14} {'время, мс':>10} {'строк/с':>12}  результат")
+    print("-" * 90)
+    for name in cases:
+        _case, report = load_case(name)
+        rows = len(((report or {}).get('rows') or {}).get('data') or [])
+        path = expected_path(name)
+        if update:
+            with open(path, 'wb') as f:
+                f.write(run_engine(REFERENCE_ENGINE, report))
+        if not os.path.exists(path):
+            failures.append(f"{name}: нет ожидаемого результата (запустите с --update)")
+            continue
+        with open(path, 'rb') as f:
+            expected = f.read()
+        groups = expected.count(b'\n') - 1
+
+        for engine in engines:
+            actual = run_engine(engine, report)
+            best = float('inf')
+            for _ in range(repeat):
+                gc.collect()
+                started = time.perf_counter()
+                run_engine(engine, report)
+                best = min(best, time.perf_counter() - started)
+            ok = actual == expected
+            if not ok:
+                failures.append(f"{name} / {engine}: {first_difference(actual, expected)}")
+            rate = f"{round(rows / best):,}" if best > 0 else '-'
+            print(f"{name:<24} {rows:>7,} {groups:>7,} {engine:<14} {best * 1000:>10.2f} {rate:>12}  "
+                  f"{'OK' if ok else 'РАСХОЖДЕНИЕ'}")
+    return failures
+
+
+def _pseudonym(value: str, salt: str) -> str:
+    digest = hashlib.sha256(f"{salt}:{value.strip().lower()}".encode('utf-8')).hexdigest()[:12]
+    stripped = value.strip()
+    pseudonym = f"anon{digest}"
+    if stripped != stripped.lower():
+        pseudonym = pseudonym.upper()
+    # Пробелы по краям сохраняются: на них проверяется очистка clickid
+    start = len(value) - len(value.lstrip())
+    return value[:start] + pseudonym + value[start + len(stripped):]
+
+
+def anonymize_value(value: Any, salt: str) -> Any:
+    """Стабильный псевдоним значения clickid / campaign_id / player_id"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        digest = hashlib.sha256(f"{salt}:{value}".encode('utf-8')).hexdigest()
+        return int(digest[:8], 16)
+    text = str(value)
+    if text.strip().lower() in KEPT_CLICKIDS:
+        return value
+    return _pseudonym(text, salt)
+
+
+def anonymize_report(report: Dict[str, Any], salt: str, limit: Optional[int] = None) -> Dict[str, Any]:
+    """Отчет для набора: только поля парсера, идентификаторы заменены псевдонимами"""
+    rows = ((report or {}).get('rows') or {}).get('data') or []
+    if limit:
+        rows = rows[:limit]
+    data = []
+    for row in rows:
+        fields = []
+        for field in row:
+            name = field.get('name')
+            if name not in PARSED_FIELDS:
+                continue
+            field = dict(field)
+            if name in CLICKID_FIELDS:
+                field['value'] = anonymize_value(field.get('value'), salt)
+            fields.append(field)
+        data.append(fields)
+    return {'report_type': report.get('report_type', 'partner'), 'rows': {'data': data}}
+
+
+def record(source: str, name: str, description: str, limit: Optional[int], salt: str):
+    """Записывает ответ API как новый случай набора и его ожидаемый результат"""
+    report = anonymize_report(json.loads(load_payload(source)), salt, limit)
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    rows = ',\n  '.join(json.dumps(row, ensure_ascii=False) for row in report['rows']['data'])
+    with open(os.path.join(GOLDEN_DIR, f'{name}.json'), 'w', encoding='utf-8') as f:
+        # Одна строка отчета - одна строка файла: изменения набора удобно смотреть в diff
+        f.write(f'{{\n "description": {json.dumps(description, ensure_ascii=False)},\n'
+                f' "report": {{"report_type": {json.dumps(report["report_type"])}, "rows": {{"data": [\n  {rows}\n ]}}}}\n}}\n')
+    with open(expected_path(name), 'wb') as f:
+        f.write(run_engine(REFERENCE_ENGINE, report))
+    print(f"Случай {name}: {len(report['rows']['data']):,} строк записано в {GOLDEN_DIR}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Регрессионная проверка parse/transform на эталонном наборе')
+    subparsers = parser.add_subparsers(dest='command')
+
+    record_parser = subparsers.add_parser('record', help='Записать ответ API как новый случай набора')
+    record_parser.add_argument('source', help='JSON-ответ API или файл raw_store (.ndjson / .ndjson.gz)')
+    record_parser.add_argument('--name', required=True, help='Имя случая')
+    record_parser.add_argument('--description', default='', help='Описание случая')
+    record_parser.add_argument('--limit', type=int, default=None, help='Взять только первые N строк отчета')
+    record_parser.add_argument('--salt', default='golden', help='Соль псевдонимов clickid')
+
+    parser.add_argument('--case', nargs='+', default=None, help='Проверить только эти случаи')
+    parser.add_argument('--engine', nargs='+', choices=list(ENGINES), default=list(ENGINES),
+                        help='Движки для проверки (по умолчанию все)')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторов для замера времени (берется лучшее)')
+    parser.add_argument('--update', action='store_true',
+                        help=f'Пересоздать ожидаемые результаты движком {REFERENCE_ENGINE}')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    if args.command == 'record':
+        record(args.source, args.name, args.description, args.limit, args.salt)
+        return
+
+    failures = check(list_cases(args.case), args.engine, max(args.repeat, 1), args.update)
+    if failures:
+        print("\nРасхождения с ожидаемыми результатами:")
+        for line in failures:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("\nВсе движки совпадают с ожидаемыми результатами")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Дисковый кеш HTTP-ответов Affilka API с TTL и LRU-вытеснением
+
+Ключ кеша - (base_url, хеш токена, путь, нормализованные параметры запроса).
+Время жизни зависит от периода отчета:
+- закрытые прошлые месяцы (to < 1 число текущего месяца) кешируются бессрочно;
+- прошлые дни текущего месяца - HTTP_CACHE_TTL_PAST_MINUTES;
+- отчеты, включающие сегодняшний день, - HTTP_CACHE_TTL_TODAY_MINUTES.
+
+Если сервер вернул ETag или Last-Modified, после истечения TTL отправляется
+условный запрос (If-None-Match / If-Modified-Since), и при ответе 304
+тело берется из кеша. Общий размер кеша ограничен HTTP_CACHE_MAX_MB,
+при превышении удаляются записи, к которым дольше всего не обращались.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, date
+from typing import Dict, Any, Optional
+from config import (
+    HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB,
+    HTTP_CACHE_TTL_PAST_MINUTES, HTTP_CACHE_TTL_TODAY_MINUTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_date(value: Any) -> Optional[date]:
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+class ResponseCache:
+    """Дисковый кеш ответов: <key>.body (тело ответа) и <key>.json (метаданные)"""
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            directory: Каталог кеша (по умолчанию HTTP_CACHE_DIR)
+            max_bytes: Максимальный суммарный размер тел ответов (по умолчанию HTTP_CACHE_MAX_MB)
+        """
+        self.directory = directory or HTTP_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else int(HTTP_CACHE_MAX_MB * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(base_url: str, token: str, path: str, params: Dict[str, Any]) -> str:
+        """Ключ кеша: токен хешируется, параметры нормализуются (сортировка ключей и значений списков)"""
+        normalized = {
+            key: sorted(str(v) for v in value) if isinstance(value, (list, tuple)) else str(value)
+            for key, value in params.items()
+            if value is not None
+        }
+        raw_key = json.dumps({
+            'base_url': base_url.rstrip('/'),
+            'token': hashlib.sha256(token.encode('utf-8')).hexdigest(),
+            'path': path,
+            'params': normalized,
+        }, sort_keys=True)
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def ttl_for(params: Dict[str, Any], today: Optional[date] = None) -> Optional[float]:
+        """
+        Время жизни записи в секундах в зависимости от периода отчета
+
+        Returns:
+            None - бессрочно (закрытый прошлый месяц), иначе TTL в секундах
+        """
+        today = today or date.today()
+        to_date = _parse_date(params.get('to'))
+        if to_date is None:
+            return HTTP_CACHE_TTL_TODAY_MINUTES * 60
+        if to_date < date(today.year, today.month, 1):
+            return None
+        if to_date < today:
+            return HTTP_CACHE_TTL_PAST_MINUTES * 60
+        return HTTP_CACHE_TTL_TODAY_MINUTES * 60
+
+    def _paths(self, key: str):
+        return os.path.join(self.directory, f"{key}.body"), os.path.join(self.directory, f"{key}.json")
+
+    def _read_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        body_path, meta_path = self._paths(key)
+        if not (os.path.exists(body_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _touch(self, key: str):
+        # Время последнего обращения (для LRU) - mtime файла метаданных
+        try:
+            os.utime(self._paths(key)[1])
+        except OSError:
+            pass
+
+    def _read_body(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._paths(key)[0], 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Возвращает тело ответа, если запись есть и не истекла"""
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        expires_at = meta.get('expires_at')
+        if expires_at is not None and time.time() > expires_at:
+            return None
+        body = self._read_body(key)
+        if body is not None:
+            self._touch(key)
+            logger.info(f"Ответ API взят из кеша ({len(body)} байт)")
+        return body
+
+    def conditional_headers(self, key: str) -> Dict[str, str]:
+        """Заголовки для условного запроса по истекшей записи (если сервер отдавал ETag/Last-Modified)"""
+        meta = self._read_meta(key)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def revalidate(self, key: str, ttl: Optional[float]) -> Optional[bytes]:
+        """Продлевает запись после ответа 304 Not Modified и возвращает тело из кеша"""
+        meta = self._read_meta(key)
+        body = self._read_body(key)
+        if meta is None or body is None:
+            return None
+        meta['stored_at'] = time.time()
+        meta['expires_at'] = None if ttl is None else meta['stored_at'] + ttl
+        self._write_meta(key, meta)
+        logger.info(f"Ответ API не изменился (304), используем кеш ({len(body)} байт)")
+        return body
+
+    def _write_meta(self, key: str, meta: Dict[str, Any]):
+        meta_path = self._paths(key)[1]
+        tmp_path = f"{meta_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def put(self, key: str, body: bytes, headers: Optional[Dict[str, str]] = None, ttl: Optional[float] = None, url: Optional[str] = None):
+        """Сохраняет ответ в кеш и при необходимости вытесняет старые записи"""
+        if self.max_bytes and len(body) > self.max_bytes:
+            logger.debug("Ответ больше размера кеша, не кешируем")
+            return
+        headers = headers or {}
+        body_path = self._paths(key)[0]
+        tmp_path = f"{body_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, body_path)
+        stored_at = time.time()
+        self._write_meta(key, {
+            'url': url,
+            'stored_at': stored_at,
+            'expires_at': None if ttl is None else stored_at + ttl,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'size': len(body),
+        })
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Удаляет записи, к которым дольше всего не обращались, пока размер кеша больше max_bytes
+
+        Returns:
+            Количество удаленных записей
+        """
+        if not self.max_bytes:
+            return 0
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.body'):
+                    continue
+                key = name[:-len('.body')]
+                body_path, meta_path = self._paths(key)
+                try:
+                    size = os.path.getsize(body_path)
+                    last_access = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+                except OSError:
+                    continue
+                entries.append((last_access, key, size))
+                total += size
+
+            removed = 0
+            for _last_access, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                removed += 1
+            if removed:
+                logger.info(f"Из кеша ответов API вытеснено {removed} записей")
+            return removed
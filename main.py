@@ -1,11 +1,26 @@
 """
 Главный скрипт для запуска ETL процесса
 Можно запускать вручную или через cron на Railway
+
+Команды:
+    python main.py [--from-date ... --to-date ...]   - однократный запуск ETL
+    python main.py serve [--schedule 15m]            - долгоживущий режим с внутренним расписанием
+    python main.py replay [--account account_1]      - пересборка fact_click_month из сохраненных ответов API
+    python main.py stats [--days 30]                 - p50/p95 длительностей стадий по истории запусков
+    python main.py analytics offers [--format csv]   - отчеты по загруженным данным (см. analytics.py)
+
+    --profile {cprofile,tracemalloc,sampling}        - профиль каждой стадии каждого аккаунта (см. profiling.py)
+    --api-override http://127.0.0.1:8808             - запросы к локальному mock API (см. mock_affilka_server.py)
 """
+import os
 import sys
 import argparse
-from datetime import datetime, timedelta, date
-from etl_process import process_all_accounts
+from datetime import datetime, timedelta
+import profiling
+from profiling import PROFILE_MODES
+from etl_process import process_all_accounts, current_month_range
+from analytics import add_arguments as add_analytics_arguments
+from config import DEFAULT_REPORT_COLUMNS, DEFAULT_REPORT_GROUP_BY, ETL_TIME_BUDGET_MINUTES
 import logging
 
 logging.basicConfig(
@@ -15,57 +30,280 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def parse_deadline(value: str) -> datetime:
+    """
+    Парсит --deadline: 'HH:MM' (ближайшее наступление этого времени) или 'YYYY-MM-DD HH:MM'
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        at = datetime.strptime(value, '%H:%M').time()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Некорректный формат --deadline: {value} (ожидается HH:MM или YYYY-MM-DD HH:MM)")
+    now = datetime.now()
+    deadline = datetime.combine(now.date(), at)
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return deadline
+
+
+def resolve_deadline(args):
+    """Определяет время завершения запуска из --deadline / --time-budget / ETL_TIME_BUDGET_MINUTES"""
+    if args.deadline:
+        return args.deadline
+    budget_minutes = args.time_budget if args.time_budget is not None else ETL_TIME_BUDGET_MINUTES
+    if budget_minutes and budget_minutes > 0:
+        return datetime.now() + timedelta(minutes=budget_minutes)
+    return None
+
+
+def run_once(args):
+    """Однократный запуск ETL для всех аккаунтов"""
+    # Определяем диапазон дат
+    if args.from_date and args.to_date:
+        from_date = args.from_date
+        to_date = args.to_date
+    else:
+        # По умолчанию загружаем весь месяц с 1 числа по текущее число
+        from_date, to_date = current_month_range()
+
+    logger.info(f"Запуск ETL процесса для периода: {from_date} - {to_date}")
+
+    try:
+        # Используем стандартные колонки и группировку по месяцу
+        columns = list(DEFAULT_REPORT_COLUMNS)
+        group_by = list(DEFAULT_REPORT_GROUP_BY)
+        process_all_accounts(
+            from_date, to_date, columns, group_by,
+            pipeline=args.pipeline or None,
+            deadline=resolve_deadline(args)
+        )
+        logger.info("ETL процесс завершен успешно")
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Критическая ошибка в ETL процессе: {e}", exc_info=True)
+        sys.exit(1)
+
+
+def run_serve(args):
+    """Долгоживущий режим: теплые соединения и внутреннее расписание"""
+    from scheduler import ETLScheduler
+
+    try:
+        scheduler = ETLScheduler(
+            default_schedule=args.schedule,
+            run_on_start=not args.no_run_on_start
+        )
+        scheduler.serve_forever()
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Критическая ошибка в режиме serve: {e}", exc_info=True)
+        sys.exit(1)
+
+
+def run_replay(args):
+    """Пересборка fact_click_month из хранилища сырых ответов без запросов к API"""
+    from replay import replay
+
+    try:
+        replay(
+            account_ids=args.account or None,
+            from_date=args.from_date,
+            to_date=args.to_date,
+            group_by=args.group_by.split(',') if args.group_by else None,
+            workers=args.workers,
+            dry_run=args.dry_run,
+            enrich=not args.no_enrich
+        )
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Критическая ошибка в режиме replay: {e}", exc_info=True)
+        sys.exit(1)
+
+
+def run_stats(args):
+    """Статистика длительностей стадий по таблице etl_run_stages"""
+    from run_stats import show_stats
+
+    try:
+        show_stats(days=args.days, account_id=args.account)
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики запусков: {e}", exc_info=True)
+        sys.exit(1)
+
+
+def run_analytics(args):
+    """Отчеты по загруженным данным (analytics.py)"""
+    from analytics import run
+
+    try:
+        sys.exit(0 if run(args) else 1)
+    except Exception as e:
+        logger.error(f"Ошибка при построении отчета: {e}", exc_info=True)
+        sys.exit(1)
+
+
 def main():
     """Главная функция для запуска ETL"""
     parser = argparse.ArgumentParser(description='ETL процесс для загрузки данных из Affilka API')
-    
+
     parser.add_argument(
         '--from-date',
         type=str,
         help='Начальная дата в формате YYYY-MM-DD (по умолчанию: вчера)',
         default=None
     )
-    
+
     parser.add_argument(
         '--to-date',
         type=str,
         help='Конечная дата в формате YYYY-MM-DD (по умолчанию: сегодня)',
         default=None
     )
-    
+
     parser.add_argument(
         '--days-back',
         type=int,
         help='Количество дней назад для загрузки (по умолчанию: загружается весь месяц с 1 числа)',
         default=None
     )
-    
+
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Конвейерный режим: запросы к API, трансформация и загрузка выполняются параллельно '
+             '(по умолчанию: ETL_PIPELINE)'
+    )
+
+    parser.add_argument(
+        '--deadline',
+        type=parse_deadline,
+        help='Время, к которому запуск должен завершиться: HH:MM или "YYYY-MM-DD HH:MM". '
+             'Аккаунты, которые не успеют обработаться, пропускаются',
+        default=None
+    )
+
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='Бюджет времени на запуск в минутах (по умолчанию: ETL_TIME_BUDGET_MINUTES, 0 - без ограничения)',
+        default=None
+    )
+
+    parser.add_argument(
+        '--profile',
+        choices=PROFILE_MODES,
+        help='Профилировать стадии ETL по аккаунтам: cprofile (pstats), tracemalloc (места выделения памяти), '
+             'sampling (collapsed stacks для flamegraph). По умолчанию: ETL_PROFILE',
+        default=None
+    )
+
+    parser.add_argument(
+        '--profile-dir',
+        type=str,
+        help='Каталог артефактов профилирования (по умолчанию: ETL_PROFILE_DIR)',
+        default=None
+    )
+
+    parser.add_argument(
+        '--api-override',
+        type=str,
+        help='Базовый URL API вместо URL аккаунтов, например локальный mock: '
+             'http://127.0.0.1:8808 (см. mock_affilka_server.py). По умолчанию: AFFILKA_API_OVERRIDE',
+        default=None
+    )
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Долгоживущий режим: ETL по внутреннему расписанию с теплыми соединениями'
+    )
+    serve_parser.add_argument(
+        '--schedule',
+        type=str,
+        help='Расписание для аккаунтов без AFFILKA_SCHEDULE_N: интервал (15m, 1h, 1d) '
+             'или cron-выражение ("*/15 * * * *"). По умолчанию: ETL_SCHEDULE',
+        default=None
+    )
+    serve_parser.add_argument(
+        '--no-run-on-start',
+        action='store_true',
+        help='Не запускать ETL сразу после старта, ждать первого срабатывания расписания'
+    )
+
+    replay_parser = subparsers.add_parser(
+        'replay',
+        help='Пересборка fact_click_month из сохраненных ответов API (raw_store) без запросов к API'
+    )
+    replay_parser.add_argument(
+        '--account',
+        action='append',
+        help='Аккаунт (account_1, account_2, ...); можно указать несколько раз. По умолчанию: все',
+        default=None
+    )
+    # SUPPRESS: чтобы значения, указанные до подкоманды, не перезаписывались
+    replay_parser.add_argument('--from-date', type=str, default=argparse.SUPPRESS,
+                               help='Начальная дата в формате YYYY-MM-DD')
+    replay_parser.add_argument('--to-date', type=str, default=argparse.SUPPRESS,
+                               help='Конечная дата в формате YYYY-MM-DD')
+    replay_parser.add_argument(
+        '--group-by',
+        type=str,
+        help='Группировка ответов для replay через запятую (по умолчанию: month,dynamic_tag_visit_id)',
+        default=None
+    )
+    replay_parser.add_argument(
+        '--workers',
+        type=int,
+        help='Количество процессов для парсинга (по умолчанию: число CPU)',
+        default=None
+    )
+    replay_parser.add_argument('--dry-run', action='store_true',
+                               help='Только распарсить и трансформировать, без записи в БД')
+    replay_parser.add_argument('--no-enrich', action='store_true',
+                               help='Не выполнять обогащение из Keitaro после загрузки')
+
+    stats_parser = subparsers.add_parser(
+        'stats',
+        help='p50/p95 длительностей стадий по стадиям и аккаунтам (таблица etl_run_stages)'
+    )
+    stats_parser.add_argument('--days', type=int, default=30,
+                              help='Глубина истории в днях (по умолчанию: 30)')
+    stats_parser.add_argument('--account', type=str, default=None,
+                              help='Только один аккаунт (account_1, account_2, ...)')
+
+    analytics_parser = subparsers.add_parser(
+        'analytics',
+        help='Отчеты по fact_click_month: summary, daily, offers, mapping, offer-types, latest, verify, reconcile '
+             '(вывод table, csv или json)'
+    )
+    add_analytics_arguments(analytics_parser)
+
     args = parser.parse_args()
-    
-    # Определяем диапазон дат
-    today = datetime.now().date()
-    
-    if args.from_date and args.to_date:
-        from_date = args.from_date
-        to_date = args.to_date
+
+    if args.api_override:
+        # get_affilka_accounts читает переменную при каждом вызове (в том числе в режиме serve)
+        os.environ['AFFILKA_API_OVERRIDE'] = args.api_override
+
+    if args.profile:
+        profiling.enable(args.profile, args.profile_dir)
     else:
-        # По умолчанию загружаем весь месяц с 1 числа по текущее число
-        month_start = date(today.year, today.month, 1)
-        from_date = month_start.strftime('%Y-%m-%d')
-        to_date = today.strftime('%Y-%m-%d')
-    
-    logger.info(f"Запуск ETL процесса для периода: {from_date} - {to_date}")
-    
-    try:
-        # Используем стандартные колонки и группировку по месяцу
-        columns = ['first_deposits_count', 'deposits_count', 'deposits_sum', 'partner_income', 'ngr']
-        group_by = ['month', 'dynamic_tag_visit_id']
-        process_all_accounts(from_date, to_date, columns, group_by)
-        logger.info("ETL процесс завершен успешно")
-        sys.exit(0)
-    except Exception as e:
-        logger.error(f"Критическая ошибка в ETL процессе: {e}", exc_info=True)
-        sys.exit(1)
+        profiling.enable_from_config()
+
+    if args.command == 'serve':
+        run_serve(args)
+    elif args.command == 'replay':
+        run_replay(args)
+    elif args.command == 'stats':
+        run_stats(args)
+    elif args.command == 'analytics':
+        run_analytics(args)
+    else:
+        run_once(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,428 @@
+"""
+Локальный mock Affilka API для нагрузочного тестирования без сети
+
+Реализует /api/customer/v1/partner/report и /api/customer/v1/partner/report/attributes.
+Отчет - синтетический (synthetic_report.py, период строк совпадает с from/to запроса)
+или записанный: JSON-файл с ответом API или файл raw_store (.ndjson.gz / .ndjson.zst),
+несколько файлов отдаются по кругу.
+
+Инъекция сбоев (только для /report, attributes отвечает всегда):
+- задержка ответа: 200 | uniform:50:500 | normal:300:100 | lognormal:300:0.5 | exp:200 (мс);
+- 429 с заголовком Retry-After с заданной вероятностью;
+- 5xx: случайные (--error-rate) и сериями (--burst-every N --burst-length M: M ошибок после каждых N ответов);
+- обрезанное тело: Content-Length полного ответа, отправляется половина и соединение закрывается;
+- медленная отдача: тело отдается частями со скоростью --drip-bps байт/с.
+
+Использование:
+    python mock_affilka_server.py --port 8808 --rows 200000
+    python mock_affilka_server.py --latency lognormal:800:0.6 --rate-limit 0.05 --burst-every 20 --burst-length 3
+    python mock_affilka_server.py --payload raw_store/account_1/2026-01-01_2026-01-31/month+dynamic_tag_visit_id/<hash>.ndjson.gz
+    python main.py --api-override http://127.0.0.1:8808    # полный прогон ETL против mock
+
+Из кода (бенчмарки):
+    with MockAffilkaServer(rows=100000) as server:
+        api = AffilkaAPI('token', server.url)
+
+Счетчики запросов и ответов: GET /__mock/stats.
+"""
+import json
+import gzip
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import Counter, OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from config import AFFILKA_API_ENDPOINT, DEFAULT_REPORT_COLUMNS
+from raw_store import RawStore
+from synthetic_report import generate_payload
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTES_ENDPOINT = f"{AFFILKA_API_ENDPOINT}/attributes"
+STATS_ENDPOINT = '/__mock/stats'
+
+AVAILABLE_COLUMNS = DEFAULT_REPORT_COLUMNS + ['visits_count', 'clean_net_revenue']
+AVAILABLE_GROUPERS = [
+    'day', 'week', 'month', 'year', 'dynamic_tag_visit_id', 'dynamic_tag_sub_id',
+    'dynamic_tag_click_id', 'campaign_id', 'player_id', 'country',
+]
+
+# Сколько синтетических отчетов (по периодам) держать в памяти
+PAYLOAD_CACHE_SIZE = 8
+
+# Размер части тела при медленной отдаче
+DRIP_CHUNK_SIZE = 8192
+
+
+def parse_latency(spec: Optional[str]) -> Callable[[random.Random], float]:
+    """
+    Распределение задержки ответа
+
+    Args:
+        spec: 200 (фиксированная), uniform:MIN:MAX, normal:MEAN:STD, lognormal:MEDIAN:SIGMA, exp:MEAN; все в мс
+
+    Returns:
+        Функция rnd -> задержка в секундах
+    """
+    if not spec:
+        return lambda rnd: 0.0
+    kind, _, rest = spec.partition(':')
+    try:
+        if not rest:
+            fixed = float(kind) / 1000
+            return lambda rnd: fixed
+        args = [float(value) for value in rest.split(':')]
+        if kind == 'uniform':
+            low, high = args
+            return lambda rnd: rnd.uniform(low, high) / 1000
+        if kind == 'normal':
+            mean, std = args
+            return lambda rnd: max(rnd.gauss(mean, std), 0) / 1000
+        if kind == 'lognormal':
+            median, sigma = args
+            mu = math.log(max(median, 1e-3))
+            return lambda rnd: rnd.lognormvariate(mu, sigma) / 1000
+        if kind == 'exp':
+            mean, = args
+            return lambda rnd: rnd.expovariate(1 / mean) / 1000 if mean > 0 else 0.0
+    except ValueError:
+        pass
+    raise ValueError(f"Некорректное распределение задержки: {spec} "
+                     f"(ожидается 200, uniform:MIN:MAX, normal:MEAN:STD, lognormal:MEDIAN:SIGMA или exp:MEAN)")
+
+
+class Faults:
+    """Настройки инъекции сбоев и выбор сбоя для очередного запроса отчета"""
+
+    def __init__(
+        self,
+        latency: Optional[str] = None,
+        rate_limit: float = 0.0,
+        retry_after: int = 1,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        burst_every: int = 0,
+        burst_length: int = 0,
+        truncate_rate: float = 0.0,
+        drip_rate: float = 0.0,
+        drip_bps: int = 65536,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            latency: Распределение задержки (см. parse_latency)
+            rate_limit: Доля ответов 429
+            retry_after: Значение заголовка Retry-After (сек)
+            error_rate: Доля случайных ответов error_status
+            error_status: Код ответа для ошибок и серий ошибок (5xx)
+            burst_every: Серия ошибок после каждых burst_every запросов (0 - без серий)
+            burst_length: Длина серии ошибок
+            truncate_rate: Доля ответов с обрезанным телом
+            drip_rate: Доля ответов, отдаваемых медленно
+            drip_bps: Скорость медленной отдачи (байт/с)
+            seed: Зерно генератора (None - случайное)
+        """
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.truncate_rate = truncate_rate
+        self.drip_rate = drip_rate
+        self.drip_bps = max(drip_bps, 1)
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    def next(self) -> Tuple[float, Optional[str]]:
+        """
+        Задержка и сбой для очередного запроса
+
+        Returns:
+            (задержка в секундах, сбой): None, 'rate_limit', 'error', 'truncate' или 'drip'
+        """
+        with self._lock:
+            self._requests += 1
+            delay = self.latency(self._rnd)
+            if self.burst_every > 0 and self.burst_length > 0:
+                cycle = self.burst_every + self.burst_length
+                if (self._requests - 1) % cycle >= self.burst_every:
+                    return delay, 'error'
+            roll = self._rnd.random()
+            for fault, rate in (('rate_limit', self.rate_limit), ('error', self.error_rate),
+                                ('truncate', self.truncate_rate), ('drip', self.drip_rate)):
+                if roll < rate:
+                    return delay, fault
+                roll -= rate
+            return delay, None
+
+
+def load_payload(path: str) -> bytes:
+    """Записанный ответ API: JSON-файл или файл raw_store"""
+    if '.ndjson' in path:
+        return json.dumps(RawStore().load(path)).encode('utf-8')
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class MockAffilkaServer:
+    """HTTP-сервер, имитирующий Affilka API"""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        rows: int = 10000,
+        clickids: Optional[int] = None,
+        null_rate: float = 0.0,
+        payloads: Optional[List[bytes]] = None,
+        faults: Optional[Faults] = None,
+        compression: bool = True,
+        seed: int = 42
+    ):
+        """
+        Args:
+            host: Адрес для прослушивания
+            port: Порт (0 - любой свободный, см. url)
+            rows: Строк в синтетическом отчете
+            clickids: Различных clickid в синтетическом отчете (по умолчанию rows / 3)
+            null_rate: Доля строк без clickid в синтетическом отчете
+            payloads: Записанные ответы (тела JSON); если заданы, отдаются по кругу вместо синтетических
+            faults: Инъекция сбоев (по умолчанию без сбоев)
+            compression: Сжимать ответ gzip, если клиент его принимает
+            seed: Зерно синтетического отчета
+        """
+        self.rows = rows
+        self.clickids = clickids
+        self.null_rate = null_rate
+        self.payloads = list(payloads or [])
+        self.faults = faults or Faults()
+        self.compression = compression
+        self.seed = seed
+        self.stats = Counter()
+        self._payload_cache: 'OrderedDict[Any, Tuple[bytes, Optional[bytes]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+
+    @property
+    def url(self) -> str:
+        """Базовый URL для AffilkaAPI / --api-override"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def attributes(self) -> bytes:
+        """Тело ответа /report/attributes"""
+        return json.dumps({
+            'available_columns': AVAILABLE_COLUMNS,
+            'available_groupers': AVAILABLE_GROUPERS,
+        }).encode('utf-8')
+
+    def report(self, params: Dict[str, List[str]]) -> Tuple[bytes, Optional[bytes]]:
+        """Тело отчета для параметров запроса: (JSON, JSON в gzip или None до первого запроса с gzip)"""
+        with self._lock:
+            if self.payloads:
+                index = self.stats['report'] % len(self.payloads)
+                key = ('recorded', index)
+            else:
+                from_date = (params.get('from') or ['2026-01-01'])[0][:10]
+                to_date = (params.get('to') or [from_date])[0][:10]
+                key = (from_date, to_date)
+            cached = self._payload_cache.get(key)
+            if cached is not None:
+                self._payload_cache.move_to_end(key)
+                return cached
+
+        if self.payloads:
+            body = self.payloads[key[1]]
+        else:
+            try:
+                days = (date.fromisoformat(key[1]) - date.fromisoformat(key[0])).days + 1
+            except ValueError:
+                days = 28
+            body = generate_payload(self.rows, clickids=self.clickids, null_rate=self.null_rate,
+                                    days=max(days, 1), start_date=key[0], seed=self.seed)
+        entry = (body, gzip.compress(body, compresslevel=6) if self.compression else None)
+        with self._lock:
+            self._payload_cache[key] = entry
+            while len(self._payload_cache) > PAYLOAD_CACHE_SIZE:
+                self._payload_cache.popitem(last=False)
+        return entry
+
+    def count(self, *keys: str):
+        with self._lock:
+            self.stats.update(keys)
+
+    def start(self) -> 'MockAffilkaServer':
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-affilka', daemon=True)
+        self._thread.start()
+        logger.info(f"Mock Affilka API: {self.url}")
+        return self
+
+    def stop(self):
+        """Останавливает сервер"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'MockAffilkaServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def mock(self) -> MockAffilkaServer:
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.mock.count(f'status_{status}')
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        self._send(status, json.dumps({'error': message}).encode('utf-8'), headers)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path.rstrip('/')
+        if path == STATS_ENDPOINT:
+            with self.mock._lock:
+                stats = dict(self.mock.stats)
+            self._send(200, json.dumps(stats).encode('utf-8'))
+            return
+        if path not in (AFFILKA_API_ENDPOINT, ATTRIBUTES_ENDPOINT):
+            self._error(404, f"Not found: {parts.path}")
+            return
+        if not self.headers.get('Authorization'):
+            self._error(401, 'Unauthorized')
+            return
+        if path == ATTRIBUTES_ENDPOINT:
+            self.mock.count('attributes')
+            self._send(200, self.mock.attributes())
+            return
+        self._report(parse_qs(parts.query))
+
+    def _report(self, params: Dict[str, List[str]]):
+        faults = self.mock.faults
+        delay, fault = faults.next()
+        if delay > 0:
+            time.sleep(delay)
+        if fault:
+            self.mock.count(f'fault_{fault}')
+        if fault == 'rate_limit':
+            self._error(429, 'Too Many Requests', {'Retry-After': str(faults.retry_after)})
+            return
+        if fault == 'error':
+            self._error(faults.error_status, 'Service Unavailable')
+            return
+
+        body, compressed = self.mock.report(params)
+        self.mock.count('report')
+        headers = {}
+        if compressed is not None and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = compressed
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if fault == 'truncate':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.mock.count('status_200')
+
+        if fault == 'truncate':
+            # Отправляем половину тела и рвем соединение: клиент получает меньше Content-Length
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        elif fault == 'drip':
+            pause = DRIP_CHUNK_SIZE / faults.drip_bps
+            for offset in range(0, len(body), DRIP_CHUNK_SIZE):
+                self.wfile.write(body[offset:offset + DRIP_CHUNK_SIZE])
+                self.wfile.flush()
+                time.sleep(pause)
+        else:
+            self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный mock Affilka API с инъекцией сбоев')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Адрес (по умолчанию 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8808, help='Порт (по умолчанию 8808)')
+    parser.add_argument('--rows', type=int, default=10000, help='Строк в синтетическом отчете (по умолчанию 10000)')
+    parser.add_argument('--clickids', type=int, default=None, help='Различных clickid (по умолчанию rows / 3)')
+    parser.add_argument('--null-rate', type=float, default=0.0, help='Доля строк без clickid (0..1)')
+    parser.add_argument('--payload', action='append', default=None,
+                        help='Записанный ответ (JSON или файл raw_store) вместо синтетического; '
+                             'можно указать несколько раз - отдаются по кругу')
+    parser.add_argument('--no-compression', action='store_true', help='Не сжимать ответы gzip')
+    parser.add_argument('--latency', type=str, default=None,
+                        help='Задержка ответа в мс: 200 | uniform:MIN:MAX | normal:MEAN:STD | '
+                             'lognormal:MEDIAN:SIGMA | exp:MEAN')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Доля ответов 429 (0..1)')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After для 429 в секундах (по умолчанию 1)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля случайных ответов 5xx (0..1)')
+    parser.add_argument('--error-status', type=int, default=503, help='Код ответа для ошибок (по умолчанию 503)')
+    parser.add_argument('--burst-every', type=int, default=0,
+                        help='Серия ошибок после каждых N запросов отчета (0 - без серий)')
+    parser.add_argument('--burst-length', type=int, default=3, help='Длина серии ошибок (по умолчанию 3)')
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help='Доля ответов с обрезанным телом (0..1)')
+    parser.add_argument('--drip-rate', type=float, default=0.0, help='Доля медленно отдаваемых ответов (0..1)')
+    parser.add_argument('--drip-bps', type=int, default=65536,
+                        help='Скорость медленной отдачи в байтах/с (по умолчанию 65536)')
+    parser.add_argument('--seed', type=int, default=None, help='Зерно генератора сбоев (по умолчанию случайное)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    faults = Faults(
+        latency=args.latency, rate_limit=args.rate_limit, retry_after=args.retry_after,
+        error_rate=args.error_rate, error_status=args.error_status,
+        burst_every=args.burst_every, burst_length=args.burst_length if args.burst_every else 0,
+        truncate_rate=args.truncate_rate, drip_rate=args.drip_rate, drip_bps=args.drip_bps, seed=args.seed
+    )
+    server = MockAffilkaServer(
+        args.host, args.port, rows=args.rows, clickids=args.clickids, null_rate=args.null_rate,
+        payloads=[load_payload(path) for path in args.payload or []], faults=faults,
+        compression=not args.no_compression
+    )
+    logger.info(f"Mock Affilka API: {server.url} (для ETL: python main.py --api-override {server.url})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        logger.info(f"Статистика запросов: {dict(server.stats)}")
+
+
+if __name__ == '__main__':
+    main()
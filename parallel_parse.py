@@ -0,0 +1,192 @@
+"""
+Параллельный парсинг больших отчетов в пуле процессов
+
+parse_report_data однопоточный и упирается в CPU на отчетах крупнейших аккаунтов.
+Если в rows.data не меньше AFFILKA_PARSE_PARALLEL_THRESHOLD строк и
+AFFILKA_PARSE_PROCESSES > 1, строки делятся на части, каждая часть парсится
+и предварительно агрегируется по (period_date, clickid) в дочернем процессе,
+а частичные агрегаты объединяются в родительском (FTD - максимум, метрики - сумма).
+
+Если в процессе нет других потоков (обычный запуск), пул создается через fork
+на время одного отчета: строки не передаются через pickle (сериализация
+декодированного JSON стоит дороже самого парсинга), дочерние процессы
+наследуют их и получают только границы своей части.
+
+Если другие потоки есть (конвейер, serve), fork унаследовал бы блокировки
+(логирование, таблица clickid, пулы соединений), захваченные этими потоками
+в момент fork. Тогда пул создается через forkserver (на платформах без него -
+spawn), и части строк передаются через pickle: это окупается только при
+большом количестве ядер. Модуль заранее загружается в forkserver.
+Обратно в обоих случаях передаются компактные кортежи агрегатов.
+
+Результат - уже сгруппированные записи; повторный transform_data по ним не меняет данных.
+Небольшие отчеты парсятся в текущем процессе, чтобы не платить за запуск процессов.
+
+iter_report_chunks отдает распарсенные записи частями по PARSE_CHUNK_ROWS строк
+и освобождает разобранные строки ответа: вызывающий код добавляет каждую часть
+в SpillingAggregator и не держит одновременно весь ответ и все записи.
+"""
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from affilka_api import parse_report_rows
+from records import ClickRecord, aggregate_records, merge_records
+from reject_sink import RejectSink
+from run_metrics import add_children_cpu, children_cpu_seconds
+from config import AFFILKA_PARSE_PROCESSES, AFFILKA_PARSE_PARALLEL_THRESHOLD, AFFILKA_KEEP_DEBUG_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Частей на процесс: несколько частей на процесс выравнивают нагрузку между процессами
+CHUNKS_PER_PROCESS = 2
+# Строк ответа в одной части при потоковом парсинге в текущем процессе
+PARSE_CHUNK_ROWS = 50000
+
+# Строки текущего отчета: наследуются дочерними процессами при fork
+_rows: Optional[List[list]] = None
+# Одновременно параллельно парсится один отчет (он и так занимает все процессы)
+_parse_lock = threading.Lock()
+
+
+def _pool_context():
+    """
+    Контекст пула: fork, только если в процессе один поток, иначе forkserver или spawn
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return multiprocessing.get_context('fork')
+    if 'forkserver' in methods:
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _pack(groups: List[ClickRecord]) -> List[Tuple]:
+    # Кортежи сериализуются заметно быстрее объектов
+    return [(g.period_date, g.clickid, g.ftd, g.dep_cnt, g.dep_sum, g.ngr, g.cpa) for g in groups]
+
+
+def _parse_chunk(rows: List[list]) -> Tuple[List[Tuple], RejectSink]:
+    """Парсит и агрегирует часть строк отчета (в дочернем процессе); пропуски учитываются в родителе"""
+    rejects = RejectSink('parse')
+    groups = aggregate_records(parse_report_rows(rows, rejects=rejects), rejects=rejects)
+    return _pack(groups), rejects
+
+
+def _parse_range(bounds: Tuple[int, int]) -> Tuple[List[Tuple], RejectSink]:
+    """Парсит и агрегирует часть унаследованных при fork строк отчета (в дочернем процессе)"""
+    start, end = bounds
+    return _parse_chunk(_rows[start:end])
+
+
+def parse_report(
+    api,
+    report_data: Dict[str, Any],
+    processes: Optional[int] = None,
+    threshold: Optional[int] = None,
+    rejects: Optional[RejectSink] = None
+) -> List[ClickRecord]:
+    """
+    Парсит отчет; большие отчеты - в пуле процессов с предварительной агрегацией
+
+    Args:
+        api: Экземпляр AffilkaAPI (для обычного парсинга небольших отчетов)
+        report_data: Данные отчета от API
+        processes: Количество процессов (по умолчанию AFFILKA_PARSE_PROCESSES, 0/1 - без пула)
+        threshold: Минимальное количество строк для параллельного парсинга
+            (по умолчанию AFFILKA_PARSE_PARALLEL_THRESHOLD)
+        rejects: Учет пропущенных строк (по умолчанию итог пишется в лог после парсинга)
+
+    Returns:
+        Записи ClickRecord: строки отчета или, при параллельном парсинге, группы (period_date, clickid)
+    """
+    processes = AFFILKA_PARSE_PROCESSES if processes is None else processes
+    threshold = AFFILKA_PARSE_PARALLEL_THRESHOLD if threshold is None else threshold
+    rows = ((report_data or {}).get('rows') or {}).get('data') or []
+
+    # debug-поля теряются при агрегации, поэтому при их сохранении парсим как обычно
+    if processes <= 1 or len(rows) < threshold or AFFILKA_KEEP_DEBUG_FIELDS:
+        return api.parse_report_data(report_data, rejects=rejects)
+
+    parts = processes * CHUNKS_PER_PROCESS
+    size = -(-len(rows) // parts)
+    bounds = [(i, min(i + size, len(rows))) for i in range(0, len(rows), size)]
+    global _rows
+    logger.info(f"Параллельный парсинг: {len(rows)} строк, {len(bounds)} частей, процессов: {processes}")
+
+    with _parse_lock:
+        # Пулы создаются только под блокировкой, поэтому прирост RUSAGE_CHILDREN - CPU этого пула
+        children_started = children_cpu_seconds()
+        try:
+            context = _pool_context()
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+                # map сохраняет порядок частей, поэтому результат объединения детерминирован
+                if context.get_start_method() == 'fork':
+                    _rows = rows
+                    partials = list(executor.map(_parse_range, bounds))
+                else:
+                    partials = list(executor.map(_parse_chunk, [rows[start:end] for start, end in bounds]))
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f"Не удалось распарсить отчет в пуле процессов ({e}), парсим в текущем процессе")
+            return api.parse_report_data(report_data, rejects=rejects)
+        finally:
+            _rows = None
+            add_children_cpu(children_cpu_seconds() - children_started)
+
+    owns_rejects = rejects is None
+    if owns_rejects:
+        rejects = RejectSink('parse')
+    for _part, part_rejects in partials:
+        rejects.merge(part_rejects)
+    merged = merge_records([ClickRecord(*values) for values in part] for part, _part_rejects in partials)
+    logger.info(f"Распарсено {len(rows)} строк отчета в {len(merged)} групп (period_date, clickid)")
+    if owns_rejects:
+        rejects.summary()
+    return merged
+
+
+def iter_report_chunks(
+    api,
+    report_data: Dict[str, Any],
+    rejects: Optional[RejectSink] = None,
+    chunk_rows: Optional[int] = None
+) -> Iterator[List[ClickRecord]]:
+    """
+    Парсит отчет частями, освобождая разобранные строки rows.data
+
+    Строки ответа заменяются на None по мере парсинга, поэтому после обхода
+    report_data больше не содержит данных. Большие отчеты (см. parse_report)
+    парсятся в пуле процессов и отдаются одной частью уже сгруппированных записей.
+
+    Args:
+        api: Экземпляр AffilkaAPI
+        report_data: Данные отчета от API
+        rejects: Учет пропущенных строк
+        chunk_rows: Строк ответа в части (по умолчанию PARSE_CHUNK_ROWS)
+
+    Yields:
+        Списки записей ClickRecord
+    """
+    rows = ((report_data or {}).get('rows') or {}).get('data') or []
+    if not rows:
+        logger.warning("Отчет не содержит данных в rows.data")
+        return
+
+    if AFFILKA_PARSE_PROCESSES > 1 and len(rows) >= AFFILKA_PARSE_PARALLEL_THRESHOLD and not AFFILKA_KEEP_DEBUG_FIELDS:
+        groups = parse_report(api, report_data, rejects=rejects)
+        rows.clear()
+        yield groups
+        return
+
+    chunk_rows = chunk_rows or PARSE_CHUNK_ROWS
+    for start in range(0, len(rows), chunk_rows):
+        end = min(start + chunk_rows, len(rows))
+        chunk = rows[start:end]
+        rows[start:end] = [None] * (end - start)
+        records = parse_report_rows(chunk, AFFILKA_KEEP_DEBUG_FIELDS, rejects)
+        del chunk
+        yield records
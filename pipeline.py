@@ -0,0 +1,328 @@
+"""
+Конвейерный (producer/consumer) режим ETL
+
+Стадии extract+parse, transform и load выполняются параллельно и связаны
+ограниченными очередями:
+
+    fetchers (N потоков) -> parsed_queue -> transform (1 поток) -> load_queue -> loaders (M потоков)
+
+Fetchers парсят ответ частями сразу в SpillingAggregator (группы окна с лимитом
+памяти и сбросом на диск), transform сливает группы окна и делит их на пачки
+по ETL_LOAD_BATCH_SIZE для загрузчиков.
+
+Когда загрузчики не успевают, очереди заполняются и fetchers блокируются
+(backpressure), поэтому в памяти одновременно находится не больше
+queue_size окон и queue_size пачек. Пока идет загрузка одного окна,
+уже запрашиваются следующие, и общее время стремится к max(fetch, load).
+
+Период разбивается на окна, не пересекающиеся по ключу (period_date, clickid):
+при группировке по месяцу - по календарным месяцам, по дню - по N дней.
+Поэтому upsert каждого окна независим и не перезаписывает данные других окон.
+
+Пачки одного окна загружаются разными загрузчиками в отдельных транзакциях:
+при ошибке часть окна может остаться загруженной. Такой аккаунт попадает
+в failed_accounts (запуск завершается с ошибкой, последний запуск аккаунта
+записывается неуспешным), и окно загружается заново следующим запуском -
+upsert по ключу идемпотентен.
+"""
+import queue
+import threading
+import logging
+from datetime import datetime, timedelta, date
+from typing import Dict, List, Tuple, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
+from database import Database, create_connection_pool
+from parallel_parse import iter_report_chunks
+from external_agg import SpillingAggregator
+from reject_sink import RejectSink
+from run_metrics import RunMetrics
+from config import (
+    ETL_PIPELINE_FETCHERS, ETL_PIPELINE_LOADERS,
+    ETL_PIPELINE_QUEUE_SIZE, ETL_PIPELINE_WINDOW_DAYS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Маркер завершения очереди
+_DONE = object()
+
+
+def split_date_range(
+    from_date: str,
+    to_date: str,
+    group_by: Optional[List[str]] = None,
+    window_days: Optional[int] = None
+) -> List[Tuple[str, str]]:
+    """
+    Разбивает период на окна, которые можно загружать независимо
+
+    Args:
+        from_date: Начальная дата (YYYY-MM-DD)
+        to_date: Конечная дата (YYYY-MM-DD)
+        group_by: Группировка отчета (определяет допустимые границы окон)
+        window_days: Размер окна в днях при группировке по дню
+
+    Returns:
+        Список пар (from_date, to_date)
+    """
+    start = datetime.strptime(from_date, '%Y-%m-%d').date()
+    end = datetime.strptime(to_date, '%Y-%m-%d').date()
+    group_by = group_by or []
+    windows = []
+
+    if 'month' in group_by:
+        # Окно не должно пересекать границу месяца, иначе частичный месяц перезапишет полный
+        current = start
+        while current <= end:
+            next_month = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+            window_end = min(end, next_month - timedelta(days=1))
+            windows.append((current.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+            current = next_month
+    elif 'day' in group_by:
+        step = max(1, window_days or ETL_PIPELINE_WINDOW_DAYS)
+        current = start
+        while current <= end:
+            window_end = min(end, current + timedelta(days=step - 1))
+            windows.append((current.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+            current = window_end + timedelta(days=1)
+    else:
+        # Для остальных группировок безопасно разбить период нельзя
+        windows.append((from_date, to_date))
+
+    return windows
+
+
+class PipelineJob:
+    """Единица работы конвейера: один аккаунт и одно окно дат"""
+
+    def __init__(self, etl, from_date: str, to_date: str, columns: Optional[List[str]], group_by: Optional[List[str]]):
+        self.etl = etl
+        self.from_date = from_date
+        self.to_date = to_date
+        self.columns = columns
+        self.group_by = group_by
+
+    def __repr__(self):
+        return f"{self.etl.account_id} {self.from_date} - {self.to_date}"
+
+
+class ETLPipeline:
+    """Конвейер extract -> transform -> load с ограниченными очередями"""
+
+    def __init__(
+        self,
+        fetch_workers: Optional[int] = None,
+        load_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        pool=None,
+        deadline: Optional[datetime] = None,
+        metrics: Optional[RunMetrics] = None,
+        expected_durations: Optional[Dict[str, float]] = None
+    ):
+        """
+        Args:
+            fetch_workers: Количество потоков для запросов к API
+            load_workers: Количество потоков загрузки в БД
+            queue_size: Размер каждой очереди между стадиями
+            pool: Пул соединений с БД (по умолчанию создается на load_workers соединений)
+            deadline: Время, после которого новые окна не запрашиваются
+            metrics: Метрики запуска (замеры стадий по каждому окну)
+            expected_durations: Ожидаемая длительность аккаунта в секундах (expected_account_duration):
+                аккаунт начинается, только если она укладывается в оставшееся до deadline время
+        """
+        self.fetch_workers = fetch_workers or ETL_PIPELINE_FETCHERS
+        self.load_workers = load_workers or ETL_PIPELINE_LOADERS
+        self.queue_size = queue_size or ETL_PIPELINE_QUEUE_SIZE
+        self.pool = pool
+        self.deadline = deadline
+        self.metrics = metrics or RunMetrics('pipeline')
+        self.parsed_queue = queue.Queue(maxsize=self.queue_size)
+        self.load_queue = queue.Queue(maxsize=self.queue_size)
+        self._lock = threading.Lock()
+        self.stats = {'fetched': 0, 'loaded': 0, 'rows_loaded': 0, 'failed': 0, 'skipped': 0}
+        self.failed_accounts = set()
+        self.skipped_accounts = set()
+        # Аккаунты, по которым загружена хотя бы одна пачка (для пересчета агрегатов)
+        self.loaded_accounts = set()
+        self.expected_durations = expected_durations or {}
+        self._started_accounts = set()
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _fail(self, job: PipelineJob):
+        with self._lock:
+            self.stats['failed'] += 1
+            self.failed_accounts.add(job.etl.account_id)
+
+    def _out_of_time(self, job: PipelineJob) -> bool:
+        """
+        Проверяет ограничение по времени перед запросом окна
+
+        Первое окно аккаунта запускается, только если ожидаемая длительность аккаунта
+        укладывается в оставшееся время; следующие окна начатого аккаунта - до deadline.
+        """
+        if not self.deadline:
+            return False
+        account_id = job.etl.account_id
+        remaining = (self.deadline - datetime.now()).total_seconds()
+        with self._lock:
+            started = account_id in self._started_accounts
+            expected = 0.0 if started else self.expected_durations.get(account_id, 0.0)
+            if remaining > 0 and expected <= remaining:
+                self._started_accounts.add(account_id)
+                return False
+            self.stats['skipped'] += 1
+            self.skipped_accounts.add(account_id)
+        if started or remaining <= 0:
+            logger.warning(f"[{job}] Пропущено: достигнуто ограничение по времени")
+        else:
+            logger.warning(
+                f"[{job}] Пропущено: ожидаемая длительность аккаунта {expected:.0f} сек "
+                f"не укладывается в оставшееся время {remaining:.0f} сек"
+            )
+        return True
+
+    def _fetch(self, job: PipelineJob):
+        """Стадия 1: запрос к API и парсинг (выполняется в пуле fetchers)"""
+        if self._out_of_time(job):
+            return
+        account_id = job.etl.account_id
+        try:
+            with self.metrics.stage('extract', account_id) as stage:
+                session = job.etl.api.session
+                received = getattr(session, 'bytes_received', 0)
+                report_data = job.etl.extract(job.from_date, job.to_date, job.columns, job.group_by)
+                stage.bytes = getattr(session, 'bytes_received', 0) - received
+                stage.rows_out = len(((report_data or {}).get('rows') or {}).get('data') or [])
+            if not report_data:
+                logger.error(f"[{job}] Не удалось получить данные из API")
+                self._fail(job)
+                return
+            # Ответ парсится частями сразу в агрегатор: весь ответ и все записи вместе в памяти не держатся
+            aggregator = SpillingAggregator(rejects=RejectSink('transform', account_id))
+            try:
+                with self.metrics.stage('parse', account_id) as stage:
+                    stage.rows_in = len((report_data.get('rows') or {}).get('data') or [])
+                    rejects = RejectSink('parse', account_id)
+                    for records in iter_report_chunks(job.etl.api, report_data, rejects=rejects):
+                        aggregator.add(records)
+                        del records
+                    rejects.summary()
+                    stage.rows_out = aggregator.groups_in_memory
+                # Освобождаем ответ API до того, как группы будут ждать в очереди
+                del report_data
+                self._count('fetched')
+                if aggregator.rows_in:
+                    # Блокируется, если transform/load не успевают (backpressure)
+                    self.parsed_queue.put((job, aggregator))
+                    aggregator = None
+                else:
+                    logger.warning(f"[{job}] Нет данных для обработки после парсинга")
+            finally:
+                # Переданный в очередь агрегатор закрывает transform
+                if aggregator is not None:
+                    aggregator.close()
+        except Exception as e:
+            logger.error(f"[{job}] Ошибка на стадии извлечения: {e}", exc_info=True)
+            self._fail(job)
+
+    def _transform_worker(self):
+        """Стадия 2: слияние групп окна и разбиение на пачки загрузки (один поток, сохраняет порядок окон)"""
+        while True:
+            item = self.parsed_queue.get()
+            if item is _DONE:
+                break
+            job, aggregator = item
+            try:
+                # Группы, сброшенные на диск, сливаются потоково по мере загрузки пачек
+                with aggregator:
+                    for batch in aggregator.iter_batches():
+                        self.load_queue.put((job, batch))
+            except Exception as e:
+                logger.error(f"[{job}] Ошибка на стадии трансформации: {e}", exc_info=True)
+                self._fail(job)
+        for _ in range(self.load_workers):
+            self.load_queue.put(_DONE)
+
+    def _load_worker(self):
+        """Стадия 3: загрузка в БД (каждый поток со своим соединением из пула)"""
+        db = Database(self.pool)
+        while True:
+            item = self.load_queue.get()
+            if item is _DONE:
+                break
+            job, data = item
+            try:
+                with self.metrics.stage('load', job.etl.account_id) as stage, db:
+                    stage.rows_in = len(data)
+                    stage.db_rows = db.upsert_fact_click_month(data, account_id=job.etl.account_id) or 0
+                    stage.rows_out = len(data)
+                self._count('loaded')
+                self._count('rows_loaded', len(data))
+                with self._lock:
+                    self.loaded_accounts.add(job.etl.account_id)
+                logger.info(f"[{job}] Загружено {len(data)} записей")
+            except Exception as e:
+                logger.error(f"[{job}] Ошибка на стадии загрузки: {e}", exc_info=True)
+                self._fail(job)
+
+    def run(self, jobs: List[PipelineJob]) -> dict:
+        """
+        Выполняет все задания через конвейер
+
+        Returns:
+            Статистика: fetched, loaded, rows_loaded, failed, skipped
+        """
+        if not jobs:
+            return self.stats
+
+        if self.pool is None:
+            self.pool = create_connection_pool(self.load_workers)
+
+        logger.info(
+            f"Конвейер: {len(jobs)} окон, fetchers={self.fetch_workers}, "
+            f"loaders={self.load_workers}, queue_size={self.queue_size}"
+        )
+
+        transformer = threading.Thread(target=self._transform_worker, name='etl-transform', daemon=True)
+        loaders = [
+            threading.Thread(target=self._load_worker, name=f'etl-load-{i}', daemon=True)
+            for i in range(self.load_workers)
+        ]
+        transformer.start()
+        for loader in loaders:
+            loader.start()
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='etl-fetch') as executor:
+            list(executor.map(self._fetch, jobs))
+
+        self.parsed_queue.put(_DONE)
+        transformer.join()
+        for loader in loaders:
+            loader.join()
+
+        logger.info(
+            f"Конвейер завершен: получено {self.stats['fetched']} окон, загружено {self.stats['loaded']} пачек "
+            f"({self.stats['rows_loaded']} записей), ошибок: {self.stats['failed']}, "
+            f"пропущено: {self.stats['skipped']}"
+        )
+        return self.stats
+
+
+def build_jobs(
+    etls: List[Any],
+    from_date: str,
+    to_date: str,
+    columns: Optional[List[str]] = None,
+    group_by: Optional[List[str]] = None
+) -> List[PipelineJob]:
+    """Создает задания конвейера для всех аккаунтов и всех окон периода"""
+    windows = split_date_range(from_date, to_date, group_by)
+    # Чередуем аккаунты, чтобы запросы к одному хосту не шли подряд
+    return [
+        PipelineJob(etl, window_from, window_to, columns, group_by)
+        for window_from, window_to in windows
+        for etl in etls
+    ]
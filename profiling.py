@@ -0,0 +1,218 @@
+"""
+Профилирование стадий ETL (main.py --profile)
+
+Профиль снимается отдельно для каждой стадии каждого аккаунта (RunMetrics.stage),
+чтобы профиль одного медленного аккаунта не растворялся среди остальных.
+Артефакты пишутся в <ETL_PROFILE_DIR>/<run_id>/<account>_<stage>_<N>.<ext>:
+
+- cprofile    - .pstats (python -m pstats, snakeviz) и .txt с топом функций по cumulative;
+- tracemalloc - .alloc.txt: топ мест выделения памяти, удерживаемой после стадии, и пик памяти стадии;
+- sampling    - .collapsed: сэмплы стека потока стадии в формате collapsed stacks
+                (flamegraph.pl, speedscope, inferno) и .txt с самыми частыми функциями.
+
+Ограничения: части отчета, которые парсятся в дочерних процессах (AFFILKA_PARSE_PROCESSES),
+не профилируются; tracemalloc считает выделения всего процесса, поэтому в конвейерном
+режиме в профиль стадии попадают и параллельные стадии других потоков.
+"""
+import os
+import re
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Optional
+from config import ETL_PROFILE, ETL_PROFILE_DIR, ETL_PROFILE_INTERVAL_MS, ETL_PROFILE_TOP
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('cprofile', 'tracemalloc', 'sampling')
+
+# Кадров стека в tracemalloc: места выделения группируются по строке кода,
+# более глубокий стек многократно замедляет трассировку на отчетах в миллионы строк
+TRACEMALLOC_FRAMES = 1
+
+_profiler: Optional['StageProfiler'] = None
+
+
+class StageProfiler:
+    """Профилировщик стадий: один режим на процесс, артефакты по (аккаунт, стадия)"""
+
+    def __init__(self, mode: str, directory: Optional[str] = None, run_id: Optional[str] = None):
+        """
+        Args:
+            mode: cprofile, tracemalloc или sampling
+            directory: Каталог артефактов (по умолчанию ETL_PROFILE_DIR)
+            run_id: Подкаталог запуска (по умолчанию время старта и pid)
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode} (доступны: {', '.join(PROFILE_MODES)})")
+        self.mode = mode
+        run_id = run_id or f"{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+        self.directory = os.path.join(directory or ETL_PROFILE_DIR, run_id)
+        self.interval = max(ETL_PROFILE_INTERVAL_MS, 1) / 1000
+        self.top = ETL_PROFILE_TOP
+        self._counter = Counter()
+        self._lock = threading.Lock()
+        # cProfile в Python 3.12+ не допускает два активных профилировщика одновременно
+        self._cprofile_busy = threading.Lock()
+        # Количество стадий, выполняющихся под tracemalloc (в конвейере - параллельно)
+        self._tracing = 0
+        os.makedirs(self.directory, exist_ok=True)
+        logger.info(f"Профилирование ({mode}): артефакты в {self.directory}")
+
+    def _path(self, stage: str, account_id: Optional[str], ext: str) -> str:
+        label = re.sub(r'[^\w.-]+', '_', f"{account_id or 'all'}_{stage}")
+        with self._lock:
+            self._counter[label] += 1
+            number = self._counter[label]
+        return os.path.join(self.directory, f"{label}_{number:03d}.{ext}")
+
+    @contextmanager
+    def profile(self, stage: str, account_id: Optional[str] = None) -> Iterator[None]:
+        """Профилирует блок кода как стадию stage аккаунта account_id"""
+        if self.mode == 'cprofile':
+            with self._cprofile(stage, account_id):
+                yield
+        elif self.mode == 'tracemalloc':
+            with self._tracemalloc(stage, account_id):
+                yield
+        else:
+            with self._sampling(stage, account_id):
+                yield
+
+    @contextmanager
+    def _cprofile(self, stage: str, account_id: Optional[str]):
+        if not self._cprofile_busy.acquire(blocking=False):
+            logger.debug(f"cProfile уже активен в другом потоке, стадия {stage} ({account_id}) не профилируется")
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            try:
+                profiler.enable()
+            except ValueError as e:
+                logger.warning(f"Не удалось включить cProfile для стадии {stage}: {e}")
+                yield
+                return
+            try:
+                yield
+            finally:
+                profiler.disable()
+                path = self._path(stage, account_id, 'pstats')
+                profiler.dump_stats(path)
+                with open(path[:-len('pstats')] + 'txt', 'w', encoding='utf-8') as f:
+                    stats = pstats.Stats(profiler, stream=f)
+                    stats.sort_stats('cumulative').print_stats(self.top)
+                logger.info(f"Профиль стадии {stage} ({account_id or 'все аккаунты'}): {path}")
+        finally:
+            self._cprofile_busy.release()
+
+    @contextmanager
+    def _tracemalloc(self, stage: str, account_id: Optional[str]):
+        # Трассировка включается только на время стадий: снимок содержит лишь выделения стадии,
+        # а не весь ответ API, поэтому он маленький и быстро группируется
+        with self._lock:
+            if self._tracing == 0:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._tracing += 1
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            with self._lock:
+                self._tracing -= 1
+                if self._tracing == 0:
+                    tracemalloc.stop()
+            skip = (tracemalloc.__file__, __file__)
+            stats = [stat for stat in snapshot.statistics('lineno') if stat.traceback[0].filename not in skip]
+            path = self._path(stage, account_id, 'alloc.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"Стадия {stage}, аккаунт {account_id or '-'}\n")
+                f.write(f"Выделено за стадию и удерживается в конце: {current / 1024 / 1024:.1f} MB, "
+                        f"пик за стадию: {peak / 1024 / 1024:.1f} MB\n\n")
+                f.write(f"Топ {self.top} мест выделения (удерживаемая память):\n\n")
+                for index, stat in enumerate(stats[:self.top], 1):
+                    frame = stat.traceback[0]
+                    f.write(f"#{index:<3} {stat.size / 1024:>12.1f} KB  блоков {stat.count:>9d}  "
+                            f"{frame.filename}:{frame.lineno}\n")
+            logger.info(f"Профиль памяти стадии {stage} ({account_id or 'все аккаунты'}): {path}")
+
+    @contextmanager
+    def _sampling(self, stage: str, account_id: Optional[str]):
+        target = threading.get_ident()
+        stacks = Counter()
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(target)
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if names:
+                    stacks[';'.join(reversed(names))] += 1
+
+        sampler = threading.Thread(target=sample, name=f'profile-{stage}', daemon=True)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            elapsed = time.perf_counter() - started
+            path = self._path(stage, account_id, 'collapsed')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            # Функции, которые чаще всего оказываются на вершине стека (self time)
+            leaves = Counter()
+            for stack, count in stacks.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            total = sum(stacks.values())
+            with open(path[:-len('collapsed')] + 'txt', 'w', encoding='utf-8') as f:
+                f.write(f"Стадия {stage}, аккаунт {account_id or '-'}: {elapsed:.2f} сек, "
+                        f"сэмплов {total}, интервал {self.interval * 1000:.0f} мс\n\n")
+                for name, count in leaves.most_common(self.top):
+                    f.write(f"{count / max(total, 1) * 100:6.1f}%  {count:>7}  {name}\n")
+            logger.info(f"Сэмплы стадии {stage} ({account_id or 'все аккаунты'}): {path}")
+
+
+def enable(mode: str, directory: Optional[str] = None, run_id: Optional[str] = None) -> StageProfiler:
+    """Включает профилирование стадий для текущего процесса"""
+    global _profiler
+    _profiler = StageProfiler(mode, directory, run_id)
+    return _profiler
+
+
+def enable_from_config() -> Optional[StageProfiler]:
+    """Включает профилирование, если задан ETL_PROFILE"""
+    if ETL_PROFILE and _profiler is None:
+        return enable(ETL_PROFILE)
+    return _profiler
+
+
+def get_profiler() -> Optional[StageProfiler]:
+    """Активный профилировщик (None - профилирование выключено)"""
+    return _profiler
+
+
+@contextmanager
+def profile_stage(stage: str, account_id: Optional[str] = None) -> Iterator[None]:
+    """Профилирует стадию, если профилирование включено; иначе ничего не делает"""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.profile(stage, account_id):
+        yield
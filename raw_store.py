@@ -0,0 +1,372 @@
+"""
+Локальное хранилище сырых ответов Affilka API (landing zone)
+
+Каждый ответ отчета сохраняется как сжатый NDJSON:
+    <RAW_STORE_DIR>/<account_id>/<from>_<to>/<group_by>/<params_hash>.ndjson.gz (или .zst)
+
+Первая строка файла - заголовок (метаданные запроса и все поля ответа,
+кроме rows.data), далее по одной строке на каждую строку rows.data.
+Если установлен пакет zstandard, используется zstd, иначе gzip.
+
+ETL по умолчанию всегда запрашивает API и только архивирует ответ
+(RAW_STORE_MAX_AGE_MINUTES=0). Сохраненные ответы читают replay, диагностические
+скрипты (не старше RAW_STORE_REUSE_MINUTES) и ETL, если повторное использование
+включено явно (например, для повторного запуска после ошибки загрузки).
+Для кеширования свежих ответов предназначен http_cache.py.
+
+Ключ файла включает хеш URL API: порядок аккаунтов (account_N) задается
+переменными окружения, и после его изменения ответ одного аккаунта не должен
+достаться другому.
+"""
+import os
+import io
+import gzip
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator
+from affilka_api import json_loads
+from config import RAW_STORE_DIR, RAW_STORE_ENABLED, RAW_STORE_RETENTION_DAYS, RAW_STORE_MAX_AGE_MINUTES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def params_hash(
+    columns: Optional[List[str]] = None,
+    conversion_currency: Optional[str] = None,
+    exchange_rates_date: Optional[str] = None,
+    base_url: Optional[str] = None
+) -> str:
+    """Короткий хеш URL API и параметров запроса, которые влияют на содержимое ответа (кроме периода и group_by)"""
+    key = json.dumps({
+        'base_url': base_url,
+        'columns': list(columns or []),
+        'conversion_currency': conversion_currency,
+        'exchange_rates_date': exchange_rates_date,
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def group_by_key(group_by: Optional[List[str]]) -> str:
+    """Имя каталога для group_by"""
+    return '+'.join(group_by) if group_by else 'none'
+
+
+class RawStore:
+    """Хранилище сырых ответов API, партиционированное по аккаунту, периоду и group_by"""
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        compression: Optional[str] = None,
+        retention_days: Optional[int] = None
+    ):
+        """
+        Args:
+            root: Корневой каталог (по умолчанию RAW_STORE_DIR)
+            compression: 'zstd' или 'gzip' (по умолчанию zstd, если установлен zstandard)
+            retention_days: Сколько дней хранить файлы (по умолчанию RAW_STORE_RETENTION_DAYS, 0 - бессрочно)
+        """
+        self.root = root or RAW_STORE_DIR
+        if compression is None:
+            compression = 'zstd' if zstandard is not None else 'gzip'
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, используем gzip")
+            compression = 'gzip'
+        self.compression = compression
+        self.retention_days = RAW_STORE_RETENTION_DAYS if retention_days is None else retention_days
+
+    @property
+    def extension(self) -> str:
+        return '.ndjson.zst' if self.compression == 'zstd' else '.ndjson.gz'
+
+    def partition_dir(self, account_id: str, from_date: str, to_date: str, group_by: Optional[List[str]]) -> str:
+        """Каталог партиции для аккаунта, периода и group_by"""
+        return os.path.join(self.root, account_id, f"{from_date}_{to_date}", group_by_key(group_by))
+
+    def _open_write(self, path: str):
+        if path.endswith('.zst'):
+            raw = open(path, 'wb')
+            return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(raw), encoding='utf-8')
+        return gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+
+    @staticmethod
+    def _open_read(path: str):
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"Для чтения {path} нужен пакет zstandard")
+            raw = open(path, 'rb')
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding='utf-8')
+        return gzip.open(path, 'rt', encoding='utf-8')
+
+    def save(
+        self,
+        account_id: str,
+        from_date: str,
+        to_date: str,
+        group_by: Optional[List[str]],
+        report_data: Dict[str, Any],
+        columns: Optional[List[str]] = None,
+        conversion_currency: Optional[str] = None,
+        exchange_rates_date: Optional[str] = None,
+        base_url: Optional[str] = None
+    ) -> str:
+        """
+        Сохраняет ответ API в хранилище (атомарно, с заменой предыдущей версии партиции)
+
+        Returns:
+            Путь к сохраненному файлу
+        """
+        directory = self.partition_dir(account_id, from_date, to_date, group_by)
+        os.makedirs(directory, exist_ok=True)
+        name = params_hash(columns, conversion_currency, exchange_rates_date, base_url)
+        path = os.path.join(directory, name + self.extension)
+
+        rows = report_data.get('rows') or {}
+        data = (rows.get('data') or []) if isinstance(rows, dict) else []
+        header = {
+            'format_version': FORMAT_VERSION,
+            'meta': {
+                'account_id': account_id,
+                'base_url': base_url,
+                'from_date': from_date,
+                'to_date': to_date,
+                'group_by': list(group_by or []),
+                'columns': list(columns or []),
+                'conversion_currency': conversion_currency,
+                'exchange_rates_date': exchange_rates_date,
+                'fetched_at': datetime.now().isoformat(timespec='seconds'),
+                'row_count': len(data),
+            },
+            'report': {key: value for key, value in report_data.items() if key != 'rows'},
+            'rows': {key: value for key, value in rows.items() if key != 'data'} if isinstance(rows, dict) else None,
+        }
+
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with self._open_write(tmp_path) as f:
+            f.write(json.dumps(header, ensure_ascii=False, default=str))
+            f.write('\n')
+            for row in data:
+                f.write(json.dumps(row, ensure_ascii=False, default=str))
+                f.write('\n')
+        os.replace(tmp_path, path)
+        logger.info(f"Ответ API сохранен в хранилище: {path} ({len(data)} строк)")
+        return path
+
+    def read_header(self, path: str) -> Dict[str, Any]:
+        """Читает только заголовок файла (метаданные)"""
+        with self._open_read(path) as f:
+            return json_loads(f.readline())
+
+    def iter_rows(self, path: str) -> Iterator[list]:
+        """Потоково читает строки rows.data из файла"""
+        with self._open_read(path) as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    yield json_loads(line)
+
+    def load(self, path: str) -> Dict[str, Any]:
+        """Восстанавливает ответ API (в формате fetch_report) из файла"""
+        with self._open_read(path) as f:
+            header = json_loads(f.readline())
+            data = [json_loads(line) for line in f if line.strip()]
+        report = dict(header.get('report') or {})
+        rows = dict(header.get('rows') or {})
+        rows['data'] = data
+        report['rows'] = rows
+        return report
+
+    def find(
+        self,
+        account_id: str,
+        from_date: str,
+        to_date: str,
+        group_by: Optional[List[str]],
+        columns: Optional[List[str]] = None,
+        conversion_currency: Optional[str] = None,
+        exchange_rates_date: Optional[str] = None,
+        max_age_minutes: Optional[float] = None,
+        base_url: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Ищет сохраненный ответ для тех же URL API и параметров запроса
+
+        Args:
+            max_age_minutes: Максимальный возраст файла в минутах (None - любой)
+            base_url: URL API аккаунта
+
+        Returns:
+            Путь к файлу или None
+        """
+        directory = self.partition_dir(account_id, from_date, to_date, group_by)
+        name = params_hash(columns, conversion_currency, exchange_rates_date, base_url)
+        for extension in ('.ndjson.zst', '.ndjson.gz'):
+            path = os.path.join(directory, name + extension)
+            if not os.path.exists(path):
+                continue
+            if extension == '.ndjson.zst' and zstandard is None:
+                continue
+            age_minutes = (time.time() - os.path.getmtime(path)) / 60
+            if max_age_minutes is not None and age_minutes > max_age_minutes:
+                continue
+            return path
+        return None
+
+    def list_partitions(
+        self,
+        account_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        group_by: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Возвращает сохраненные файлы, период которых пересекается с [from_date, to_date]
+
+        Returns:
+            Список словарей: path, account_id, from_date, to_date, group_by, mtime
+        """
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        wanted_group = group_by_key(group_by) if group_by else None
+        for account in sorted(os.listdir(self.root)):
+            if account_id and account != account_id:
+                continue
+            account_dir = os.path.join(self.root, account)
+            if not os.path.isdir(account_dir):
+                continue
+            for period in sorted(os.listdir(account_dir)):
+                if '_' not in period:
+                    continue
+                period_from, period_to = period.split('_', 1)
+                if (to_date and period_from > to_date) or (from_date and period_to < from_date):
+                    continue
+                period_dir = os.path.join(account_dir, period)
+                for group in sorted(os.listdir(period_dir)):
+                    if wanted_group and group != wanted_group:
+                        continue
+                    group_dir = os.path.join(period_dir, group)
+                    for name in sorted(os.listdir(group_dir)):
+                        if not name.endswith(('.ndjson.gz', '.ndjson.zst')):
+                            continue
+                        path = os.path.join(group_dir, name)
+                        result.append({
+                            'path': path,
+                            'account_id': account,
+                            'from_date': period_from,
+                            'to_date': period_to,
+                            'group_by': group,
+                            'mtime': os.path.getmtime(path),
+                        })
+        return result
+
+    def purge(self, retention_days: Optional[int] = None) -> int:
+        """
+        Удаляет файлы старше срока хранения
+
+        Обходит все хранилище, поэтому вызывается один раз за запуск после загрузки
+        (purge_raw_store), а не при каждом сохранении.
+
+        Returns:
+            Количество удаленных файлов
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+        if not retention_days or not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - retention_days * 86400
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            if dirpath != self.root and not os.listdir(dirpath):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    # В каталог уже сохраняют новый ответ
+                    pass
+        if removed:
+            logger.info(f"Удалено {removed} файлов из хранилища сырых ответов (старше {retention_days} дн.)")
+        return removed
+
+    def fetch(
+        self,
+        api,
+        account_id: str,
+        from_date: str,
+        to_date: str,
+        columns: Optional[List[str]] = None,
+        group_by: Optional[List[str]] = None,
+        conversion_currency: Optional[str] = None,
+        exchange_rates_date: Optional[str] = None,
+        max_age_minutes: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Запрашивает API и сохраняет ответ; сохраненный ответ используется вместо запроса,
+        только если явно разрешен его возраст (max_age_minutes > 0)
+
+        Args:
+            api: Экземпляр AffilkaAPI
+            account_id: Идентификатор аккаунта (партиция хранилища)
+            max_age_minutes: Максимальный возраст сохраненного ответа (по умолчанию RAW_STORE_MAX_AGE_MINUTES,
+                0 - всегда запрашивать API)
+
+        Returns:
+            Данные отчета в формате fetch_report или None
+        """
+        if max_age_minutes is None:
+            max_age_minutes = RAW_STORE_MAX_AGE_MINUTES
+        base_url = getattr(api, 'base_url', None)
+        if max_age_minutes > 0:
+            path = self.find(
+                account_id, from_date, to_date, group_by, columns,
+                conversion_currency, exchange_rates_date, max_age_minutes, base_url
+            )
+            if path:
+                logger.info(f"Используем сохраненный ответ API из хранилища: {path}")
+                return self.load(path)
+
+        report_data = api.fetch_report(
+            from_date, to_date, columns, group_by,
+            conversion_currency=conversion_currency,
+            exchange_rates_date=exchange_rates_date
+        )
+        if report_data:
+            try:
+                self.save(
+                    account_id, from_date, to_date, group_by, report_data,
+                    columns, conversion_currency, exchange_rates_date,
+                    base_url=base_url
+                )
+            except OSError as e:
+                # Хранилище не должно ломать ETL (например, при нехватке места на диске)
+                logger.warning(f"Не удалось сохранить ответ API в хранилище: {e}")
+        return report_data
+
+
+def get_raw_store() -> Optional[RawStore]:
+    """Возвращает хранилище сырых ответов или None, если оно отключено (RAW_STORE_ENABLED)"""
+    return RawStore() if RAW_STORE_ENABLED else None
+
+
+def purge_raw_store():
+    """Удаляет файлы старше RAW_STORE_RETENTION_DAYS (один раз за запуск ETL, после загрузки)"""
+    store = get_raw_store()
+    if store is None:
+        return
+    try:
+        store.purge()
+    except OSError as e:
+        logger.warning(f"Не удалось очистить хранилище сырых ответов: {e}")
@@ -0,0 +1,396 @@
+"""
+Сверка fact_click_month с API по контрольным суммам (main.py analytics reconcile)
+
+Проверяются все аккаунты (или --account) и каждый месяц периода, по шагам:
+
+    1. Итоги: отчет API только с группировкой по дате (первое поле группировки ETL,
+       по умолчанию month - одна строка на месяц) и SUM / COUNT по period_date в БД.
+       Даты, итоги которых совпали, дальше не проверяются.
+    2. Бакеты: для дат с расхождением отчет API с clickid (для группировки по дню - за
+       эту дату, по месяцу - за месяц) агрегируется так же, как в ETL, и сравнивается
+       с GROUP BY по первым символам clickid в БД.
+    3. Строки: для бакетов с расхождением из БД читаются только clickid этого бакета
+       и сравниваются с API по каждому clickid.
+
+Итоги API и БД законно расходятся: ETL не загружает строки без clickid, а FTD
+повторяющихся строк clickid объединяет. Эта разница сохраняется в reconcile_gap после
+успешной сверки даты и учитывается на шаге 1 следующих запусков: пока данные
+не менялись, месяц проверяется одним маленьким запросом к API и одним к БД.
+
+Использование:
+    python main.py analytics reconcile
+    python main.py analytics reconcile --from-date 2026-01-01 --to-date 2026-03-31 --account account_2
+    python main.py analytics reconcile --details --format csv -o mismatches.csv
+"""
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+from affilka_api import AffilkaAPI, parse_report_rows
+from analytics import METRICS, VERIFY_TOLERANCE, Period, Report, _month_end, _shift_month
+from config import DEFAULT_REPORT_COLUMNS, DEFAULT_REPORT_GROUP_BY, get_affilka_accounts
+from database import Database
+from records import aggregate_records
+from reject_sink import RejectSink
+
+logger = logging.getLogger(__name__)
+
+# Группировки по дате, для которых известен диапазон одного значения period_date
+GRAINS = ('day', 'month')
+
+# Бакет - первые символы нормализованного clickid
+BUCKET_CHARS = 2
+
+# Счетчики сравниваются точно, суммы - с допуском на округление каждой строки БД до копеек
+COUNT_METRICS = ('ftd', 'dep_cnt')
+ROUNDING = 0.005
+
+# Сколько расхождений по clickid показывать под таблицей (все - с --details)
+MAX_EXAMPLES = 10
+
+ISSUES = {'only_api': 'только в API', 'only_db': 'только в БД', 'metrics': 'метрики'}
+
+MONTH_COLUMNS = [
+    ('account_id', 'Аккаунт', 'text', 12, False),
+    ('month', 'Месяц', 'text', 8, False),
+    ('dates', 'Дат', 'int', 5, True),
+    ('drilled', 'Детал.', 'int', 7, True),
+    ('mismatched', 'Расх.', 'int', 6, True),
+    ('buckets', 'Бакетов', 'int', 8, True),
+    ('clickids', 'clickid', 'int', 8, True),
+    ('api_requests', 'API', 'int', 4, True),
+    ('diff_ftd', 'FTD БД-API', 'int', 11, False),
+    ('diff_dep_cnt', 'diff_dep_cnt', 'int', 0, False),
+    ('diff_dep_sum', 'Сумма БД-API', 'money', 14, False),
+    ('diff_ngr', 'diff_ngr', 'money', 0, False),
+    ('diff_cpa', 'diff_cpa', 'money', 0, False),
+    ('status', 'Статус', 'text', 12, False),
+]
+
+DETAIL_COLUMNS = [
+    ('account_id', 'Аккаунт', 'text', 12, False),
+    ('period_date', 'Дата', 'text', 10, False),
+    ('clickid', 'clickid', 'text', 24, False),
+    ('issue', 'Расхождение', 'text', 12, False),
+] + [(f"diff_{name}", f"{name} БД-API", 'int' if name in COUNT_METRICS else 'money', 13, True) for name in METRICS]
+
+
+def _key(value: Any) -> str:
+    """Ключ даты: YYYY-MM-DD (встроенные БД возвращают даты строками)"""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)[:10]
+
+
+def _bucket(clickid: str) -> str:
+    return clickid[:BUCKET_CHARS].lower()
+
+
+def _differs(api: List[float], db: List[float], groups: int = 0) -> bool:
+    """Есть ли расхождение метрик; groups - число строк БД в сумме (допуск на округление)"""
+    for index, name in enumerate(METRICS):
+        tolerance = 0.5 if name in COUNT_METRICS else VERIFY_TOLERANCE + ROUNDING * groups
+        if abs(api[index] - db[index]) >= tolerance:
+            return True
+    return False
+
+
+def _add(values: List[float], source: Any):
+    """Добавляет метрики ClickRecord или строки БД к values"""
+    for index, name in enumerate(METRICS):
+        values[index] += float(source[name] or 0)
+
+
+class AccountReconciler:
+    """Сверка одного аккаунта по месяцам"""
+
+    def __init__(
+        self,
+        db: Database,
+        db_columns: List[str],
+        account_id: str,
+        api: AffilkaAPI,
+        group_by: Optional[List[str]] = None
+    ):
+        """
+        Args:
+            db: Подключение к БД
+            db_columns: Колонки fact_click_month
+            account_id: Аккаунт (account_N)
+            api: Клиент API аккаунта
+            group_by: Группировка, с которой ETL загружает данные (по умолчанию DEFAULT_REPORT_GROUP_BY)
+        """
+        self.db = db
+        self.db_columns = db_columns
+        self.account_id = account_id
+        self.api = api
+        self.group_by = list(group_by or DEFAULT_REPORT_GROUP_BY)
+        self.grain = self.group_by[0]
+        if self.grain not in GRAINS:
+            raise ValueError(f"Сверка поддерживает группировку по {' / '.join(GRAINS)}, а не {self.grain}")
+        self.api_requests = 0
+        self.mismatches: List[Dict[str, Any]] = []
+        self.rejected = 0
+
+    def _fetch(self, from_date: date, to_date: date, group_by: List[str]) -> List[list]:
+        self.api_requests += 1
+        report = self.api.fetch_report(
+            from_date=str(from_date),
+            to_date=str(to_date),
+            columns=list(DEFAULT_REPORT_COLUMNS),
+            group_by=group_by,
+            conversion_currency='EUR'
+        )
+        if report is None:
+            raise RuntimeError(f"Не удалось получить отчет API {self.account_id} за {from_date} - {to_date}")
+        return (report.get('rows') or {}).get('data') or []
+
+    def _api_totals(self, from_date: date, to_date: date) -> Dict[str, List[float]]:
+        """Шаг 1, API: итоги по датам без группировки по clickid"""
+        totals: Dict[str, List[float]] = {}
+        rows = self._fetch(from_date, to_date, self.group_by[:1])
+        rejects = RejectSink('reconcile', self.account_id, directory='')
+        for record in parse_report_rows(rows, rejects=rejects, require_clickid=False):
+            _add(totals.setdefault(_key(record.period_date), [0.0] * len(METRICS)), record)
+        return totals
+
+    def _db_totals(self, from_date: date, to_date: date) -> Dict[str, List[float]]:
+        """Шаг 1, БД: суммы метрик по датам"""
+        where, params = Period(from_date, to_date, self.account_id).where(self.db_columns)
+        totals = {}
+        for row in self.db.stream(f"""
+            SELECT period_date, {', '.join(f'SUM({name}) AS {name}' for name in METRICS)}
+            FROM fact_click_month
+            WHERE {where}
+            GROUP BY period_date
+        """, params):
+            _add(totals.setdefault(_key(row['period_date']), [0.0] * len(METRICS)), row)
+        return totals
+
+    def _api_players(self, from_date: date, to_date: date, keys: List[str]) -> Dict[str, Dict[str, Dict[str, List[float]]]]:
+        """
+        Шаг 2, API: группы (дата, clickid) как в ETL
+
+        Returns:
+            дата -> бакет -> clickid -> метрики
+        """
+        rows = self._fetch(from_date, to_date, self.group_by)
+        rejects = RejectSink('reconcile', self.account_id, directory='')
+        players: Dict[str, Dict[str, Dict[str, List[float]]]] = {key: {} for key in keys}
+        for group in aggregate_records(parse_report_rows(rows, rejects=rejects), rejects):
+            buckets = players.get(_key(group.period_date))
+            if buckets is None:
+                continue
+            values = buckets.setdefault(_bucket(group.clickid), {}).setdefault(group.clickid, [0.0] * len(METRICS))
+            _add(values, group)
+        self.rejected += rejects.total
+        return players
+
+    def _db_buckets(self, key: str) -> Dict[str, Tuple[int, List[float]]]:
+        """Шаг 2, БД: количество строк и суммы метрик по бакетам clickid за дату"""
+        where, params = Period(date.fromisoformat(key), date.fromisoformat(key), self.account_id).where(self.db_columns)
+        bucket = f"LOWER(SUBSTR(clickid, 1, {BUCKET_CHARS}))"
+        buckets = {}
+        for row in self.db.stream(f"""
+            SELECT {bucket} AS bucket, COUNT(*) AS row_count, {', '.join(f'SUM({name}) AS {name}' for name in METRICS)}
+            FROM fact_click_month
+            WHERE {where}
+            GROUP BY {bucket}
+        """, params):
+            values = [0.0] * len(METRICS)
+            _add(values, row)
+            buckets[row['bucket'] or ''] = (int(row['row_count']), values)
+        return buckets
+
+    def _db_players(self, key: str, bucket: str) -> Dict[str, List[float]]:
+        """Шаг 3, БД: метрики clickid одного бакета за дату"""
+        where, params = Period(date.fromisoformat(key), date.fromisoformat(key), self.account_id).where(self.db_columns)
+        players: Dict[str, List[float]] = {}
+        for row in self.db.stream(f"""
+            SELECT clickid, {', '.join(METRICS)}
+            FROM fact_click_month
+            WHERE {where} AND LOWER(SUBSTR(clickid, 1, {BUCKET_CHARS})) = %s
+        """, params + [bucket]):
+            _add(players.setdefault(row['clickid'].lower(), [0.0] * len(METRICS)), row)
+        return players
+
+    def _compare_players(self, key: str, api: Dict[str, List[float]], db: Dict[str, List[float]]) -> int:
+        """Шаг 3: расхождения по clickid; возвращает их количество"""
+        zero = [0.0] * len(METRICS)
+        found = 0
+        for clickid in sorted(set(api) | set(db)):
+            api_values, db_values = api.get(clickid), db.get(clickid)
+            if api_values is None:
+                issue = 'only_db'
+            elif db_values is None:
+                issue = 'only_api'
+            elif _differs(api_values, db_values):
+                issue = 'metrics'
+            else:
+                continue
+            found += 1
+            api_values, db_values = api_values or zero, db_values or zero
+            item = {'account_id': self.account_id, 'period_date': key, 'clickid': clickid, 'issue': ISSUES[issue]}
+            for index, name in enumerate(METRICS):
+                item[f"diff_{name}"] = db_values[index] - api_values[index]
+            self.mismatches.append(item)
+        return found
+
+    def _drill_window(self, key: str, from_date: date, to_date: date) -> Tuple[date, date]:
+        """Диапазон запроса с clickid, в который попадает дата key"""
+        if self.grain == 'day':
+            day = date.fromisoformat(key)
+            return day, day
+        return from_date, to_date
+
+    def check_month(self, from_date: date, to_date: date) -> Dict[str, Any]:
+        """
+        Сверяет период внутри одного месяца
+
+        Returns:
+            Строка отчета по месяцу (см. MONTH_COLUMNS)
+        """
+        requests_before = self.api_requests
+        mismatches_before = len(self.mismatches)
+        api_totals = self._api_totals(from_date, to_date)
+        db_totals = self._db_totals(from_date, to_date)
+        gaps = self.db.get_reconcile_gaps(self.account_id, from_date, to_date)
+
+        zero = [0.0] * len(METRICS)
+        diff = [0.0] * len(METRICS)
+        suspicious = []
+        for key in sorted(set(api_totals) | set(db_totals)):
+            api_values = api_totals.get(key, zero)
+            db_values = db_totals.get(key, zero)
+            gap = gaps.get(key) or {}
+            expected = [api_values[index] - gap.get(name, 0.0) for index, name in enumerate(METRICS)]
+            for index in range(len(METRICS)):
+                diff[index] += db_values[index] - expected[index]
+            if _differs(expected, db_values):
+                suspicious.append(key)
+
+        # Шаг 2: отчет с clickid - по одному на окно (день или весь месяц)
+        windows: Dict[Tuple[date, date], List[str]] = {}
+        for key in suspicious:
+            windows.setdefault(self._drill_window(key, from_date, to_date), []).append(key)
+        mismatched = buckets_mismatched = clickids_mismatched = 0
+        for (window_from, window_to), keys in windows.items():
+            api_players = self._api_players(window_from, window_to, keys)
+            for key in keys:
+                api_buckets = api_players[key]
+                db_buckets = self._db_buckets(key)
+                bad_buckets = []
+                for bucket in sorted(set(api_buckets) | set(db_buckets)):
+                    players = api_buckets.get(bucket, {})
+                    api_values = [0.0] * len(METRICS)
+                    for values in players.values():
+                        for index in range(len(METRICS)):
+                            api_values[index] += values[index]
+                    db_count, db_values = db_buckets.get(bucket, (0, zero))
+                    if db_count != len(players) or _differs(api_values, db_values, max(db_count, len(players))):
+                        bad_buckets.append(bucket)
+                if not bad_buckets:
+                    # Итоги разошлись только на законную разницу: запоминаем ее для следующих запусков
+                    api_values = api_totals.get(key, zero)
+                    db_values = db_totals.get(key, zero)
+                    self.db.save_reconcile_gap(self.account_id, date.fromisoformat(key), {
+                        name: api_values[index] - db_values[index] for index, name in enumerate(METRICS)
+                    })
+                    continue
+                # Шаг 3: строки только бакетов с расхождением
+                mismatched += 1
+                buckets_mismatched += len(bad_buckets)
+                for bucket in bad_buckets:
+                    clickids_mismatched += self._compare_players(
+                        key, api_buckets.get(bucket, {}), self._db_players(key, bucket)
+                    )
+
+        logger.info(
+            f"Сверка {self.account_id} {from_date} - {to_date}: дат {len(set(api_totals) | set(db_totals))}, "
+            f"детализировано {len(suspicious)}, с расхождениями {mismatched}, "
+            f"clickid {len(self.mismatches) - mismatches_before}"
+        )
+        row = {
+            'account_id': self.account_id,
+            'month': from_date.strftime('%Y-%m'),
+            'dates': len(set(api_totals) | set(db_totals)),
+            'drilled': len(suspicious),
+            'mismatched': mismatched,
+            'buckets': buckets_mismatched,
+            'clickids': clickids_mismatched,
+            'api_requests': self.api_requests - requests_before,
+            'status': 'РАСХОЖДЕНИЯ' if mismatched else 'OK',
+        }
+        for index, name in enumerate(METRICS):
+            row[f"diff_{name}"] = diff[index]
+        return row
+
+
+def _months(from_date: date, to_date: date) -> List[Tuple[date, date]]:
+    """Периоды внутри месяцев: [(начало, конец), ...]"""
+    months = []
+    month = from_date.replace(day=1)
+    while month <= to_date:
+        months.append((max(month, from_date), min(_month_end(month), to_date)))
+        month = _shift_month(month, 1)
+    return months
+
+
+def reconcile(db: Database, period: Period, db_columns: List[str], details: bool = False) -> Report:
+    """
+    Сверка БД с API по всем аккаунтам (или period.account_id) и месяцам периода
+
+    Args:
+        db: Подключение к БД
+        period: Период и аккаунт
+        db_columns: Колонки fact_click_month
+        details: Строки отчета - расхождения по clickid, а не итоги по месяцам
+    """
+    if 'account_id' not in db_columns:
+        raise ValueError("В fact_click_month нет колонки account_id, сверка по аккаунтам недоступна")
+    accounts = [(f"account_{i}", account) for i, account in enumerate(get_affilka_accounts(), 1)]
+    if period.account_id:
+        accounts = [item for item in accounts if item[0] == period.account_id]
+        if not accounts:
+            raise ValueError(f"Нет аккаунта {period.account_id}")
+    if not accounts:
+        raise ValueError("Не настроены аккаунты API")
+
+    rows: List[Dict[str, Any]] = []
+    mismatches: List[Dict[str, Any]] = []
+    rejected = 0
+    failed = False
+    for account_id, account in accounts:
+        reconciler = AccountReconciler(db, db_columns, account_id, AffilkaAPI(account['token'], account['url']))
+        for month_from, month_to in _months(period.from_date, period.to_date):
+            try:
+                row = reconciler.check_month(month_from, month_to)
+            except RuntimeError as e:
+                logger.error(f"Сверка {account_id} за {month_from:%Y-%m}: {e}")
+                row = {'account_id': account_id, 'month': month_from.strftime('%Y-%m'), 'status': 'ОШИБКА',
+                       'api_requests': reconciler.api_requests}
+            failed = failed or row['status'] != 'OK'
+            rows.append(row)
+        mismatches.extend(reconciler.mismatches)
+        rejected += reconciler.rejected
+
+    def notes(_totals: Dict[str, float], _count: int) -> List[str]:
+        lines = [f"Аккаунтов: {len(accounts)}, месяцев с расхождениями: "
+                 f"{sum(row['status'] != 'OK' for row in rows)} из {len(rows)}"]
+        if rejected:
+            lines.append(f"Строк API без clickid / даты в детализации (не загружаются ETL): {rejected:,}")
+        if not details:
+            for item in mismatches[:MAX_EXAMPLES]:
+                metrics = ', '.join(f"{name} {item[f'diff_{name}']:+.2f}" for name in METRICS
+                                    if abs(item[f'diff_{name}']) >= VERIFY_TOLERANCE)
+                lines.append(f"  {item['account_id']} {item['period_date']} {item['clickid']}: {item['issue']}"
+                             f"{' (' + metrics + ')' if metrics else ''}")
+            if len(mismatches) > MAX_EXAMPLES:
+                lines.append(f"  ... еще {len(mismatches) - MAX_EXAMPLES:,} (все - с --details)")
+        return lines
+
+    if details:
+        return Report(f"Расхождения БД и API по clickid за {period}", DETAIL_COLUMNS, mismatches,
+                      totals=True, notes=notes, ok=not failed)
+    return Report(f"Сверка БД с API за {period}", MONTH_COLUMNS, rows, totals=True, notes=notes, ok=not failed)
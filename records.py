@@ -0,0 +1,182 @@
+"""
+Компактное представление строк отчета в цепочке parse -> transform -> load
+
+ClickRecord - класс со __slots__: без словаря атрибутов на каждый объект,
+поэтому строка занимает в несколько раз меньше памяти, чем dict с теми же полями.
+Для совместимости с кодом, который работает со строками как со словарями
+(upsert_fact_click_month, диагностические скрипты), поддерживаются
+record['ftd'], record.get('ftd'), 'ftd' in record, keys() и items().
+
+Поля ответа API, которые не маппятся в fact_click_month, сохраняются в debug
+(ключи с префиксом '_', как раньше в словаре строки) только если явно включен
+AFFILKA_KEEP_DEBUG_FIELDS или передан keep_debug_fields=True.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from clickid_codes import get_clickid_table
+from reject_sink import RejectSink
+
+# Поля записи в порядке колонок fact_click_month
+RECORD_FIELDS = ('period_date', 'clickid', 'ftd', 'dep_cnt', 'dep_sum', 'ngr', 'cpa')
+
+# Метрики, которые суммируются при группировке (ftd - флаг, берется максимум)
+SUM_METRICS = ('dep_cnt', 'dep_sum', 'ngr', 'cpa')
+
+_MISSING = object()
+
+
+class ClickRecord:
+    """Строка отчета / группа (period_date, clickid) с метриками"""
+
+    __slots__ = RECORD_FIELDS + ('debug',)
+
+    def __init__(
+        self,
+        period_date=None,
+        clickid=None,
+        ftd: float = 0.0,
+        dep_cnt: float = 0.0,
+        dep_sum: float = 0.0,
+        ngr: float = 0.0,
+        cpa: float = 0.0,
+        debug: Optional[Dict[str, Any]] = None
+    ):
+        self.period_date = period_date
+        self.clickid = clickid
+        self.ftd = ftd
+        self.dep_cnt = dep_cnt
+        self.dep_sum = dep_sum
+        self.ngr = ngr
+        self.cpa = cpa
+        self.debug = debug
+
+    def __getitem__(self, key: str) -> Any:
+        if key in RECORD_FIELDS:
+            return getattr(self, key)
+        if self.debug is not None and key in self.debug:
+            return self.debug[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in RECORD_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.debug is None:
+                self.debug = {}
+            self.debug[key] = value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self[key] if key in self else _MISSING
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: str) -> bool:
+        return key in RECORD_FIELDS or (self.debug is not None and key in self.debug)
+
+    def keys(self) -> Iterator[str]:
+        yield from RECORD_FIELDS
+        if self.debug:
+            yield from self.debug
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for key in self.keys():
+            yield key, self[key]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Запись как dict (например, для вывода в JSON)"""
+        return dict(self.items())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ClickRecord):
+            return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ClickRecord({', '.join(f'{key}={value!r}' for key, value in self.items())})"
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+
+def add_into(group: ClickRecord, row: ClickRecord):
+    """Добавляет метрики row в group: FTD - флаг (максимум), остальные метрики суммируются"""
+    if row.ftd > group.ftd:
+        group.ftd = row.ftd
+    group.dep_cnt += row.dep_cnt
+    group.dep_sum += row.dep_sum
+    group.ngr += row.ngr
+    group.cpa += row.cpa
+
+
+def aggregate_records(rows: Iterable[ClickRecord], rejects: Optional[RejectSink] = None) -> List[ClickRecord]:
+    """
+    Группирует строки по (period_date, нормализованный clickid) и агрегирует метрики
+
+    clickid кодируются в общей таблице строк (clickid_codes): ключи группировки -
+    маленькие int, а нормализация выполняется один раз на каждое различное значение.
+
+    Args:
+        rows: Строки отчета
+        rejects: Учет пропущенных строк; если не передан, итог пишется в лог в конце агрегации
+
+    Returns:
+        Новые записи-группы с нормализованным clickid
+    """
+    owns_rejects = rejects is None
+    if owns_rejects:
+        rejects = RejectSink('transform')
+    table = get_clickid_table()
+    grouped = {}
+
+    with table.lock:
+        table.reset_if_full()
+        encode = table.encode
+        for row in rows:
+            code = encode(row.clickid)
+            if code is None:
+                rejects.reject('invalid_clickid', row)
+                continue
+
+            period_date = row.period_date
+            if not period_date:
+                rejects.reject('missing_period_date', row)
+                continue
+
+            key = (period_date, code)
+            group = grouped.get(key)
+            if group is None:
+                grouped[key] = ClickRecord(period_date, code, max(row.ftd, 0.0), row.dep_cnt, row.dep_sum, row.ngr, row.cpa)
+            else:
+                add_into(group, row)
+
+        # Возвращаем коды в строки clickid
+        groups = list(grouped.values())
+        decode = table.decode
+        for group in groups:
+            group.clickid = decode(group.clickid)
+    if owns_rejects:
+        rejects.summary()
+    return groups
+
+
+def merge_records(partials: Iterable[List[ClickRecord]]) -> List[ClickRecord]:
+    """
+    Объединяет частичные агрегаты (результаты aggregate_records по частям отчета)
+
+    Семантика та же, что у aggregate_records: FTD - максимум, остальные метрики - сумма.
+    Записи первой части переиспользуются, порядок групп - по первому появлению.
+    """
+    merged: Dict[Tuple[Any, str], ClickRecord] = {}
+    for part in partials:
+        for record in part:
+            key = (record.period_date, record.clickid)
+            group = merged.get(key)
+            if group is None:
+                merged[key] = record
+            else:
+                add_into(group, record)
+    return list(merged.values())
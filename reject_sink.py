@@ -0,0 +1,119 @@
+"""
+Учет пропущенных строк (reject sink) вместо предупреждения в лог на каждую строку
+
+На отчетах, где у многих строк нет visit_id, форматирование строки в лог на
+каждую пропущенную запись становится узким местом и засоряет логи. Вместо этого
+каждая стадия (parse, transform) собирает:
+- счетчики по причинам пропуска;
+- первые REJECT_MAX_EXAMPLES примеров по каждой причине (попадают в итоговую строку лога);
+- выборку пропущенных строк (каждая 1/REJECT_SAMPLE_RATE-я) в файл JSON lines
+  в REJECT_SINK_DIR, не больше REJECT_MAX_FILE_ROWS строк на файл.
+
+Итог по стадии пишется в лог один раз (summary).
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config import REJECT_SINK_DIR, REJECT_SAMPLE_RATE, REJECT_MAX_EXAMPLES, REJECT_MAX_FILE_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Количество строк, уже записанных в каждый файл выборки (общий для всех стадий процесса)
+_file_rows: Dict[str, int] = {}
+_file_lock = threading.Lock()
+
+
+def _serializable(row: Any) -> Any:
+    if hasattr(row, 'to_dict'):
+        return row.to_dict()
+    return row
+
+
+class RejectSink:
+    """Счетчики, примеры и выборка пропущенных строк одной стадии"""
+
+    def __init__(
+        self,
+        stage: str,
+        account_id: Optional[str] = None,
+        directory: Optional[str] = None,
+        sample_rate: Optional[float] = None,
+        max_examples: Optional[int] = None
+    ):
+        """
+        Args:
+            stage: Название стадии (parse, transform, ...)
+            account_id: Аккаунт (для файла выборки и лога)
+            directory: Каталог для файла выборки (по умолчанию REJECT_SINK_DIR, пусто - без файла)
+            sample_rate: Доля пропущенных строк, записываемых в файл (по умолчанию REJECT_SAMPLE_RATE)
+            max_examples: Количество первых примеров на причину (по умолчанию REJECT_MAX_EXAMPLES)
+        """
+        self.stage = stage
+        self.account_id = account_id
+        self.directory = REJECT_SINK_DIR if directory is None else directory
+        sample_rate = REJECT_SAMPLE_RATE if sample_rate is None else sample_rate
+        # Записываем каждую N-ю строку: дешевле, чем random() на каждую строку
+        self.sample_every = int(round(1 / sample_rate)) if sample_rate and sample_rate > 0 else 0
+        self.max_examples = REJECT_MAX_EXAMPLES if max_examples is None else max_examples
+        self.counts: Dict[str, int] = {}
+        self.examples: Dict[str, List[Any]] = {}
+        self.total = 0
+
+    def reject(self, reason: str, row: Any):
+        """Учитывает пропущенную строку (сама строка сериализуется только для примеров и выборки)"""
+        self.total += 1
+        count = self.counts.get(reason, 0) + 1
+        self.counts[reason] = count
+        if count <= self.max_examples:
+            self.examples.setdefault(reason, []).append(_serializable(row))
+        if self.sample_every and (count - 1) % self.sample_every == 0 and self.directory:
+            self._write_sample(reason, row)
+
+    def _file_path(self) -> str:
+        name = f"rejects_{datetime.now().strftime('%Y%m%d')}_{self.stage}_{os.getpid()}.jsonl"
+        return os.path.join(self.directory, name)
+
+    def _write_sample(self, reason: str, row: Any):
+        path = self._file_path()
+        with _file_lock:
+            written = _file_rows.get(path, 0)
+            if written >= REJECT_MAX_FILE_ROWS:
+                return
+            _file_rows[path] = written + 1
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({
+                        'at': datetime.now().isoformat(timespec='seconds'),
+                        'stage': self.stage,
+                        'account_id': self.account_id,
+                        'reason': reason,
+                        'row': _serializable(row),
+                    }, ensure_ascii=False, default=str))
+                    f.write('\n')
+            except OSError as e:
+                # Выборка - вспомогательная, не должна ломать ETL
+                logger.debug(f"Не удалось записать пропущенную строку в {path}: {e}")
+
+    def merge(self, other: 'RejectSink'):
+        """Добавляет счетчики и примеры другой стадии/части (например, из дочернего процесса)"""
+        self.total += other.total
+        for reason, count in other.counts.items():
+            self.counts[reason] = self.counts.get(reason, 0) + count
+            examples = self.examples.setdefault(reason, [])
+            examples.extend(other.examples.get(reason, [])[:max(0, self.max_examples - len(examples))])
+
+    def summary(self, level: int = logging.WARNING):
+        """Пишет в лог итог по стадии (одна строка), если были пропуски"""
+        if not self.total:
+            return
+        prefix = f"[{self.account_id}] " if self.account_id else ''
+        reasons = ', '.join(f"{reason}: {count}" for reason, count in sorted(self.counts.items(), key=lambda x: -x[1]))
+        examples = '; '.join(
+            f"{reason}: {json.dumps(rows[0], ensure_ascii=False, default=str)[:300]}"
+            for reason, rows in self.examples.items() if rows
+        )
+        logger.log(level, f"{prefix}{self.stage}: пропущено {self.total} строк ({reasons}). Примеры: {examples}")
@@ -0,0 +1,262 @@
+"""
+Replay: пересборка fact_click_month из сохраненных ответов API (raw_store) без обращения к API
+
+Используется после изменения логики трансформации (нормализация clickid, обработка FTD и т.п.),
+чтобы пересчитать историю. Файлы парсятся и трансформируются параллельно в пуле процессов,
+загрузка в БД идет в основном процессе по мере готовности результатов.
+
+Дочерний процесс читает файл потоково и группирует строки в SpillingAggregator
+(лимит памяти ETL_AGG_MAX_GROUPS), а группы передает основному процессу через
+временный файл: основной процесс загружает их пачками по ETL_LOAD_BATCH_SIZE
+в одной транзакции на файл, не держа в памяти весь результат.
+
+В той же транзакции перед загрузкой удаляются строки аккаунта за период файла:
+группы, которых после повторной трансформации больше нет (например, clickid
+после изменения нормализации), не остаются в fact_click_month. Группы вне
+периода replay (--from-date / --to-date) не загружаются.
+"""
+import os
+import shutil
+import logging
+import tempfile
+from datetime import date, timedelta
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from affilka_api import parse_report_rows
+from external_agg import SpillingAggregator, batched, read_records, write_records
+from parallel_parse import PARSE_CHUNK_ROWS
+from reject_sink import RejectSink
+from raw_store import RawStore, group_by_key
+from database import Database
+from config import DEFAULT_REPORT_GROUP_BY, AFFILKA_KEEP_DEBUG_FIELDS, ETL_AGG_SPILL_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def _period_start(day: date, group_by: List[str]) -> date:
+    """Начало периода группировки, в который попадает день (period_date строк ответа)"""
+    if 'year' in group_by:
+        return day.replace(month=1, day=1)
+    if 'month' in group_by:
+        return day.replace(day=1)
+    if 'week' in group_by:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _replay_file(
+    path: str,
+    account_id: str,
+    groups_path: str,
+    period_from: date,
+    period_to: date,
+    root: Optional[str] = None
+) -> Tuple[int, int]:
+    """
+    Парсит и трансформирует один файл хранилища (выполняется в дочернем процессе)
+
+    Только парсинг и агрегация, без AffilkaETL: дочернему процессу не нужны
+    HTTP-транспорт, подключение к БД и метрики запуска.
+
+    Args:
+        path: Файл хранилища
+        account_id: Аккаунт (для учета пропущенных строк)
+        groups_path: Файл, в который пишутся группы (period_date, clickid)
+        period_from: Первая загружаемая period_date (группы раньше нее отбрасываются)
+        period_to: Последняя загружаемая period_date (группы позже нее отбрасываются)
+        root: Каталог хранилища
+
+    Returns:
+        Кортеж (количество строк в ответе, количество групп в периоде)
+    """
+    rows = RawStore(root=root).iter_rows(path)
+    row_count = 0
+    with SpillingAggregator(rejects=RejectSink('transform', account_id)) as aggregator:
+        while True:
+            chunk = list(islice(rows, PARSE_CHUNK_ROWS))
+            if not chunk:
+                break
+            row_count += len(chunk)
+            aggregator.add(parse_report_rows(chunk, AFFILKA_KEEP_DEBUG_FIELDS))
+            del chunk
+        group_count = write_records(
+            groups_path, (r for r in aggregator if period_from <= r.period_date <= period_to)
+        )
+    return row_count, group_count
+
+
+def select_partitions(
+    store: RawStore,
+    account_ids: Optional[List[str]],
+    from_date: Optional[str],
+    to_date: Optional[str],
+    group_by: Optional[List[str]] = None,
+    conversion_currency: Optional[str] = 'EUR'
+) -> List[Dict[str, Any]]:
+    """
+    Выбирает файлы хранилища для replay
+
+    Берутся только ответы с той же группировкой и валютой, что использует ETL,
+    чтобы ответы диагностических скриптов не попали в fact_click_month.
+    Если один период полностью покрыт более свежим ответом за более широкий период
+    (например, 01-01..01-15 и позже 01-01..01-31), берется только более свежий.
+    Из нескольких ответов за один период (другой URL API после смены порядка
+    аккаунтов, другие колонки) берется самый свежий.
+    Результат упорядочен так, что более поздние ответы загружаются последними.
+    """
+    group_by = group_by or DEFAULT_REPORT_GROUP_BY
+    partitions = []
+    for account_id in account_ids or [None]:
+        for partition in store.list_partitions(account_id, from_date, to_date, group_by):
+            meta = store.read_header(partition['path']).get('meta', {})
+            if conversion_currency and meta.get('conversion_currency') != conversion_currency:
+                continue
+            partitions.append(partition)
+
+    def newer(other: Dict[str, Any], partition: Dict[str, Any]) -> bool:
+        if other['mtime'] != partition['mtime']:
+            return other['mtime'] > partition['mtime']
+        same_period = (other['from_date'], other['to_date']) == (partition['from_date'], partition['to_date'])
+        return not same_period or other['path'] > partition['path']
+
+    selected = []
+    for partition in partitions:
+        dominated = any(
+            other is not partition
+            and other['account_id'] == partition['account_id']
+            and other['from_date'] <= partition['from_date']
+            and other['to_date'] >= partition['to_date']
+            and newer(other, partition)
+            for other in partitions
+        )
+        if not dominated:
+            selected.append(partition)
+
+    return sorted(selected, key=lambda p: (p['to_date'], p['mtime']))
+
+
+def replay(
+    account_ids: Optional[List[str]] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    group_by: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    dry_run: bool = False,
+    enrich: bool = True,
+    root: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Пересобирает fact_click_month из сохраненных ответов API
+
+    Args:
+        account_ids: Аккаунты (account_1, ...); по умолчанию все, что есть в хранилище
+        from_date: Начальная дата (YYYY-MM-DD), по умолчанию без ограничения
+        to_date: Конечная дата (YYYY-MM-DD), по умолчанию без ограничения
+        group_by: Группировка ответов для replay (по умолчанию DEFAULT_REPORT_GROUP_BY)
+        workers: Количество процессов для парсинга (по умолчанию - число CPU)
+        dry_run: Только распарсить и трансформировать, без записи в БД
+        enrich: Выполнить обогащение из Keitaro после загрузки
+        root: Каталог хранилища (по умолчанию RAW_STORE_DIR)
+
+    Returns:
+        Статистика: files, rows, loaded, deleted (строки, удаленные перед загрузкой)
+    """
+    store = RawStore(root=root)
+    partitions = select_partitions(store, account_ids, from_date, to_date, group_by)
+    stats = {'files': 0, 'rows': 0, 'loaded': 0, 'deleted': 0}
+    loaded_accounts = set()
+
+    if not partitions:
+        logger.warning(
+            f"В хранилище {store.root} нет ответов для replay "
+            f"(аккаунты: {account_ids or 'все'}, период: {from_date or '...'} - {to_date or '...'}, "
+            f"group_by: {group_by_key(group_by or DEFAULT_REPORT_GROUP_BY)})"
+        )
+        return stats
+
+    logger.info(f"Replay: {len(partitions)} файлов, процессов: {workers or 'по числу CPU'}")
+
+    db = None
+    if not dry_run:
+        db = Database()
+        if not db.connect():
+            raise RuntimeError("Не удалось подключиться к БД")
+
+    workers = workers or os.cpu_count() or 1
+    group_by = group_by or DEFAULT_REPORT_GROUP_BY
+    # Период replay в масштабе period_date: при группировке по месяцу --from-date 2025-01-15
+    # оставляет группы января (period_date = 2025-01-01)
+    window_from = _period_start(date.fromisoformat(from_date), group_by) if from_date else date.min
+    window_to = date.fromisoformat(to_date) if to_date else date.max
+    tmp_dir = tempfile.mkdtemp(prefix='etl_replay_', dir=ETL_AGG_SPILL_DIR or None)
+
+    def submit(executor, index: int, partition: Dict[str, Any]):
+        groups_path = os.path.join(tmp_dir, f"{index:05d}.jsonl")
+        # Период файла в масштабе period_date, обрезанный периодом replay
+        period_from = max(_period_start(date.fromisoformat(partition['from_date']), group_by), window_from)
+        period_to = min(date.fromisoformat(partition['to_date']), window_to)
+        future = executor.submit(
+            _replay_file, partition['path'], partition['account_id'], groups_path, period_from, period_to, root
+        )
+        return partition, groups_path, period_from, period_to, future
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # В работе не больше workers файлов: результаты не копятся в основном процессе,
+            # пока загрузка в БД отстает от парсинга. Результаты забираются по порядку,
+            # поэтому более свежие ответы загружаются последними
+            pending = deque()
+            queued = enumerate(partitions)
+            for index, partition in queued:
+                pending.append(submit(executor, index, partition))
+                if len(pending) >= workers:
+                    break
+            while pending:
+                partition, groups_path, period_from, period_to, future = pending.popleft()
+                row_count, group_count = future.result()
+                queued_next = next(queued, None)
+                if queued_next is not None:
+                    pending.append(submit(executor, *queued_next))
+                stats['files'] += 1
+                stats['rows'] += row_count
+                logger.info(
+                    f"[{partition['account_id']} {partition['from_date']} - {partition['to_date']}] "
+                    f"{row_count} строк -> {group_count} групп"
+                )
+                if db is not None:
+                    # Период файла заменяется целиком или никак, как и окно обычного запуска
+                    db.begin()
+                    try:
+                        deleted = db.delete_fact_click_month(
+                            partition['account_id'], period_from, period_to, commit=False
+                        )
+                        for batch in batched(read_records(groups_path)):
+                            db.upsert_fact_click_month(batch, account_id=partition['account_id'], commit=False)
+                        db.commit()
+                    except BaseException:
+                        db.rollback()
+                        raise
+                    stats['loaded'] += group_count
+                    stats['deleted'] += deleted
+                    loaded_accounts.add(partition['account_id'])
+                os.remove(groups_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if db is not None:
+            db.disconnect()
+
+    if not dry_run:
+        from etl_process import enrich_all_accounts, refresh_rollups
+        period_from = from_date or min(p['from_date'] for p in partitions)
+        period_to = to_date or max(p['to_date'] for p in partitions)
+        enriched = enrich_all_accounts(period_from, period_to) if enrich else 0
+        refresh_rollups(period_from, period_to, None if enriched else sorted(loaded_accounts))
+
+    logger.info(
+        f"Replay завершен: файлов {stats['files']}, строк {stats['rows']}, "
+        f"загружено {stats['loaded']} записей (удалено перед загрузкой {stats['deleted']})"
+        f"{' (dry run)' if dry_run else ''}"
+    )
+    return stats
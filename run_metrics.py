@@ -0,0 +1,383 @@
+"""
+Метрики стадий ETL и отчет о запуске
+
+Каждая стадия (extract, parse, load, enrich, ...) выполняется внутри
+RunMetrics.stage(), который замеряет:
+- wall - время выполнения стадии;
+- cpu - процессорное время потока стадии; для стадии parse, которая запускает пул
+  параллельного парсинга, - плюс время дочерних процессов этого пула (add_children_cpu);
+- rows_in / rows_out - строк на входе и выходе стадии;
+- bytes - байт скачано из API (до распаковки);
+- db_rows - строк затронуто в БД (rowcount MySQL: 1 - вставка, 2 - обновление);
+- process_peak_rss - пиковый RSS всего процесса с его запуска (ru_maxrss), снятый
+  при завершении стадии: это не потребление самой стадии, рост значения лишь
+  показывает, что новый пик процесса пришелся на эту стадию или параллельную ей;
+- error - класс исключения, если стадия завершилась ошибкой.
+
+По завершении запуска (finish) пишутся:
+- JSON-отчет <ETL_METRICS_DIR>/run_<run_id>.json;
+- textfile в формате Prometheus (ETL_METRICS_TEXTFILE, для textfile collector node_exporter);
+- метрики в Prometheus Pushgateway (ETL_METRICS_PUSHGATEWAY);
+- запуск и все стадии в таблицы etl_runs / etl_run_stages (ETL_RUNS_LEDGER),
+  по которым main.py stats считает p50/p95 длительностей.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import requests
+from profiling import profile_stage
+from config import ETL_METRICS_DIR, ETL_METRICS_TEXTFILE, ETL_METRICS_PUSHGATEWAY, ETL_RUNS_LEDGER
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Счетчики стадии, которые суммируются в отчете и экспортируются в Prometheus
+STAGE_COUNTERS = ('wall', 'cpu', 'rows_in', 'rows_out', 'bytes', 'db_rows')
+
+PROMETHEUS_PREFIX = 'affilka_etl'
+PUSHGATEWAY_JOB = 'affilka_etl'
+
+_version: Optional[str] = None
+
+
+def run_version() -> str:
+    """
+    Версия кода для отчета о запуске
+
+    На Railway - RAILWAY_GIT_COMMIT_SHA, иначе короткий хеш текущего коммита git
+    (с пометкой -dirty при незакоммиченных изменениях), иначе 'unknown'.
+    """
+    global _version
+    if _version is not None:
+        return _version
+    version = os.getenv('ETL_VERSION') or os.getenv('RAILWAY_GIT_COMMIT_SHA', '')[:12]
+    if not version:
+        try:
+            cwd = os.path.dirname(os.path.abspath(__file__))
+            version = subprocess.run(
+                ['git', 'describe', '--always', '--dirty'], cwd=cwd,
+                capture_output=True, text=True, timeout=5
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            version = ''
+    _version = version or 'unknown'
+    return _version
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Пиковый RSS текущего процесса с его запуска в байтах (None, если недоступно)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def children_cpu_seconds() -> float:
+    """Процессорное время завершившихся дочерних процессов"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+# CPU дочерних процессов, учтенное в текущем потоке
+_thread_children = threading.local()
+
+
+def add_children_cpu(seconds: float):
+    """
+    Относит CPU дочерних процессов к стадии, выполняемой в текущем потоке
+
+    Вызывает владелец пула процессов (parallel_parse) после его завершения:
+    RUSAGE_CHILDREN общий для процесса, и без этого CPU пула попадал бы
+    в любые стадии, открытые в это время в других потоках конвейера.
+    """
+    _thread_children.seconds = thread_children_cpu() + seconds
+
+
+def thread_children_cpu() -> float:
+    """CPU дочерних процессов, отнесенный к текущему потоку (add_children_cpu)"""
+    return getattr(_thread_children, 'seconds', 0.0)
+
+
+class StageMetrics:
+    """Замеры одной стадии для одного аккаунта"""
+
+    def __init__(self, stage: str, account_id: Optional[str] = None):
+        self.stage = stage
+        self.account_id = account_id
+        self.started_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.status = 'ok'
+        self.error: Optional[str] = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes = 0
+        self.db_rows = 0
+        self.process_peak_rss = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stage': self.stage,
+            'account_id': self.account_id,
+            'started_at': self.started_at.isoformat(timespec='milliseconds'),
+            'finished_at': self.finished_at.isoformat(timespec='milliseconds') if self.finished_at else None,
+            'status': self.status,
+            'error': self.error,
+            'wall': round(self.wall, 3),
+            'cpu': round(self.cpu, 3),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes': self.bytes,
+            'db_rows': self.db_rows,
+            'process_peak_rss': self.process_peak_rss,
+        }
+
+
+class RunMetrics:
+    """Метрики одного запуска ETL (все аккаунты и стадии); потокобезопасен для конвейерного режима"""
+
+    def __init__(self, mode: str = 'once', run_id: Optional[str] = None):
+        """
+        Args:
+            mode: Режим запуска (once, pipeline, serve) - попадает в отчет и метки Prometheus
+            run_id: Идентификатор запуска (по умолчанию время старта и pid)
+        """
+        self.mode = mode
+        self.started_at = datetime.now()
+        self.run_id = run_id or f"{self.started_at:%Y%m%d_%H%M%S}_{os.getpid()}"
+        self.stages: List[StageMetrics] = []
+        self._lock = threading.Lock()
+        self._wall_started = time.perf_counter()
+        self._cpu_started = time.process_time() + children_cpu_seconds()
+
+    @contextmanager
+    def stage(self, name: str, account_id: Optional[str] = None) -> Iterator[StageMetrics]:
+        """
+        Замеряет стадию; счетчики строк и байт заполняются внутри блока
+
+        Пример:
+            with metrics.stage('parse', account_id) as stage:
+                stage.rows_in = len(rows)
+                ...
+        """
+        stage = StageMetrics(name, account_id)
+        wall_started = time.perf_counter()
+        # CPU потока, а не процесса: в конвейере стадии выполняются параллельно в разных потоках
+        cpu_started = time.thread_time() + thread_children_cpu()
+        try:
+            # При включенном --profile стадия профилируется отдельно (артефакт на аккаунт и стадию)
+            with profile_stage(name, account_id):
+                yield stage
+        except BaseException as e:
+            stage.status = 'error'
+            stage.error = type(e).__name__
+            raise
+        finally:
+            stage.finished_at = datetime.now()
+            stage.wall = time.perf_counter() - wall_started
+            stage.cpu = time.thread_time() + thread_children_cpu() - cpu_started
+            stage.process_peak_rss = peak_rss_bytes()
+            with self._lock:
+                self.stages.append(stage)
+            parts = [f"{stage.wall:.2f} сек", f"CPU {stage.cpu:.2f} сек"]
+            if stage.rows_in or stage.rows_out:
+                parts.append(f"строк {stage.rows_in} -> {stage.rows_out}")
+            if stage.bytes:
+                parts.append(f"скачано {stage.bytes / 1024:.1f} KB")
+            if stage.db_rows:
+                parts.append(f"в БД {stage.db_rows}")
+            prefix = f"[{account_id}] " if account_id else ''
+            logger.info(f"{prefix}Стадия {name}: {', '.join(parts)}" + (' (ошибка)' if stage.status != 'ok' else ''))
+
+    def totals(self) -> Dict[Tuple[str, Optional[str]], Dict[str, float]]:
+        """Суммы счетчиков по (стадия, аккаунт)"""
+        totals: Dict[Tuple[str, Optional[str]], Dict[str, float]] = {}
+        with self._lock:
+            stages = list(self.stages)
+        for stage in stages:
+            total = totals.setdefault((stage.stage, stage.account_id), {key: 0 for key in STAGE_COUNTERS + ('count', 'errors')})
+            for key in STAGE_COUNTERS:
+                total[key] += getattr(stage, key)
+            total['count'] += 1
+            total['errors'] += stage.status != 'ok'
+        return totals
+
+    def report(self, success: bool = True, error: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Отчет о запуске (JSON-совместимый dict)
+
+        Args:
+            success: Успешно ли завершился запуск
+            error: Класс ошибки запуска (по умолчанию - ошибка первой упавшей стадии)
+        """
+        with self._lock:
+            stages = [stage.to_dict() for stage in self.stages]
+        if error is None:
+            error = next((stage['error'] for stage in stages if stage['error']), None)
+        by_stage: Dict[str, Dict[str, float]] = {}
+        for (name, _account_id), total in self.totals().items():
+            summary = by_stage.setdefault(name, {key: 0 for key in STAGE_COUNTERS + ('count', 'errors')})
+            for key, value in total.items():
+                summary[key] += value
+        for summary in by_stage.values():
+            summary['wall'] = round(summary['wall'], 3)
+            summary['cpu'] = round(summary['cpu'], 3)
+        return {
+            'run_id': self.run_id,
+            'mode': self.mode,
+            'version': run_version(),
+            'success': success,
+            'error': error,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'wall': round(time.perf_counter() - self._wall_started, 3),
+            'cpu': round(time.process_time() + children_cpu_seconds() - self._cpu_started, 3),
+            'peak_rss': peak_rss_bytes(),
+            'totals': by_stage,
+            'stages': stages,
+        }
+
+    def prometheus_text(self, report: Optional[Dict[str, Any]] = None) -> str:
+        """Метрики запуска в текстовом формате Prometheus"""
+        report = report or self.report()
+        mode = _label(self.mode)
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{labels}}} {value}")
+
+        metric('run_success', 'gauge', 'Last run finished successfully (1) or not (0)',
+               [(f'mode="{mode}"', int(bool(report['success'])))])
+        metric('run_timestamp_seconds', 'gauge', 'Unix time the last run finished',
+               [(f'mode="{mode}"', round(time.time(), 3))])
+        metric('run_duration_seconds', 'gauge', 'Wall time of the last run',
+               [(f'mode="{mode}"', report['wall'])])
+        metric('run_cpu_seconds', 'gauge', 'CPU time of the last run (including child processes)',
+               [(f'mode="{mode}"', report['cpu'])])
+        if report['peak_rss'] is not None:
+            metric('run_peak_rss_bytes', 'gauge', 'Peak resident set size of the ETL process',
+                   [(f'mode="{mode}"', report['peak_rss'])])
+
+        stage_metrics = (
+            ('wall', 'stage_duration_seconds', 'Wall time per stage and account'),
+            ('cpu', 'stage_cpu_seconds', 'CPU time per stage and account'),
+            ('rows_in', 'stage_rows_in', 'Rows entering the stage'),
+            ('rows_out', 'stage_rows_out', 'Rows produced by the stage'),
+            ('bytes', 'stage_bytes_downloaded', 'Bytes downloaded from the API (on the wire)'),
+            ('db_rows', 'stage_db_rows_affected', 'Rows affected in the database'),
+            ('errors', 'stage_errors', 'Failed stage executions'),
+        )
+        totals = sorted(self.totals().items(), key=lambda item: (item[0][0], item[0][1] or ''))
+        for key, name, help_text in stage_metrics:
+            samples = [
+                (f'mode="{mode}",stage="{_label(stage)}",account_id="{_label(account_id or "")}"', round(total[key], 3))
+                for (stage, account_id), total in totals
+            ]
+            if samples:
+                metric(name, 'gauge', help_text, samples)
+        return '\n'.join(lines) + '\n'
+
+    def finish(self, success: bool = True, error: Optional[str] = None, pool=None) -> Dict[str, Any]:
+        """
+        Завершает запуск: пишет JSON-отчет, textfile Prometheus, отправляет метрики в Pushgateway
+        и сохраняет запуск в etl_runs / etl_run_stages
+
+        Ошибки записи метрик не прерывают ETL (пишутся в лог).
+
+        Args:
+            success: Успешно ли завершился запуск
+            error: Класс ошибки запуска (по умолчанию - ошибка первой упавшей стадии)
+            pool: Пул соединений с БД для записи в etl_runs (опционально)
+
+        Returns:
+            Отчет о запуске
+        """
+        report = self.report(success, error)
+        self._log_summary(report)
+        if ETL_METRICS_DIR:
+            path = os.path.join(ETL_METRICS_DIR, f"run_{self.run_id}.json")
+            try:
+                _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2, default=str))
+                logger.info(f"Отчет о запуске сохранен: {path}")
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить отчет о запуске {path}: {e}")
+        if ETL_METRICS_TEXTFILE or ETL_METRICS_PUSHGATEWAY:
+            text = self.prometheus_text(report)
+            if ETL_METRICS_TEXTFILE:
+                try:
+                    _write_atomic(ETL_METRICS_TEXTFILE, text)
+                except OSError as e:
+                    logger.warning(f"Не удалось записать метрики в {ETL_METRICS_TEXTFILE}: {e}")
+            if ETL_METRICS_PUSHGATEWAY:
+                self.push(text)
+        if ETL_RUNS_LEDGER:
+            self.save(report, pool)
+        return report
+
+    def save(self, report: Dict[str, Any], pool=None):
+        """Сохраняет запуск и его стадии в etl_runs / etl_run_stages"""
+        from database import Database
+        try:
+            with Database(pool) as db:
+                if db.cursor:
+                    db.record_run(report)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить запуск {self.run_id} в etl_runs: {e}")
+
+    def push(self, text: str):
+        """Отправляет метрики в Pushgateway (группа job/instance заменяется целиком)"""
+        url = f"{ETL_METRICS_PUSHGATEWAY.rstrip('/')}/metrics/job/{PUSHGATEWAY_JOB}/instance/{self.mode}"
+        try:
+            response = requests.put(url, data=text.encode('utf-8'),
+                                    headers={'Content-Type': 'text/plain; version=0.0.4'}, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Не удалось отправить метрики в Pushgateway ({url}): {e}")
+
+    def _log_summary(self, report: Dict[str, Any]):
+        peak_rss = report['peak_rss']
+        logger.info(
+            f"Запуск {self.run_id}: {report['wall']:.1f} сек, CPU {report['cpu']:.1f} сек"
+            + (f", пиковый RSS процесса {peak_rss / 1024 / 1024:.0f} MB" if peak_rss is not None else '')
+        )
+        for name, total in report['totals'].items():
+            logger.info(
+                f"  {name:<10} {total['wall']:>9.2f} сек  CPU {total['cpu']:>9.2f} сек  "
+                f"строк {int(total['rows_in'])} -> {int(total['rows_out'])}  "
+                f"скачано {total['bytes'] / 1024 / 1024:.1f} MB  в БД {int(total['db_rows'])}"
+                + (f"  ошибок {int(total['errors'])}" if total['errors'] else '')
+            )
+
+
+def _label(value: str) -> str:
+    """Экранирует значение метки Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path: str, text: str):
+    """Пишет файл через временный файл, чтобы читатель (node_exporter) не увидел его наполовину записанным"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
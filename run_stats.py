@@ -0,0 +1,102 @@
+"""
+Статистика длительностей стадий по истории запусков (main.py stats)
+
+Читает etl_run_stages за последние N дней и выводит p50/p95 длительности
+по каждой стадии и по каждой паре (стадия, аккаунт), а также медианный объем
+скачанных данных и количество ошибок. Позволяет заметить постепенное замедление
+отдельной стадии или API конкретного аккаунта.
+"""
+import math
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль с линейной интерполяцией (как numpy.percentile по умолчанию), q - от 0 до 100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def stage_stats(rows: Iterable[Dict[str, Any]], by_account: bool = False) -> List[Dict[str, Any]]:
+    """
+    Сводка по стадиям
+
+    Args:
+        rows: Строки etl_run_stages (Database.get_run_stages())
+        by_account: Группировать по (стадия, аккаунт), иначе только по стадии
+
+    Returns:
+        Список словарей: stage, account_id, runs, errors, p50, p95, max, p50_mb, last_version
+    """
+    groups: Dict[Tuple[str, Optional[str]], List[Dict[str, Any]]] = {}
+    for row in rows:
+        key = (row['stage'], row['account_id'] if by_account else None)
+        groups.setdefault(key, []).append(row)
+
+    stats = []
+    for (stage, account_id), stage_rows in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        durations = [float(row['duration_sec']) for row in stage_rows if row['status'] == 'ok']
+        megabytes = [row['api_bytes'] / 1024 / 1024 for row in stage_rows if row['api_bytes']]
+        stats.append({
+            'stage': stage,
+            'account_id': account_id,
+            'runs': len(stage_rows),
+            'errors': sum(1 for row in stage_rows if row['status'] != 'ok'),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'max': max(durations) if durations else None,
+            'p50_mb': percentile(megabytes, 50),
+            'last_version': stage_rows[-1].get('version'),
+        })
+    return stats
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value:.1f}"
+
+
+def print_stats(stats: List[Dict[str, Any]], title: str):
+    """Выводит таблицу сводки по стадиям"""
+    print(f"\n{title}")
+    print(f"{'стадия':<12} {'аккаунт':<14} {'запусков':>9} {'ошибок':>7} {'p50, с':>9} {'p95, с':>9} "
+          f"{'max, с':>9} {'p50, MB':>9}  версия")
+    for item in stats:
+        print(
+            f"{item['stage']:<12} {item['account_id'] or '*':<14} {item['runs']:>9} {item['errors']:>7} "
+            f"{_format_seconds(item['p50']):>9} {_format_seconds(item['p95']):>9} {_format_seconds(item['max']):>9} "
+            f"{'-' if item['p50_mb'] is None else format(item['p50_mb'], '.1f'):>9}  {item['last_version'] or '-'}"
+        )
+
+
+def show_stats(days: int = 30, account_id: Optional[str] = None) -> bool:
+    """
+    Выводит p50/p95 длительностей по стадиям и по аккаунтам за последние days дней
+
+    Returns:
+        True, если история запусков найдена
+    """
+    with Database() as db:
+        if not db.cursor:
+            logger.error("Не удалось подключиться к БД")
+            return False
+        rows = db.get_run_stages(days, account_id)
+
+    if not rows:
+        print(f"Нет запусков за последние {days} дн. в etl_run_stages")
+        return False
+
+    runs = len({row['run_id'] for row in rows})
+    print(f"За последние {days} дн.: {runs} запусков, {len(rows)} стадий")
+    print_stats(stage_stats(rows), 'По стадиям')
+    print_stats(stage_stats(rows, by_account=True), 'По стадиям и аккаунтам')
+    return True
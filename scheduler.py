@@ -0,0 +1,252 @@
+"""
+Долгоживущий режим ETL (main.py serve)
+
+Процесс остается запущенным, держит "теплые" HTTP-сессии к Affilka и пул
+соединений с БД, и запускает ETL по внутреннему расписанию. Для каждого
+аккаунта можно задать свое расписание (AFFILKA_SCHEDULE_N / AFFILKA_SCHEDULE_N_M):
+интервал ("15m", "1h", "1d") или cron-выражение ("*/15 * * * *").
+"""
+import re
+import time
+import signal
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Set
+from config import get_affilka_accounts, ETL_SCHEDULE, DEFAULT_REPORT_COLUMNS, DEFAULT_REPORT_GROUP_BY
+from database import Database, create_connection_pool
+from etl_process import create_account_etls, enrich_all_accounts, refresh_rollups, current_month_range
+from raw_store import purge_raw_store
+from clickid_codes import reset_clickid_table
+from run_metrics import RunMetrics
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class IntervalSchedule:
+    """Расписание с фиксированным интервалом между запусками"""
+
+    def __init__(self, seconds: int):
+        if seconds <= 0:
+            raise ValueError("Интервал расписания должен быть больше нуля")
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Возвращает время следующего запуска после moment"""
+        return moment + timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return f"IntervalSchedule({self.seconds}s)"
+
+
+class CronSchedule:
+    """
+    Расписание в формате cron (5 полей: минута, час, день месяца, месяц, день недели)
+
+    Поддерживаются '*', списки (1,15), диапазоны (1-5) и шаги (*/15, 0-30/10).
+    День недели: 0-6, где 0 (или 7) - воскресенье.
+    """
+
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron-выражение должно содержать 5 полей: {expression}")
+        self.expression = expression
+        fields = [self._parse_field(part, lo, hi) for part, (lo, hi) in zip(parts, self.FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        # 7 - тоже воскресенье
+        self.weekdays = {0 if d == 7 else d for d in weekdays}
+        self.days_restricted = parts[2] != '*'
+        self.weekdays_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(field: str, lo: int, hi: int) -> Set[int]:
+        values = set()
+        for item in field.split(','):
+            step = 1
+            if '/' in item:
+                item, step_str = item.split('/', 1)
+                step = int(step_str)
+                if step <= 0:
+                    raise ValueError(f"Некорректный шаг в cron-выражении: {field}")
+            if item == '*':
+                start, end = lo, hi
+            elif '-' in item:
+                start_str, end_str = item.split('-', 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = int(item)
+                end = hi if step > 1 else start
+            if start < lo or end > hi or start > end:
+                raise ValueError(f"Значение вне диапазона {lo}-{hi} в cron-выражении: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        # cron: weekday 0 = воскресенье, в Python weekday() 0 = понедельник
+        weekday = (moment.weekday() + 1) % 7
+        day_ok = moment.day in self.days
+        weekday_ok = weekday in self.weekdays
+        # Стандартная семантика cron: если ограничены оба поля, достаточно совпадения любого
+        if self.days_restricted and self.weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Возвращает время следующего запуска строго после moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron-выражение никогда не срабатывает: {self.expression}")
+
+    def __repr__(self):
+        return f"CronSchedule('{self.expression}')"
+
+
+def parse_schedule(spec: Optional[str]):
+    """
+    Парсит расписание из строки
+
+    Args:
+        spec: Интервал ("30s", "15m", "1h", "1d", можно с префиксом "every ")
+              или cron-выражение из 5 полей
+
+    Returns:
+        IntervalSchedule или CronSchedule
+    """
+    spec = (spec or ETL_SCHEDULE).strip()
+    match = re.fullmatch(r'(?:every\s+)?(\d+)\s*([smhd])', spec, re.IGNORECASE)
+    if match:
+        return IntervalSchedule(int(match.group(1)) * INTERVAL_UNITS[match.group(2).lower()])
+    return CronSchedule(spec)
+
+
+class ETLScheduler:
+    """Планировщик для долгоживущего режима: держит ETL-экземпляры и пул соединений между запусками"""
+
+    def __init__(
+        self,
+        accounts: Optional[List[Dict[str, str]]] = None,
+        columns: Optional[List[str]] = None,
+        group_by: Optional[List[str]] = None,
+        default_schedule: Optional[str] = None,
+        run_on_start: bool = True
+    ):
+        """
+        Args:
+            accounts: Список аккаунтов (по умолчанию из get_affilka_accounts())
+            columns: Список колонок для запроса
+            group_by: Список полей для группировки
+            default_schedule: Расписание для аккаунтов без собственного расписания
+            run_on_start: Запустить все аккаунты сразу после старта
+        """
+        self.accounts = accounts if accounts is not None else get_affilka_accounts()
+        self.columns = columns or DEFAULT_REPORT_COLUMNS
+        self.group_by = group_by or DEFAULT_REPORT_GROUP_BY
+        self.pool = create_connection_pool()
+        self.etls = create_account_etls(self.accounts, pool=self.pool)
+        self.schedules = [
+            parse_schedule(account.get('schedule') or default_schedule)
+            for account in self.accounts
+        ]
+        now = datetime.now()
+        self.next_runs = [
+            now if run_on_start else schedule.next_after(now)
+            for schedule in self.schedules
+        ]
+        self._stop = threading.Event()
+
+    def stop(self, *_args):
+        """Останавливает планировщик после завершения текущего запуска"""
+        logger.info("Получен сигнал остановки, завершаем работу после текущего запуска")
+        self._stop.set()
+
+    def _record_account_run(self, etl, success: bool, duration: float):
+        """Сохраняет результат и длительность обработки аккаунта (как process_all_accounts)"""
+        try:
+            with Database(self.pool) as state_db:
+                if state_db.cursor:
+                    state_db.record_account_run(etl.account_id, success, duration if success else None, base_url=etl.base_url)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние аккаунта {etl.account_id}: {e}")
+
+    def run_due(self, now: datetime) -> int:
+        """
+        Запускает ETL для всех аккаунтов, у которых наступило время запуска
+
+        Returns:
+            Количество запущенных аккаунтов
+        """
+        due = [i for i, next_run in enumerate(self.next_runs) if next_run <= now]
+        if not due:
+            return 0
+
+        from_date, to_date = current_month_range()
+        logger.info(f"Запуск ETL для {len(due)} аккаунт(ов), период: {from_date} - {to_date}")
+
+        # Отдельный отчет о запуске на каждое срабатывание расписания
+        metrics = RunMetrics('serve')
+        success = True
+        processed = []
+        enriched = 0
+        for i in due:
+            etl = self.etls[i]
+            etl.metrics = metrics
+            processed.append(etl.account_id)
+            started = time.monotonic()
+            account_success = False
+            try:
+                account_success = etl.process_date_range(from_date, to_date, self.columns, self.group_by)
+                enriched += etl.enriched_rows
+            except Exception as e:
+                logger.error(f"Ошибка при обработке аккаунта {etl.account_id} ({etl.base_url}): {e}", exc_info=True)
+            success = success and account_success
+            self._record_account_run(etl, account_success, time.monotonic() - started)
+            # Следующий запуск считаем от момента завершения, чтобы долгие запуски не накапливались
+            self.next_runs[i] = self.schedules[i].next_after(datetime.now())
+            logger.info(f"Следующий запуск {etl.account_id}: {self.next_runs[i]:%Y-%m-%d %H:%M:%S}")
+            if self._stop.is_set():
+                break
+
+        enriched += enrich_all_accounts(from_date, to_date, pool=self.pool, metrics=metrics)
+        refresh_rollups(from_date, to_date, None if enriched else processed, pool=self.pool, metrics=metrics)
+        purge_raw_store()
+        reset_clickid_table()
+        metrics.finish(success=success, pool=self.pool)
+        return len(due)
+
+    def serve_forever(self):
+        """Основной цикл: ждет ближайший запуск и выполняет ETL для наступивших аккаунтов"""
+        if not self.accounts:
+            logger.error("Не найдено ни одного аккаунта в конфигурации. Проверьте переменные окружения.")
+            return
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        logger.info(f"Режим serve: {len(self.accounts)} аккаунт(ов)")
+        for etl, schedule in zip(self.etls, self.schedules):
+            logger.info(f"  - {etl.account_id} ({etl.base_url}): {schedule}")
+
+        while not self._stop.is_set():
+            self.run_due(datetime.now())
+            wait_seconds = max(0.0, (min(self.next_runs) - datetime.now()).total_seconds())
+            if wait_seconds > 0:
+                logger.debug(f"Ожидание следующего запуска: {wait_seconds:.0f} сек")
+                self._stop.wait(wait_seconds)
+
+        logger.info("Режим serve остановлен")
@@ -0,0 +1,106 @@
+"""
+Генератор синтетических отчетов в формате Affilka API
+
+Отчет имеет ту же форму, что и ответ /partner/report: rows.data - список строк,
+каждая строка - список объектов {name, value, type}, денежные поля - объекты
+{amount, currency}. Используется в бенчмарках (bench_etl.py, bench_json_decode.py,
+bench_row_memory.py) вместо запросов к живому API.
+
+Использование:
+    python synthetic_report.py --rows 100000 -o report.json
+    python synthetic_report.py --rows 1000000 --clickids 200000 --null-rate 0.05 --days 90 -o big.json
+"""
+import json
+import random
+import argparse
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+# Поле clickid, которое группирует ETL (см. DEFAULT_REPORT_GROUP_BY)
+CLICKID_FIELD = 'dynamic_tag_visit_id'
+
+
+def generate_report(
+    rows: int = 100000,
+    clickids: Optional[int] = None,
+    null_rate: float = 0.0,
+    days: int = 28,
+    start_date: str = '2026-01-01',
+    currency: str = 'EUR',
+    extra_fields: int = 0,
+    seed: int = 42
+) -> Dict[str, Any]:
+    """
+    Синтетический отчет Affilka
+
+    Args:
+        rows: Количество строк в rows.data
+        clickids: Количество различных clickid (по умолчанию rows // 3 + 1, т.е. в среднем 3 строки на clickid)
+        null_rate: Доля строк с пустым clickid (null) - такие строки ETL пропускает
+        days: Количество дней, по которым распределены строки, начиная с start_date
+        start_date: Первая дата периода (YYYY-MM-DD)
+        currency: Валюта денежных полей
+        extra_fields: Количество дополнительных полей без маппинга в каждой строке
+        seed: Зерно генератора (одинаковые параметры - одинаковый отчет)
+
+    Returns:
+        Отчет: {'report_type': 'partner', 'rows': {'data': [...]}}
+    """
+    rnd = random.Random(seed)
+    clickids = clickids or rows // 3 + 1
+    start = date.fromisoformat(start_date)
+    dates = [f"{start + timedelta(days=offset)}T00:00:00Z" for offset in range(max(days, 1))]
+    data = []
+    for i in range(rows):
+        period = dates[rnd.randint(0, len(dates) - 1)]
+        clickid = f"v{rnd.randint(0, clickids - 1):08x}"
+        # random() только при null_rate > 0: при null_rate = 0 последовательность не меняется
+        if null_rate > 0 and rnd.random() < null_rate:
+            clickid = None
+        row = [
+            {'name': 'date', 'value': period, 'type': 'date'},
+            {'name': CLICKID_FIELD, 'value': clickid, 'type': 'string'},
+            {'name': 'first_deposits_count', 'value': rnd.randint(0, 1), 'type': 'integer'},
+            {'name': 'deposits_count', 'value': rnd.randint(0, 5), 'type': 'integer'},
+            {'name': 'deposits_sum', 'value': {'amount': f"{rnd.uniform(0, 500):.2f}", 'currency': currency}, 'type': 'money'},
+            {'name': 'partner_income', 'value': {'amount': f"{rnd.uniform(0, 100):.2f}", 'currency': currency}, 'type': 'money'},
+            {'name': 'ngr', 'value': {'amount': f"{rnd.uniform(-50, 300):.2f}", 'currency': currency}, 'type': 'money'},
+        ]
+        for j in range(extra_fields):
+            row.append({'name': f'extra_{j}', 'value': i % 97, 'type': 'integer'})
+        data.append(row)
+    return {'report_type': 'partner', 'rows': {'data': data}}
+
+
+def generate_payload(rows: int = 100000, **kwargs) -> bytes:
+    """Синтетический отчет как тело ответа API (JSON, UTF-8); параметры - как у generate_report"""
+    return json.dumps(generate_report(rows, **kwargs)).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетический отчет в формате Affilka API')
+    parser.add_argument('--rows', type=int, default=100000, help='Количество строк (по умолчанию 100000)')
+    parser.add_argument('--clickids', type=int, default=None,
+                        help='Количество различных clickid (по умолчанию rows / 3)')
+    parser.add_argument('--null-rate', type=float, default=0.0, help='Доля строк без clickid (0..1)')
+    parser.add_argument('--days', type=int, default=28, help='Количество дней в периоде (по умолчанию 28)')
+    parser.add_argument('--start-date', type=str, default='2026-01-01', help='Первая дата периода')
+    parser.add_argument('--extra-fields', type=int, default=0, help='Дополнительные поля без маппинга в строке')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Файл для отчета (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    payload = generate_payload(
+        args.rows, clickids=args.clickids, null_rate=args.null_rate, days=args.days,
+        start_date=args.start_date, extra_fields=args.extra_fields, seed=args.seed
+    )
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(payload)
+        print(f"Сохранено {args.rows:,} строк ({len(payload) / 1024 / 1024:.1f} MB) в {args.output}")
+    else:
+        print(payload.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    main()
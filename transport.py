@@ -0,0 +1,474 @@
+"""
+HTTP-транспорт для Affilka API
+
+Два варианта:
+- RequestsTransport (по умолчанию) - requests.Session с настроенным пулом соединений,
+  таймаутами, повторами и сжатием ответов;
+- HttpxTransport - httpx.Client с HTTP/2 (AFFILKA_HTTP2): несколько отчетов к одному хосту
+  идут по одному соединению. Нужен пакет httpx[http2], иначе используется RequestsTransport.
+
+Для каждого запроса замеряется, куда уходит время: DNS, TCP-подключение, TLS,
+ожидание первого байта (TTFB - в основном расчет отчета на стороне API) и скачивание тела,
+а также размер ответа до и после распаковки. Замеры пишутся в лог и доступны
+в transport.last_timing / transport.timings; transport.bytes_received - сколько байт
+скачано в текущем потоке (для метрик стадии extract).
+"""
+import abc
+import time
+import socket
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from config import (
+    AFFILKA_HTTP_CONNECT_TIMEOUT, AFFILKA_HTTP_READ_TIMEOUT, AFFILKA_HTTP_POOL_SIZE,
+    AFFILKA_HTTP_RETRIES, AFFILKA_HTTP_BACKOFF, AFFILKA_HTTP_COMPRESSION,
+    AFFILKA_HTTP2, AFFILKA_HTTP_VERSION_HEADER,
+)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import brotli  # noqa: F401 - urllib3/httpx распаковывают br, если пакет установлен
+    BROTLI_AVAILABLE = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        BROTLI_AVAILABLE = True
+    except ImportError:
+        BROTLI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, при которых запрос повторяется (с учетом Retry-After)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Максимальная пауза между повторами по коду ответа, секунд (как urllib3 Retry.DEFAULT_BACKOFF_MAX)
+BACKOFF_MAX = 120
+
+# Сколько последних замеров хранить в transport.timings
+TIMINGS_HISTORY = 100
+
+# Замер текущего запроса (заполняется соединениями urllib3 в том же потоке)
+_current = threading.local()
+
+
+def accept_encoding(compression: bool = True) -> str:
+    """Значение заголовка Accept-Encoding"""
+    if not compression:
+        return 'identity'
+    return 'gzip, deflate, br' if BROTLI_AVAILABLE else 'gzip, deflate'
+
+
+def _timing() -> Optional[Dict[str, Any]]:
+    return getattr(_current, 'timing', None)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Пауза из заголовка Retry-After (секунды или HTTP-дата) или None"""
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+def format_timing(timing: Dict[str, Any]) -> str:
+    """Строка с замером запроса для лога"""
+    parts = [
+        f"{timing.get('method', 'GET')} {timing.get('host')}: {timing.get('status')}",
+        timing.get('http_version') or '',
+        'повторное соединение' if timing.get('reused') else
+        f"dns {_ms(timing.get('dns'))}, connect {_ms(timing.get('connect'))}, tls {_ms(timing.get('tls'))}",
+        f"ttfb {_ms(timing.get('ttfb'))}",
+        f"download {_ms(timing.get('download'))}",
+        f"всего {_ms(timing.get('total'))}",
+    ]
+    size = timing.get('bytes')
+    if size is not None:
+        wire = timing.get('wire_bytes')
+        encoding = timing.get('content_encoding')
+        size_part = f"{size / 1024:.1f} KB"
+        if wire is not None and encoding:
+            size_part += f" ({encoding}: {wire / 1024:.1f} KB)"
+        parts.append(size_part)
+    return ', '.join(part for part in parts if part)
+
+
+class TransportResponse:
+    """
+    Ответ транспорта с интерфейсом, совместимым с requests.Response
+    (status_code, headers, content, text, url, json(), raise_for_status())
+    """
+
+    def __init__(self, status_code: int, headers, content: bytes, url: str,
+                 encoding: Optional[str] = None, timing: Optional[Dict[str, Any]] = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.encoding = encoding or 'utf-8'
+        self.timing = timing or {}
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        from affilka_api import json_loads
+        return json_loads(self.content)
+
+    def raise_for_status(self):
+        """Ошибка HTTP как requests.HTTPError, чтобы обработка ошибок не зависела от транспорта"""
+        if 400 <= self.status_code < 600:
+            kind = 'Client' if self.status_code < 500 else 'Server'
+            error = requests.exceptions.HTTPError(f"{self.status_code} {kind} Error for url: {self.url}")
+            error.response = self
+            raise error
+
+
+class _TimedConnectionMixin:
+    """Замер DNS, TCP-подключения, TLS и ожидания первого байта для соединения urllib3"""
+
+    def _new_conn(self):
+        timing = _timing()
+        if timing is None:
+            return super()._new_conn()
+        started = time.perf_counter()
+        try:
+            # Только замер: адрес не закрепляется, urllib3 сам перебирает все адреса
+            # хоста (IPv6 / IPv4). Повторный резолв обычно отвечает из кеша резолвера
+            socket.getaddrinfo(self._dns_host, self.port, type=socket.SOCK_STREAM)
+            timing['dns'] = time.perf_counter() - started
+        except OSError:
+            # Ошибку резолва пусть обработает urllib3 (NameResolutionError)
+            pass
+        connect_started = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            timing['connect'] = time.perf_counter() - connect_started
+
+    def connect(self):
+        timing = _timing()
+        if timing is None:
+            return super().connect()
+        started = time.perf_counter()
+        super().connect()
+        timing['reused'] = False
+        if isinstance(self, HTTPSConnection):
+            elapsed = time.perf_counter() - started
+            timing['tls'] = max(0.0, elapsed - timing.get('connect', 0.0))
+
+    def request(self, *args, **kwargs):
+        timing = _timing()
+        result = super().request(*args, **kwargs)
+        if timing is not None:
+            timing['sent_at'] = time.perf_counter()
+        return result
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timing = _timing()
+        if timing is not None and 'sent_at' in timing:
+            timing['ttfb'] = time.perf_counter() - timing['sent_at']
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, создающий соединения с замером времени"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+class BaseTransport(abc.ABC):
+    """Общая часть транспортов: заголовки, таймауты и история замеров"""
+
+    name = 'base'
+
+    def __init__(
+        self,
+        headers: Optional[Dict[str, str]] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        pool_size: Optional[int] = None,
+        retries: Optional[int] = None,
+        compression: Optional[bool] = None
+    ):
+        self.connect_timeout = AFFILKA_HTTP_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = AFFILKA_HTTP_READ_TIMEOUT if read_timeout is None else read_timeout
+        self.pool_size = pool_size or AFFILKA_HTTP_POOL_SIZE
+        self.retries = AFFILKA_HTTP_RETRIES if retries is None else retries
+        self.compression = AFFILKA_HTTP_COMPRESSION if compression is None else compression
+        self.headers = {'Accept-Encoding': accept_encoding(self.compression)}
+        if AFFILKA_HTTP_VERSION_HEADER:
+            self.headers['Version'] = AFFILKA_HTTP_VERSION_HEADER
+        self.headers.update(headers or {})
+        self.timings = deque(maxlen=TIMINGS_HISTORY)
+        self._timings_lock = threading.Lock()
+        # Замер последнего запроса в каждом потоке (fetchers конвейера работают параллельно)
+        self._last = threading.local()
+
+    @property
+    def last_timing(self) -> Optional[Dict[str, Any]]:
+        """Замер последнего запроса, выполненного в текущем потоке"""
+        return getattr(self._last, 'timing', None)
+
+    @property
+    def bytes_received(self) -> int:
+        """Байт скачано в текущем потоке за все время (до распаковки, если размер известен)"""
+        return getattr(self._last, 'bytes_received', 0)
+
+    def _record(self, timing: Dict[str, Any]):
+        timing.pop('sent_at', None)
+        self._last.timing = timing
+        received = timing.get('wire_bytes')
+        self._last.bytes_received = self.bytes_received + (timing.get('bytes', 0) if received is None else received)
+        with self._timings_lock:
+            self.timings.append(timing)
+        logger.info(f"HTTP {format_timing(timing)}")
+
+    @abc.abstractmethod
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+        """GET-запрос с замером времени"""
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(BaseTransport):
+    """Транспорт на requests (HTTP/1.1) с пулом соединений, повторами и замерами"""
+
+    name = 'requests'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,  # повтор после таймаута чтения заново запустит расчет тяжелого отчета
+            status=self.retries,
+            backoff_factor=AFFILKA_HTTP_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = TimedHTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+        timing = {'method': 'GET', 'host': urlsplit(url).netloc, 'reused': True, 'http_version': 'HTTP/1.1'}
+        _current.timing = timing
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                url, params=params, headers=headers, stream=True,
+                timeout=(self.connect_timeout, self.read_timeout),
+            )
+            download_started = time.perf_counter()
+            content = response.content
+            timing['download'] = time.perf_counter() - download_started
+        finally:
+            _current.timing = None
+        timing['total'] = time.perf_counter() - started
+        timing['status'] = response.status_code
+        timing['bytes'] = len(content)
+        timing['content_encoding'] = response.headers.get('Content-Encoding')
+        try:
+            # Байты, прочитанные из сокета (до распаковки)
+            timing['wire_bytes'] = response.raw.tell()
+        except (AttributeError, OSError):
+            timing['wire_bytes'] = None
+        self._record(timing)
+        return TransportResponse(
+            response.status_code, response.headers, content, response.url,
+            encoding=response.encoding, timing=timing
+        )
+
+    def close(self):
+        self.session.close()
+
+
+class HttpxTransport(BaseTransport):
+    """
+    Транспорт на httpx с HTTP/2: параллельные запросы к одному хосту мультиплексируются
+
+    retries у httpx.HTTPTransport повторяет только ошибки подключения, поэтому
+    повторы по кодам RETRY_STATUSES (с Retry-After и экспоненциальной паузой)
+    выполняются в get, как Retry в RequestsTransport.
+    """
+
+    name = 'httpx'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # http2 и limits задаются у транспорта: с явным transport= httpx.Client их игнорирует
+        self.client = httpx.Client(
+            headers=self.headers,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=self.retries,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            ),
+        )
+
+    @staticmethod
+    def _trace(timing: Dict[str, Any]):
+        """Обработчик событий httpcore: DNS в httpx входит в connect_tcp"""
+        started = {}
+
+        def trace(event_name: str, info: Dict[str, Any]):
+            now = time.perf_counter()
+            step = event_name.rsplit('.', 1)
+            if len(step) != 2:
+                return
+            name, state = step
+            started_at = started.pop(name, None) if state in ('complete', 'failed') else None
+            if state == 'started':
+                started[name] = now
+            elif started_at is not None:
+                if name.endswith('connect_tcp'):
+                    timing['connect'] = now - started_at
+                    timing['reused'] = False
+                elif name.endswith('start_tls'):
+                    timing['tls'] = now - started_at
+                elif name.endswith('send_request_body'):
+                    timing['sent_at'] = now
+                elif name.endswith('receive_response_headers') and 'sent_at' in timing:
+                    timing['ttfb'] = now - timing['sent_at']
+        return trace
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+        attempt = 0
+        while True:
+            response = self._get_once(url, params, headers)
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+            delay = retry_after_seconds(response.headers)
+            if delay is None:
+                delay = min(BACKOFF_MAX, AFFILKA_HTTP_BACKOFF * (2 ** attempt))
+            attempt += 1
+            logger.warning(
+                f"HTTP {response.status_code} от {urlsplit(url).netloc}, повтор {attempt}/{self.retries} "
+                f"через {delay:.1f} сек"
+            )
+            time.sleep(delay)
+
+    def _get_once(self, url: str, params: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> TransportResponse:
+        timing = {'method': 'GET', 'host': urlsplit(url).netloc, 'reused': True}
+        started = time.perf_counter()
+        try:
+            with self.client.stream(
+                'GET', url, params=params, headers=headers,
+                extensions={'trace': self._trace(timing)},
+            ) as response:
+                download_started = time.perf_counter()
+                content = response.read()
+                timing['download'] = time.perf_counter() - download_started
+                timing['wire_bytes'] = response.num_bytes_downloaded
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        timing['total'] = time.perf_counter() - started
+        timing['status'] = response.status_code
+        timing['http_version'] = response.http_version
+        timing['bytes'] = len(content)
+        timing['content_encoding'] = response.headers.get('Content-Encoding')
+        self._record(timing)
+        return TransportResponse(
+            response.status_code, response.headers, content, str(response.url),
+            encoding=response.encoding, timing=timing
+        )
+
+    def close(self):
+        self.client.close()
+
+
+def http2_available() -> bool:
+    """Установлен ли httpx с поддержкой HTTP/2 (пакет h2)"""
+    if httpx is None:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def create_transport(headers: Optional[Dict[str, str]] = None, http2: Optional[bool] = None, **kwargs) -> BaseTransport:
+    """
+    Создает транспорт для API
+
+    Args:
+        headers: Заголовки для всех запросов (авторизация и т.п.)
+        http2: Использовать HTTP/2 (по умолчанию AFFILKA_HTTP2)
+        **kwargs: connect_timeout, read_timeout, pool_size, retries, compression
+
+    Returns:
+        HttpxTransport, если запрошен HTTP/2 и установлен httpx[http2], иначе RequestsTransport
+    """
+    http2 = AFFILKA_HTTP2 if http2 is None else http2
+    if http2:
+        if http2_available():
+            return HttpxTransport(headers, **kwargs)
+        logger.warning("Для HTTP/2 нужен пакет httpx[http2], используем HTTP/1.1 (requests)")
+    return RequestsTransport(headers, **kwargs)
+